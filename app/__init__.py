@@ -12,6 +12,15 @@ def create_app():
                 static_folder='static')
     app.config.from_object(Config)
 
+    # Быстрая сериализация ответов API (orjson, если установлен)
+    from app.serializer import FastJSONProvider
+    app.json = FastJSONProvider(app)
+
+    # Адрес клиента из X-Forwarded-For при работе за обратным прокси (лимит проверок паролей)
+    if Config.PROXY_FIX_X_FOR > 0:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.PROXY_FIX_X_FOR)
+
     # Настройки cookie для совместимости с Chrome
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
     app.config['SESSION_COOKIE_SECURE'] = False  # Установите True при использовании HTTPS
@@ -21,13 +30,29 @@ def create_app():
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Пожалуйста, войдите в систему для доступа к этой странице'
 
-    app.config['UPLOAD_FOLDER'] = os.path.join(Config.BASE_DIR, 'uploads')
+    app.config['UPLOAD_FOLDER'] = Config.UPLOAD_PATH
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
     app.config['DATABASE_PATH'] = Config.DATABASE_PATH
 
     os.makedirs(app.config['DATABASE_PATH'], exist_ok=True)
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+    # Одно чтение и не более одной записи каждой коллекции за запрос
+    from app import unit_of_work
+    unit_of_work.init_app(app)
+
+    # Фоновая проверка целостности базы данных
+    from app import integrity
+    integrity.init_app(app)
+
+    # Фоновая очистка использованных и просроченных токенов приглашений
+    from app import tokens
+    tokens.init_app(app)
+
+    # События изменений коллекций, сделанных другими рабочими процессами
+    from app import changes
+    changes.init_app(app)
+
     from app.routes.auth import auth_bp
     from app.routes.dashboard import dashboard_bp
     from app.routes.projects import projects_bp
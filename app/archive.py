@@ -0,0 +1,372 @@
+"""
+archive.py - Архив завершенных проектов и задач
+
+Завершенные проекты и задачи, с даты окончания (завершения) которых прошло
+больше Config.ARCHIVE_AFTER_DAYS дней, переносятся из рабочих коллекций в
+сжатые файлы архива по годам: Config.ARCHIVE_PATH/projects-<год>.json.gz и
+tasks-<год>.json.gz. Задача архивируется целиком, вместе с дочерними
+списками (история, отчеты, файлы, подзадачи); проект - только когда в
+рабочих коллекциях не осталось его задач, поэтому задачи в работе никогда не
+ссылаются на архивный проект.
+
+Каталог архива (catalog.json) хранит для каждой записи год ее файла, поэтому
+поиск по id разбирает только один файл; для проектов в нем есть и
+руководители и команда, поэтому проекты пользователя (member_projects)
+читаются только из файлов их годов. Разобранные файлы кэшируются в
+процессе до изменения файла. Архив доступен только для чтения: карточка
+проекта, карточка задачи и отчеты читают его через app.utils (archived=True),
+а панель и списки задач работают только с рабочими коллекциями.
+
+Перенос выполняется под блокировками затронутых коллекций: сначала
+записываются файлы архива и каталог, затем записи удаляются из рабочих
+коллекций одной транзакцией. После сбоя между этими шагами запись есть в
+обеих копиях; рабочая копия имеет приоритет, а следующий перенос заменяет
+архивную.
+"""
+
+import gzip
+import os
+import re
+import threading
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from app import serializer, task_store
+from app.changes import change_bus
+from app.records import Record
+from app.storage import collection_cache, collection_locks, file_signature, freeze, thaw
+
+
+PROJECTS = 'projects'
+TASKS = 'tasks'
+
+# Статусы завершенных записей и поля, от которых отсчитывается возраст
+PROJECT_DONE = 'завершен'
+TASK_DONE = 'завершена'
+_AGE_FIELDS = {PROJECTS: 'end_date', TASKS: 'completion_date'}
+
+# Поля проекта, которые каталог хранит для выборки проектов пользователя
+OWNER_FIELDS = ('supervisor_id', 'manager_id', 'team')
+
+_FILE_RE = re.compile(r'^(projects|tasks)-(\d{4})\.json\.gz$')
+
+# Путь -> (сигнатура файла, разобранное содержимое)
+_cache: Dict[str, Tuple[Any, Any]] = {}
+_cache_lock = threading.Lock()
+
+
+class ArchiveResult:
+    """Итог переноса в архив"""
+
+    __slots__ = ('projects', 'tasks')
+
+    def __init__(self):
+        self.projects = 0
+        self.tasks = 0
+
+
+class _Catalog:
+    """Каталог архива: id записи -> год файла"""
+
+    __slots__ = ('projects', 'tasks', 'project_years')
+
+    def __init__(self, data: Any):
+        # id проекта -> {'year', 'supervisor_id', 'manager_id', 'team'}; в каталогах
+        # прежних версий - только год
+        self.projects: Dict[Any, Any] = {
+            project_id: entry if isinstance(entry, dict) else {'year': entry}
+            for project_id, entry in (data.get(PROJECTS) or {}).items()}
+        # id задачи -> {'year', 'project_id'}
+        self.tasks: Dict[Any, Any] = dict(data.get(TASKS) or {})
+        self.project_years: Dict[Any, List[int]] = {}
+        for entry in self.tasks.values():
+            years = self.project_years.setdefault(entry['project_id'], [])
+            if entry['year'] not in years:
+                years.append(entry['year'])
+        for years in self.project_years.values():
+            years.sort()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {PROJECTS: self.projects, TASKS: self.tasks}
+
+
+def archive_path(kind: str, year: int) -> str:
+    """Путь к файлу архива вида kind (projects, tasks) за год year"""
+    return os.path.join(Config.ARCHIVE_PATH, f"{kind}-{year}.json.gz")
+
+
+def catalog_path() -> str:
+    return os.path.join(Config.ARCHIVE_PATH, 'catalog.json')
+
+
+def archive_years(kind: str) -> List[int]:
+    """Годы, за которые есть файлы архива вида kind"""
+    try:
+        names = os.listdir(Config.ARCHIVE_PATH)
+    except FileNotFoundError:
+        return []
+    return sorted(int(m.group(2)) for m in map(_FILE_RE.match, names) if m and m.group(1) == kind)
+
+
+def _cached(path: str, parse) -> Any:
+    """Разобранное содержимое файла (None, если файла нет); перечитывается при изменении"""
+    signature = file_signature(path)
+    if signature is None:
+        return None
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(path, 'rb') as f:
+        value = parse(f.read())
+    with _cache_lock:
+        _cache[path] = (signature, value)
+    return value
+
+
+def _catalog() -> _Catalog:
+    return _cached(catalog_path(), lambda data: _Catalog(serializer.loads(data))) or _Catalog({})
+
+
+def _year_records(kind: str, year: int) -> Dict[Any, Any]:
+    """Записи файла архива: id -> запись (только для чтения) в порядке файла"""
+    records = _cached(archive_path(kind, year),
+                      lambda data: {r['id']: freeze(r) for r in serializer.loads(gzip.decompress(data))})
+    return records or {}
+
+
+def _live(kind: str, record_id: Any) -> bool:
+    """Запись есть в рабочих коллекциях (вернулась из архива или перенос прерван)"""
+    if kind == PROJECTS:
+        return collection_cache.index(Config.PROJECTS_DB).get(record_id) is not None
+    return task_store.task_shard(record_id) is not None
+
+
+def archived_ids(kind: str) -> Any:
+    """id записей вида kind в архиве (по каталогу)"""
+    catalog = _catalog()
+    return (catalog.projects if kind == PROJECTS else catalog.tasks).keys()
+
+
+def find_project(project_id: Any) -> Optional[Any]:
+    """Архивный проект по id (только для чтения)"""
+    entry = _catalog().projects.get(project_id)
+    return _year_records(PROJECTS, entry['year']).get(project_id) if entry is not None else None
+
+
+def find_task(task_id: Any) -> Optional[Any]:
+    """Архивная задача по id вместе с дочерними списками (только для чтения)"""
+    entry = _catalog().tasks.get(task_id)
+    return _year_records(TASKS, entry['year']).get(task_id) if entry is not None else None
+
+
+def project_tasks(project_id: Any) -> List[Any]:
+    """Архивные задачи проекта, которых нет в рабочих коллекциях"""
+    catalog = _catalog()
+    tasks = []
+    for year in catalog.project_years.get(project_id, ()):
+        tasks.extend(task for task in _year_records(TASKS, year).values()
+                     if catalog.tasks.get(task['id']) == {'year': year, 'project_id': project_id}
+                     and not _live(TASKS, task['id']))
+    return tasks
+
+
+def records(kind: str) -> Iterator[Any]:
+    """Все архивные записи вида kind по годам, кроме вернувшихся в рабочие коллекции"""
+    catalog = _catalog()
+    for year in archive_years(kind):
+        for record in _year_records(kind, year).values():
+            # Запись, перенесенная повторно с другой датой, учитывается только в файле из каталога
+            entry = (catalog.projects if kind == PROJECTS else catalog.tasks).get(record['id']) or {}
+            year_in_catalog = entry.get('year')
+            if year_in_catalog == year and not _live(kind, record['id']):
+                yield record
+
+
+def _member(entry: Any, field: str, user_id: Any) -> bool:
+    value = entry.get(field)
+    return user_id in (value or ()) if field == 'team' else value == user_id
+
+
+def member_projects(field: str, user_id: Any) -> List[Any]:
+    """
+    Архивные проекты, где user_id - значение поля field (supervisor_id,
+    manager_id) или участник команды (team)
+
+    Проекты выбираются по каталогу, поэтому разбираются только файлы годов,
+    в которых они есть. Проекты из каталогов прежних версий (без полей
+    OWNER_FIELDS) проверяются по самой записи.
+    """
+    years: Dict[int, set] = {}
+    for project_id, entry in _catalog().projects.items():
+        if field not in entry or _member(entry, field, user_id):
+            years.setdefault(entry['year'], set()).add(project_id)
+    projects = []
+    for year in sorted(years):
+        projects.extend(project for project in _year_records(PROJECTS, year).values()
+                        if project['id'] in years[year] and _member(project, field, user_id)
+                        and not _live(PROJECTS, project['id']))
+    return projects
+
+
+def scan(kind: str, *fields: str) -> Iterator[Dict[str, Any]]:
+    """Перебор архивных записей вида kind с выбором полей (как app.utils.scan_records)"""
+    return ({f: record[f] for f in fields if f in record} for record in records(kind))
+
+
+def _expired(record: Any, status: str, field: str, cutoff: date) -> Optional[date]:
+    """Дата окончания завершенной записи, если она не позже cutoff (иначе None)"""
+    if record.get('status') != status or not isinstance(record, Record):
+        return None
+    value = record.date(field)
+    return value if value is not None and value <= cutoff else None
+
+
+def _write_atomic(path: str, fill) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            fill(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _write_year(kind: str, year: int, added: List[dict]) -> None:
+    """Дописать записи в файл архива за год (записи с теми же id заменяются)"""
+    merged = {record_id: thaw(record) for record_id, record in _year_records(kind, year).items()}
+    merged.update((record['id'], record) for record in added)
+
+    def fill(f):
+        # mtime=0: одинаковое содержимое дает одинаковый файл
+        with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as archive:
+            serializer.dump_array(merged.values(), archive)
+
+    _write_atomic(archive_path(kind, year), fill)
+
+
+def _candidates(cutoff: date) -> List[Any]:
+    """Проекты, у которых могут быть записи для переноса (проверяются повторно под блокировками)"""
+    project_ids = []
+    for project in collection_cache.get(Config.PROJECTS_DB):
+        if _expired(project, PROJECT_DONE, _AGE_FIELDS[PROJECTS], cutoff):
+            project_ids.append(project['id'])
+    for project_id in dict.fromkeys(entry.get('project_id') for entry in task_store.manifest()):
+        if project_id not in project_ids and any(
+                _expired(task, TASK_DONE, _AGE_FIELDS[TASKS], cutoff)
+                for task in task_store.project_tasks(project_id)):
+            project_ids.append(project_id)
+    return project_ids
+
+
+def archive_completed(days: Optional[int] = None, today: Optional[date] = None) -> ArchiveResult:
+    """
+    Перенести в архив завершенные проекты и задачи старше days дней
+
+    Args:
+        days: Возраст записи в днях (по умолчанию Config.ARCHIVE_AFTER_DAYS)
+        today: Текущая дата (для проверок)
+
+    Returns:
+        Число перенесенных проектов и задач
+    """
+    days = Config.ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = (today or date.today()) - timedelta(days=days)
+    result = ArchiveResult()
+    task_store.ensure_sharded()
+
+    project_ids = _candidates(cutoff)
+    if not project_ids:
+        return result
+
+    paths = {Config.PROJECTS_DB, Config.TASK_MANIFEST_DB, catalog_path()}
+    for project_id in project_ids:
+        paths.add(task_store.shard_path(project_id))
+        paths.update(task_store.child_path(field, project_id) for field in task_store.CHILD_KINDS)
+
+    with collection_locks(paths):
+        changes: Dict[str, Tuple[List[Any], List[Any]]] = {}
+        added: Dict[Tuple[str, int], List[dict]] = {}
+        # Копия: кэшированный каталог не изменяется до записи файла
+        catalog = _Catalog(_catalog().to_dict())
+        drops = []
+
+        def delete(filepath, record_id):
+            changes.setdefault(filepath, ([], []))[1].append(record_id)
+
+        for project_id in project_ids:
+            shard = task_store.shard_path(project_id)
+            tasks = collection_cache.get(shard)
+            archived_tasks = 0
+            for task in tasks:
+                completed = _expired(task, TASK_DONE, _AGE_FIELDS[TASKS], cutoff)
+                if completed is None:
+                    continue
+                full = thaw(task)
+                for field in task_store.CHILD_KINDS:
+                    path = task_store.child_path(field, project_id)
+                    items = collection_cache.index(path).filter('task_id', task['id'])
+                    if items:
+                        full[field] = [thaw(item['data']) for item in items]
+                        for item in items:
+                            delete(path, item['id'])
+                added.setdefault((TASKS, completed.year), []).append(full)
+                catalog.tasks[task['id']] = {'year': completed.year, 'project_id': project_id}
+                delete(shard, task['id'])
+                delete(Config.TASK_MANIFEST_DB, task['id'])
+                archived_tasks += 1
+            result.tasks += archived_tasks
+
+            project = collection_cache.index(Config.PROJECTS_DB).get(project_id)
+            ended = _expired(project, PROJECT_DONE, _AGE_FIELDS[PROJECTS], cutoff) if project is not None else None
+            if ended is not None and archived_tasks == len(tasks):
+                project = thaw(project)
+                added.setdefault((PROJECTS, ended.year), []).append(project)
+                catalog.projects[project_id] = {'year': ended.year,
+                                                 **{f: project.get(f) for f in OWNER_FIELDS}}
+                delete(Config.PROJECTS_DB, project_id)
+                drops.append(shard)
+                drops.extend(task_store.child_path(field, project_id) for field in task_store.CHILD_KINDS)
+                result.projects += 1
+
+        if not changes:
+            return result
+
+        # Сначала архив и каталог, затем удаление из рабочих коллекций
+        for (kind, year), records_added in sorted(added.items()):
+            _write_year(kind, year, records_added)
+        _write_atomic(catalog_path(), lambda f: f.write(serializer.dumps(catalog.to_dict())))
+        collection_cache.save_transaction(changes)
+
+        backend = collection_cache.backend
+        for filepath in drops:
+            if backend.exists(filepath):
+                backend.drop(filepath)
+                collection_cache.invalidate(filepath)
+                change_bus.reset(filepath)
+
+    return result
+
+
+__all__ = [
+    'PROJECTS',
+    'TASKS',
+    'OWNER_FIELDS',
+    'ArchiveResult',
+    'archive_path',
+    'catalog_path',
+    'archive_years',
+    'archived_ids',
+    'find_project',
+    'find_task',
+    'project_tasks',
+    'records',
+    'member_projects',
+    'scan',
+    'archive_completed'
+]
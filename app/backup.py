@@ -0,0 +1,346 @@
+"""
+backup.py - Снимки базы данных и загруженных файлов на момент времени
+
+Каждый снимок - каталог Config.BACKUP_PATH/<время>/ с подкаталогами database/,
+archive/ (app.archive) и uploads/ и файлом manifest.json (сигнатуры исходных файлов). Файл, сигнатура
+которого (mtime, размер, inode) не изменилась с предыдущего снимка, не читается
+и не копируется, а становится жесткой ссылкой на копию из предыдущего снимка:
+неизмененные коллекции и загруженные файлы ничего не стоят ни по времени,
+ни по месту. Поскольку запись коллекции дописывает журнал, а снимок коллекции
+переписывается только при уплотнении, обычно копируются лишь журналы.
+
+Коллекции JSON копируются под разделяемыми блокировками всех коллекций,
+поэтому снимок согласован между коллекциями; база SQLite копируется через
+sqlite3 backup API.
+"""
+
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from app import archive, serializer
+from app.changes import change_bus
+from app.storage import collection_cache, collection_lock, collection_locks, file_signature
+
+
+MANIFEST = 'manifest.json'
+_TMP_SUFFIX = '.tmp'
+
+
+class BackupResult:
+    """Итог создания снимка"""
+
+    __slots__ = ('name', 'linked', 'copied', 'copied_bytes')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.linked = 0
+        self.copied = 0
+        self.copied_bytes = 0
+
+
+def _walk(root: str) -> Iterator[Tuple[str, str]]:
+    """Файлы каталога: (путь, путь относительно root)"""
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            yield path, os.path.relpath(path, root)
+
+
+def list_backups(backup_path: Optional[str] = None) -> List[str]:
+    """Имена завершенных снимков от старых к новым"""
+    backup_path = backup_path or Config.BACKUP_PATH
+    try:
+        names = os.listdir(backup_path)
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names if os.path.isfile(os.path.join(backup_path, n, MANIFEST)))
+
+
+def read_manifest(name: str, backup_path: Optional[str] = None) -> Dict[str, Any]:
+    """Манифест снимка"""
+    path = os.path.join(backup_path or Config.BACKUP_PATH, name, MANIFEST)
+    with open(path, 'rb') as f:
+        return serializer.loads(f.read())
+
+
+class _SnapshotWriter:
+    """Заполнение каталога нового снимка с переиспользованием предыдущего"""
+
+    def __init__(self, root: str, previous: Optional[str], result: BackupResult):
+        self.root = root
+        self.previous = previous
+        self.previous_files: Dict[str, Any] = {}
+        if previous is not None:
+            with open(os.path.join(previous, MANIFEST), 'rb') as f:
+                self.previous_files = serializer.loads(f.read())['files']
+        self.files: Dict[str, Any] = {}
+        self.result = result
+
+    def add(self, source: str, relpath: str) -> None:
+        """Добавить файл: жесткая ссылка на предыдущую копию или копирование"""
+        signature = file_signature(source)
+        if signature is None:
+            return
+        signature = list(signature)
+        target = os.path.join(self.root, relpath)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if self.previous_files.get(relpath) == signature:
+            try:
+                os.link(os.path.join(self.previous, relpath), target)
+                self.files[relpath] = signature
+                self.result.linked += 1
+                return
+            except OSError:
+                # Снимки на другой файловой системе или копия удалена - копируем
+                pass
+        shutil.copy2(source, target)
+        self.files[relpath] = signature
+        self.result.copied += 1
+        self.result.copied_bytes += signature[1]
+
+    def add_sqlite(self, db_path: str, relpath: str) -> None:
+        """Согласованная копия базы SQLite (backup API, не блокирует писателей надолго)"""
+        target = os.path.join(self.root, relpath)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        source = sqlite3.connect(db_path)
+        try:
+            destination = sqlite3.connect(target)
+            try:
+                source.backup(destination)
+            finally:
+                destination.close()
+        finally:
+            source.close()
+        signature = list(file_signature(target))
+        self.files[relpath] = signature
+        self.result.copied += 1
+        self.result.copied_bytes += signature[1]
+
+
+def _archive_files() -> List[Tuple[str, str]]:
+    """Файлы архива завершенных записей: (путь, путь относительно каталога архива)"""
+    if not os.path.isdir(Config.ARCHIVE_PATH):
+        return []
+    return [(path, relpath) for path, relpath in _walk(Config.ARCHIVE_PATH)
+            if not relpath.endswith(('.lock', _TMP_SUFFIX))]
+
+
+def _database_files(backend) -> Tuple[List[str], List[str]]:
+    """Коллекции базы данных и их файлы (снимки и журналы), существующие сейчас"""
+    from app.utils import database_collections
+
+    collections = database_collections(backend)
+    files = []
+    for filepath in collections:
+        for path in (filepath, backend.journal_path(filepath)):
+            if os.path.exists(path):
+                files.append(path)
+    return collections, files
+
+
+def create_backup(backup_path: Optional[str] = None, upload_path: Optional[str] = None,
+                  keep: Optional[int] = None) -> BackupResult:
+    """
+    Создать снимок базы данных и загруженных файлов
+
+    Args:
+        backup_path: Каталог снимков (по умолчанию Config.BACKUP_PATH)
+        upload_path: Каталог загруженных файлов (по умолчанию Config.UPLOAD_PATH)
+        keep: Сколько последних снимков оставить (по умолчанию Config.BACKUP_KEEP; 0 - все)
+
+    Returns:
+        Имя снимка и число связанных и скопированных файлов
+    """
+    backup_path = backup_path or Config.BACKUP_PATH
+    upload_path = upload_path or Config.UPLOAD_PATH
+    os.makedirs(backup_path, exist_ok=True)
+
+    name = datetime.now().strftime('%Y%m%d-%H%M%S')
+    suffix = 1
+    while os.path.exists(os.path.join(backup_path, name)):
+        suffix += 1
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{suffix}"
+    root = os.path.join(backup_path, name + _TMP_SUFFIX)
+
+    existing = list_backups(backup_path)
+    previous = os.path.join(backup_path, existing[-1]) if existing else None
+    result = BackupResult(name)
+    writer = _SnapshotWriter(root, previous, result)
+    backend = collection_cache.backend
+
+    try:
+        os.makedirs(root)
+        if backend.name == 'sqlite':
+            writer.add_sqlite(backend.db_path, os.path.join('database', os.path.basename(backend.db_path)))
+        else:
+            while True:
+                collections, _ = _database_files(backend)
+                with collection_locks(collections, exclusive=False):
+                    # Набор коллекций мог измениться до захвата блокировок (новый шард)
+                    current, files = _database_files(backend)
+                    if current != collections:
+                        continue
+                    for path in files:
+                        writer.add(path, os.path.join('database', os.path.relpath(path, Config.DATABASE_PATH)))
+                break
+
+        # Архив копируется после коллекций: запись, перенесенная в архив во время
+        # создания снимка, попадет хотя бы в одну из копий
+        with collection_lock(archive.catalog_path(), exclusive=False):
+            for path, relpath in _archive_files():
+                writer.add(path, os.path.join('archive', relpath))
+
+        if os.path.isdir(upload_path):
+            for path, relpath in _walk(upload_path):
+                writer.add(path, os.path.join('uploads', relpath))
+
+        manifest = {'created': datetime.now().strftime('%d.%m.%Y %H:%M:%S'), 'backend': backend.name,
+                    'files': writer.files}
+        with open(os.path.join(root, MANIFEST), 'wb') as f:
+            f.write(serializer.dumps(manifest, pretty=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(root, os.path.join(backup_path, name))
+    except BaseException:
+        shutil.rmtree(root, ignore_errors=True)
+        raise
+
+    prune_backups(Config.BACKUP_KEEP if keep is None else keep, backup_path)
+    return result
+
+
+def prune_backups(keep: int, backup_path: Optional[str] = None) -> List[str]:
+    """
+    Удалить старые снимки, оставив keep последних, и незавершенные каталоги
+
+    Файлы, на которые ссылаются оставшиеся снимки, при этом не удаляются
+    (жесткие ссылки), освобождается только место уникальных копий.
+
+    Returns:
+        Имена удаленных снимков
+    """
+    backup_path = backup_path or Config.BACKUP_PATH
+    if not os.path.isdir(backup_path):
+        return []
+    for name in os.listdir(backup_path):
+        if name.endswith(_TMP_SUFFIX):
+            shutil.rmtree(os.path.join(backup_path, name), ignore_errors=True)
+    if keep <= 0:
+        return []
+    removed = list_backups(backup_path)[:-keep]
+    for name in removed:
+        shutil.rmtree(os.path.join(backup_path, name), ignore_errors=True)
+    return removed
+
+
+def _restore_file(source: str, target: str) -> None:
+    """Атомарная замена файла копией из снимка (снимок не изменяется)"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_path = f"{target}.restore.{os.getpid()}"
+    try:
+        shutil.copy2(source, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def restore_backup(name: str, database: bool = True, uploads: bool = True,
+                   backup_path: Optional[str] = None, upload_path: Optional[str] = None) -> Dict[str, int]:
+    """
+    Восстановить базу данных и (или) загруженные файлы из снимка
+
+    Коллекции JSON (снимок и журнал из резервной копии) записываются заново
+    под исключительными блокировками всех коллекций;
+    коллекции, которых нет в снимке, удаляются вместе с журналами и
+    незавершенными транзакциями; архив завершенных записей заменяется архивом
+    снимка. Загруженные файлы восстанавливаются, если
+    отсутствуют или отличаются; файлы, загруженные после снимка, остаются.
+
+    Returns:
+        Число восстановленных файлов базы данных и загруженных файлов
+    """
+    backup_path = backup_path or Config.BACKUP_PATH
+    upload_path = upload_path or Config.UPLOAD_PATH
+    root = os.path.join(backup_path, name)
+    manifest = read_manifest(name, backup_path)
+    backend = collection_cache.backend
+    restored = {'database': 0, 'uploads': 0}
+
+    if database:
+        files = {relpath[len('database') + 1:]: signature for relpath, signature in manifest['files'].items()
+                 if relpath.startswith('database' + os.sep)}
+        if manifest['backend'] != backend.name:
+            raise ValueError(f"Снимок {name} сделан для бэкенда {manifest['backend']}, активен {backend.name}")
+        if backend.name == 'sqlite':
+            source = sqlite3.connect(os.path.join(root, 'database', os.path.basename(backend.db_path)))
+            try:
+                target = sqlite3.connect(backend.db_path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+            finally:
+                source.close()
+            restored['database'] = 1
+        else:
+            collections, current = _database_files(backend)
+            restored_collections = {os.path.join(Config.DATABASE_PATH, relpath[:-len('.journal')]
+                                                 if relpath.endswith('.journal') else relpath)
+                                    for relpath in files}
+            with collection_locks(set(collections) | restored_collections):
+                for filepath in sorted(restored_collections):
+                    relpath = os.path.relpath(filepath, Config.DATABASE_PATH)
+                    source = os.path.join(root, 'database', relpath)
+                    # Журнал в снимке относится к исходному файлу (сигнатура в манифесте),
+                    # а не к копии с другим inode - коллекция собирается и записывается целиком
+                    data = backend.read_files(source, backend.journal_path(source), files.get(relpath))
+                    backend.write(filepath, data)
+                    restored['database'] += 1
+                for filepath in collections:
+                    if filepath not in restored_collections:
+                        backend.drop(filepath)
+                # Транзакции относятся к заменяемому состоянию и не должны доигрываться
+                shutil.rmtree(Config.TRANSACTIONS_PATH, ignore_errors=True)
+
+        # Архив заменяется архивом снимка целиком
+        saved = {relpath[len('archive') + 1:] for relpath in manifest['files']
+                 if relpath.startswith('archive' + os.sep)}
+        with collection_lock(archive.catalog_path()):
+            for path, relpath in _archive_files():
+                if relpath not in saved:
+                    os.remove(path)
+            for relpath in sorted(saved):
+                _restore_file(os.path.join(root, 'archive', relpath), os.path.join(Config.ARCHIVE_PATH, relpath))
+                restored['database'] += 1
+        collection_cache.invalidate()
+        change_bus.reset()
+
+    if uploads:
+        for relpath, signature in manifest['files'].items():
+            if not relpath.startswith('uploads' + os.sep):
+                continue
+            target = os.path.join(upload_path, relpath[len('uploads') + 1:])
+            current = file_signature(target)
+            # Копия из снимка сохраняет mtime и размер исходного файла
+            if current is None or list(current[:2]) != signature[:2]:
+                _restore_file(os.path.join(root, relpath), target)
+                restored['uploads'] += 1
+
+    return restored
+
+
+__all__ = [
+    'BackupResult',
+    'list_backups',
+    'read_manifest',
+    'create_backup',
+    'prune_backups',
+    'restore_backup'
+]
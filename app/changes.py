@@ -0,0 +1,381 @@
+"""
+changes.py - Поток изменений коллекций (change data capture)
+
+Каждая запись через кэш коллекций (app.storage.CollectionCache) после
+фиксации публикует события изменений записей: вставка, изменение, удаление -
+с коллекцией, id, новой и прежней версией записи. События доставляются
+подписчикам процесса (change_bus.subscribe) пакетами, по одному пакету на
+запись, вне блокировок коллекций. Производные кэши и статистика обновляются
+по событиям, а не перечитыванием коллекций.
+
+Замена коллекции целиком в обход записей (потоковая перезапись, восстановление
+из резервной копии или после повреждения) публикуется событием RESET без id:
+производные данные коллекции нужно перестроить.
+
+При Config.CHANGE_FEED события также дописываются в файловый журнал
+Config.CHANGE_FEED_PATH (сегменты JSON Lines, позиция - сквозное смещение
+в байтах). По нему подписчики каждого рабочего процесса получают изменения,
+сделанные другими процессами (change_bus.poll перед каждым запросом), а
+внешние потребители (экспорт, python manage.py changes) читают его с
+сохраненной позиции. Журнал пишется после фиксации и без fsync: после сбоя
+последние события могут отсутствовать, а отставший читатель, чьи сегменты уже
+удалены, получает RESET для всех коллекций.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+from app import serializer
+
+try:
+    import fcntl
+except ImportError:  # Windows: журнал пишется без межпроцессной блокировки
+    fcntl = None
+
+
+# Виды событий
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+RESET = 'reset'
+
+
+class ChangeEvent:
+    """
+    Изменение записи коллекции
+
+    Attributes:
+        op: INSERT, UPDATE, DELETE или RESET
+        collection: Путь к файлу коллекции (None у RESET - все коллекции)
+        record_id: id записи (None у RESET)
+        record: Новая версия записи (None у DELETE и RESET)
+        previous: Прежняя версия записи (None у INSERT и RESET)
+        base: Версия коллекции до записи (сигнатура бэкенда, см. normalize_version)
+        version: Версия коллекции после записи; у событий одной записи base и version общие,
+            поэтому производные данные версии base можно обновить до version без перечитывания
+        pid: Процесс, выполнивший запись
+        position: Позиция события в файловом журнале (None, если журнал отключен)
+    """
+
+    __slots__ = ('op', 'collection', 'record_id', 'record', 'previous', 'base', 'version', 'pid', 'position')
+
+    def __init__(self, op: str, collection: Optional[str], record_id: Any = None, record: Any = None,
+                 previous: Any = None, base: Any = None, version: Any = None, pid: Optional[int] = None,
+                 position: Optional[int] = None):
+        self.op = op
+        self.collection = collection
+        self.record_id = record_id
+        self.record = record
+        self.previous = previous
+        self.base = base
+        self.version = version
+        self.pid = os.getpid() if pid is None else pid
+        self.position = position
+
+    def __repr__(self) -> str:
+        name = os.path.relpath(self.collection, Config.DATABASE_PATH) if self.collection else '*'
+        return f'{self.op} {name} [{self.record_id}]' if self.record_id is not None else f'{self.op} {name}'
+
+    def to_entry(self) -> Dict[str, Any]:
+        """Строка файлового журнала (коллекция - путь относительно базы данных)"""
+        entry = {'op': self.op, 'pid': self.pid, 'ts': round(time.time(), 3)}
+        if self.collection is not None:
+            entry['collection'] = os.path.relpath(self.collection, Config.DATABASE_PATH)
+        if self.record_id is not None:
+            entry['id'] = self.record_id
+        if self.record is not None:
+            entry['record'] = self.record
+        if self.previous is not None:
+            entry['previous'] = self.previous
+        if self.version is not None:
+            entry['base'] = self.base
+            entry['version'] = self.version
+        return entry
+
+    @classmethod
+    def from_entry(cls, entry: Dict[str, Any], position: int) -> 'ChangeEvent':
+        collection = entry.get('collection')
+        return cls(entry['op'], os.path.join(Config.DATABASE_PATH, collection) if collection else None,
+                   entry.get('id'), entry.get('record'), entry.get('previous'), entry.get('base'),
+                   entry.get('version'), entry.get('pid'), position)
+
+
+def normalize_version(signature: Any) -> Any:
+    """Сигнатура коллекции в виде, одинаковом в процессе и в файловом журнале (кортежи -> списки)"""
+    return serializer.loads(serializer.dumps(signature)) if signature is not None else None
+
+
+def record_changes(filepath: str, lookup: Callable[[Any], Any], upserts: Iterable[Any],
+                   deletes: Iterable[Any], base: Any = None, version: Any = None) -> List[ChangeEvent]:
+    """
+    События пакета изменений коллекции
+
+    Args:
+        filepath: Путь к файлу коллекции
+        lookup: Прежняя версия записи по id (None - записи не было)
+        upserts: Добавленные и замененные записи
+        deletes: id удаленных записей
+        base: Сигнатура коллекции до записи
+        version: Сигнатура коллекции после записи
+
+    Returns:
+        События в порядке пакета; замена записи той же версией события не дает
+    """
+    base, version = normalize_version(base), normalize_version(version)
+    events = []
+    for record in upserts:
+        record_id = record.get('id')
+        previous = lookup(record_id)
+        if previous is None:
+            events.append(ChangeEvent(INSERT, filepath, record_id, record, base=base, version=version))
+        elif previous != record:
+            events.append(ChangeEvent(UPDATE, filepath, record_id, record, previous, base, version))
+    for record_id in deletes:
+        previous = lookup(record_id)
+        if previous is not None:
+            events.append(ChangeEvent(DELETE, filepath, record_id, previous=previous, base=base, version=version))
+    return events
+
+
+def collection_changes(filepath: str, before: Iterable[Any], after: Iterable[Any],
+                       base: Any = None, version: Any = None) -> List[ChangeEvent]:
+    """События замены коллекции целиком (save_data): разница версий по id"""
+    previous = {record.get('id'): record for record in before if hasattr(record, 'get')}
+    current = [record for record in after if hasattr(record, 'get')]
+    ids = {record.get('id') for record in current}
+    return record_changes(filepath, previous.get, current, [record_id for record_id in previous
+                                                            if record_id not in ids], base, version)
+
+
+class ChangeFeed:
+    """
+    Файловый журнал событий: сегменты <позиция начала>.jsonl в каталоге path
+
+    Позиция события - смещение в байтах от начала первого сегмента за все время;
+    сегмент закрывается по достижении segment_bytes, хранятся последние segments.
+    """
+
+    _SUFFIX = '.jsonl'
+
+    def __init__(self, path: str, segment_bytes: int, segments: int):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.segments = segments
+
+    def _segments(self) -> List[int]:
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-len(self._SUFFIX)]) for name in names
+                      if name.endswith(self._SUFFIX) and name[:-len(self._SUFFIX)].isdigit())
+
+    def _segment_path(self, start: int) -> str:
+        return os.path.join(self.path, f'{start:016d}{self._SUFFIX}')
+
+    def end(self) -> int:
+        """Позиция после последнего записанного события"""
+        segments = self._segments()
+        if not segments:
+            return 0
+        try:
+            return segments[-1] + os.path.getsize(self._segment_path(segments[-1]))
+        except FileNotFoundError:
+            return segments[-1]
+
+    def append(self, events: List[ChangeEvent]) -> None:
+        """Дописать события одной записью в последний сегмент"""
+        if not events:
+            return
+        lines = [serializer.dumps(event.to_entry()) + b'\n' for event in events]
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'feed.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            segments = self._segments() or [0]
+            start = segments[-1]
+            path = self._segment_path(start)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size >= self.segment_bytes:
+                start += size
+                path = self._segment_path(start)
+                segments.append(start)
+                size = 0
+            with open(path, 'ab') as f:
+                f.write(b''.join(lines))
+            for old in segments[:-self.segments]:
+                try:
+                    os.remove(self._segment_path(old))
+                except FileNotFoundError:
+                    pass
+        position = start + size
+        for event, line in zip(events, lines):
+            event.position = position
+            position += len(line)
+
+    def read(self, position: int, limit: int = 10000) -> Tuple[List[ChangeEvent], int, bool]:
+        """
+        События, записанные начиная с позиции
+
+        Returns:
+            (события, позиция для следующего чтения, пропуск: сегменты с позиции уже удалены)
+        """
+        segments = self._segments()
+        if not segments:
+            return [], position, False
+        gap = position < segments[0]
+        if gap:
+            position = segments[0]
+        events = []
+        for i, start in enumerate(segments):
+            end = segments[i + 1] if i + 1 < len(segments) else None
+            if end is not None and position >= end:
+                continue
+            try:
+                with open(self._segment_path(start), 'rb') as f:
+                    f.seek(position - start)
+                    data = f.read()
+            except FileNotFoundError:
+                # Сегмент удален во время чтения - читатель отстал
+                return events, position, True
+            # Последняя строка может еще дописываться
+            complete = data[:data.rfind(b'\n') + 1]
+            for line in complete.splitlines(keepends=True):
+                try:
+                    events.append(ChangeEvent.from_entry(serializer.loads(line), position))
+                except (ValueError, KeyError, TypeError):
+                    # Строка, оборванная сбоем процесса во время записи
+                    print(f"Damaged change feed entry at {position} skipped")
+                position += len(line)
+                if len(events) >= limit:
+                    return events, position, gap
+            if len(complete) < len(data) or end is None:
+                break
+            position = end
+        return events, position, gap
+
+
+class ChangeBus:
+    """Доставка событий подписчикам процесса и запись в файловый журнал"""
+
+    def __init__(self, feed: Optional[ChangeFeed] = None):
+        self.feed = feed
+        self._subscribers: Tuple[Tuple[Callable[[List[ChangeEvent]], Any], Optional[frozenset]], ...] = ()
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._position: Optional[int] = None
+
+    @property
+    def active(self) -> bool:
+        """Нужно ли вычислять события (есть подписчики или файловый журнал)"""
+        return bool(self._subscribers) or self.feed is not None
+
+    def subscribe(self, callback: Callable[[List[ChangeEvent]], Any],
+                  collections: Optional[Iterable[str]] = None) -> Callable[[], None]:
+        """
+        Подписаться на события
+
+        Args:
+            callback: Функция callback(events), получающая пакет событий одной записи
+            collections: Пути коллекций (None - все); RESET всех коллекций доставляется всегда
+
+        Returns:
+            Функция отмены подписки
+        """
+        subscriber = (callback, frozenset(collections) if collections is not None else None)
+        with self._lock:
+            self._subscribers += (subscriber,)
+        if self.feed is not None and self._position is None:
+            # Изменения других процессов доставляются начиная с момента подписки
+            self._position = self.feed.end()
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers = tuple(s for s in self._subscribers if s is not subscriber)
+        return unsubscribe
+
+    def publish(self, events: List[ChangeEvent]) -> None:
+        """Записать события в журнал и доставить подписчикам (после фиксации записи)"""
+        if not events:
+            return
+        if self.feed is not None:
+            try:
+                self.feed.append(events)
+            except OSError as e:
+                print(f"Change feed append failed: {e}")
+        self._deliver(events)
+
+    def reset(self, collection: Optional[str] = None) -> None:
+        """Опубликовать замену коллекции целиком (None - всех коллекций)"""
+        self.publish([ChangeEvent(RESET, collection)])
+
+    def _deliver(self, events: List[ChangeEvent]) -> None:
+        for callback, collections in self._subscribers:
+            selected = events if collections is None else \
+                [e for e in events if e.collection is None or e.collection in collections]
+            if not selected:
+                continue
+            try:
+                callback(selected)
+            except Exception as e:
+                print(f"Change subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
+
+    def poll(self) -> int:
+        """
+        Доставить подписчикам события других процессов из файлового журнала
+
+        Returns:
+            Число доставленных событий
+        """
+        if self.feed is None or not self._subscribers or not self._poll_lock.acquire(blocking=False):
+            return 0
+        try:
+            if self._position is None:
+                self._position = self.feed.end()
+            delivered = 0
+            pid = os.getpid()
+            while True:
+                events, self._position, gap = self.feed.read(self._position)
+                if gap:
+                    self._deliver([ChangeEvent(RESET, None)])
+                foreign = [event for event in events if event.pid != pid]
+                if foreign:
+                    self._deliver(foreign)
+                    delivered += len(foreign)
+                if not events:
+                    return delivered
+        finally:
+            self._poll_lock.release()
+
+
+change_bus = ChangeBus(ChangeFeed(Config.CHANGE_FEED_PATH, Config.CHANGE_FEED_SEGMENT_BYTES,
+                                  Config.CHANGE_FEED_SEGMENTS) if Config.CHANGE_FEED else None)
+
+
+def init_app(app) -> None:
+    """Получать изменения других рабочих процессов перед каждым запросом"""
+    if change_bus.feed is None:
+        return
+
+    @app.before_request
+    def _poll_changes():
+        change_bus.poll()
+
+
+__all__ = [
+    'INSERT',
+    'UPDATE',
+    'DELETE',
+    'RESET',
+    'ChangeEvent',
+    'normalize_version',
+    'record_changes',
+    'collection_changes',
+    'ChangeFeed',
+    'ChangeBus',
+    'change_bus',
+    'init_app'
+]
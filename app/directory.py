@@ -0,0 +1,146 @@
+"""
+directory.py - Справочник пользователей: id -> имя, логин, роль
+
+Справочник строится один раз из снимка коллекции пользователей и затем
+поддерживается событиями изменений (app.changes): регистрация, изменение
+и удаление пользователя меняют одну запись справочника, а не перечитывают
+users.json. Версия справочника сверяется с сигнатурой коллекции не чаще
+одного раза за запрос (app.unit_of_work); если коллекцию изменил другой
+процесс, а его события не пришли (файловый журнал изменений отключен),
+справочник строится заново.
+
+Имена в таблицах, истории задач и карточках берутся из справочника
+поиском в словаре вместо перебора или индексации всей коллекции.
+"""
+
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+from app.changes import change_bus, normalize_version, DELETE, RESET
+from app.records import Record
+from app.storage import collection_cache, current_scope
+
+
+class UserEntry(Record):
+    """Запись справочника: поля пользователя, нужные для отображения и входа"""
+
+    __slots__ = ('id', 'username', 'name', 'full_name', 'role', 'token', 'projects')
+    INTERN = ('role',)
+
+    FIELDS = ('id', 'username', 'name', 'full_name', 'role', 'token', 'projects')
+
+    @classmethod
+    def of(cls, user: Any) -> 'UserEntry':
+        return cls((field, user[field]) for field in cls.FIELDS if field in user)
+
+    @property
+    def display_name(self) -> str:
+        """Имя для истории и подписей: имя, иначе логин"""
+        return self.get('name', self.get('username', 'Неизвестный'))
+
+
+class UserDirectory:
+    """Справочник пользователей коллекции filepath, обновляемый по событиям изменений"""
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        # (версия коллекции, id -> UserEntry, сигнатура бэкенда этой версии или None);
+        # словарь не изменяется после публикации
+        self._state: Optional[Tuple[Any, Dict[Any, UserEntry], Any]] = None
+        self._lock = threading.Lock()
+        self._subscribed = False
+        # (справочник, id -> позиция в нем); пересчитывается для новой версии справочника
+        self._positions: Optional[Tuple[Dict[Any, UserEntry], Dict[Any, int]]] = None
+
+    def entries(self) -> Dict[Any, UserEntry]:
+        """Актуальный справочник (только для чтения): id -> UserEntry"""
+        state = self._state
+        validated = getattr(current_scope(), 'validated', None)
+        if state is not None and validated is not None and self in validated:
+            return state[1]
+        state = self._validate(state)
+        if validated is not None:
+            validated.add(self)
+        return state[1]
+
+    def _validate(self, state: Optional[Tuple[Any, Dict[Any, UserEntry], Any]]) -> Tuple[Any, Dict[Any, UserEntry], Any]:
+        """Сверить справочник с сигнатурой коллекции; при расхождении - построить заново"""
+        if state is None:
+            return self._build()
+        signature = collection_cache.backend.signature(self.filepath)
+        if state[2] is not None and signature == state[2]:
+            return state
+        if normalize_version(signature) != state[0]:
+            return self._build()
+        # Версия совпала (справочник обновлен событиями) - запомнить сигнатуру бэкенда
+        state = (state[0], state[1], signature)
+        with self._lock:
+            if self._state is not None and self._state[0] == state[0]:
+                self._state = state
+        return state
+
+    def get(self, user_id: Any) -> Optional[UserEntry]:
+        """Запись пользователя (None, если пользователя нет)"""
+        return self.entries().get(user_id)
+
+    def name(self, user_id: Any, default: str = '') -> str:
+        """Имя пользователя (default, если пользователя или имени нет)"""
+        entry = self.entries().get(user_id)
+        return entry.get('name', default) if entry is not None else default
+
+    def ordered(self, user_ids: Iterable[Any]) -> List[UserEntry]:
+        """Записи пользователей user_ids без повторов в порядке коллекции (неизвестные id пропускаются)"""
+        entries = self.entries()
+        positions = self._positions
+        if positions is None or positions[0] is not entries:
+            positions = (entries, {user_id: i for i, user_id in enumerate(entries)})
+            self._positions = positions
+        found = {user_id for user_id in user_ids if user_id in entries}
+        return [entries[user_id] for user_id in sorted(found, key=positions[1].__getitem__)]
+
+    def _build(self) -> Tuple[Any, Dict[Any, UserEntry], Any]:
+        if not self._subscribed:
+            # Подписка раньше чтения снимка: события записей после него не теряются
+            change_bus.subscribe(self._apply, [self.filepath])
+            self._subscribed = True
+        snapshot = collection_cache.snapshot(self.filepath)
+        state = (normalize_version(snapshot.signature),
+                 {user.get('id'): UserEntry.of(user) for user in snapshot.data if hasattr(user, 'get')},
+                 snapshot.signature)
+        with self._lock:
+            self._state = state
+        return state
+
+    def _apply(self, events) -> None:
+        """Обновить справочник по событиям; при разрыве версий - сбросить"""
+        with self._lock:
+            if self._state is None:
+                return
+            version, entries, _ = self._state
+            entries = dict(entries)
+            for event in events:
+                if event.op == RESET:
+                    self._state = None
+                    return
+                if event.version != version:
+                    if event.base is None or event.base != version:
+                        # Пропущена запись (например, другого процесса) - перестроить при обращении
+                        self._state = None
+                        return
+                    version = event.version
+                if event.op == DELETE:
+                    entries.pop(event.record_id, None)
+                else:
+                    entries[event.record_id] = UserEntry.of(event.record)
+            self._state = (version, entries, None)
+
+
+user_directory = UserDirectory(Config.USERS_DB)
+
+
+__all__ = [
+    'UserEntry',
+    'UserDirectory',
+    'user_directory'
+]
@@ -0,0 +1,134 @@
+"""
+group_commit.py - Объединение записей в коллекции (group commit)
+
+Изменения отдельных записей ставятся в очередь коллекции; фоновый поток
+коллекции записывает их пакетами - одна блокировка, одна запись в журнал
+и один fsync на пакет вместо каждого запроса. Вызывающий получает Future,
+который завершается после записи.
+
+Пакеты записываются не чаще одного раза за окно (Config.GROUP_COMMIT_WINDOW_MS):
+первое изменение после простоя записывается сразу, а изменения, пришедшие
+во время серии записей, накапливаются до конца окна и уходят одним пакетом.
+
+Поток коллекции запускается при первой записи и завершается после
+простоя, поэтому число потоков не растет вместе с числом шардов.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+
+class PendingChange:
+    """Изменение, ожидающее записи в составе пакета"""
+
+    __slots__ = ('upserts', 'deletes', 'expected', 'future')
+
+    def __init__(self, upserts: List[Any], deletes: List[Any], expected: Optional[Dict[Any, Any]]):
+        self.upserts = upserts
+        self.deletes = deletes
+        self.expected = expected
+        self.future = Future()
+
+
+class _Lane:
+    """Очередь и фоновый поток одной коллекции"""
+
+    __slots__ = ('pending', 'thread', 'last_commit')
+
+    def __init__(self):
+        self.pending: List[PendingChange] = []
+        self.thread: Optional[threading.Thread] = None
+        self.last_commit = float('-inf')
+
+
+class GroupCommitWriter:
+    """
+    Фоновая пакетная запись изменений по коллекциям
+
+    Args:
+        commit: Функция commit(filepath, changes), записывающая пакет; она сама
+            завершает Future изменений (например, отклоняет конфликтующие),
+            а незавершенные после ее выхода считаются записанными
+        window: Минимальный интервал между записями пакетов коллекции, секунды
+        max_batch: Размер пакета, при котором он записывается не дожидаясь окна
+        idle_timeout: Простой, после которого поток коллекции завершается, секунды
+    """
+
+    def __init__(self, commit: Callable[[str, List[PendingChange]], None], window: float,
+                 max_batch: int = 1000, idle_timeout: float = 1.0):
+        self._commit = commit
+        self.window = window
+        self.max_batch = max_batch
+        self.idle_timeout = idle_timeout
+        self._lanes: Dict[str, _Lane] = {}
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+
+    def submit(self, filepath: str, upserts: List[Any], deletes: List[Any],
+               expected: Optional[Dict[Any, Any]] = None) -> Future:
+        """Поставить изменение в очередь коллекции; Future завершается после записи пакета"""
+        change = PendingChange(upserts, deletes, expected)
+        if self._pid != os.getpid():
+            # После fork потоки родителя в дочернем процессе не существуют
+            self._pid = os.getpid()
+            self._lanes = {}
+            self._cond = threading.Condition()
+        with self._cond:
+            lane = self._lanes.get(filepath)
+            if lane is None:
+                lane = self._lanes[filepath] = _Lane()
+            lane.pending.append(change)
+            if lane.thread is None:
+                lane.thread = threading.Thread(target=self._run, args=(filepath, lane),
+                                               name=f'group-commit:{filepath}', daemon=True)
+                lane.thread.start()
+            self._cond.notify_all()
+        return change.future
+
+    def _collect(self, filepath: str, lane: _Lane) -> Optional[List[PendingChange]]:
+        """Дождаться изменений и собрать пакет (None - поток коллекции завершается)"""
+        with self._cond:
+            idle_until = time.monotonic() + self.idle_timeout
+            while not lane.pending:
+                remaining = idle_until - time.monotonic()
+                if remaining <= 0:
+                    lane.thread = None
+                    del self._lanes[filepath]
+                    return None
+                self._cond.wait(remaining)
+
+            commit_at = lane.last_commit + self.window
+            while len(lane.pending) < self.max_batch:
+                remaining = commit_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, lane.pending = lane.pending, []
+            lane.last_commit = time.monotonic()
+            return batch
+
+    def _run(self, filepath: str, lane: _Lane) -> None:
+        while True:
+            batch = self._collect(filepath, lane)
+            if batch is None:
+                return
+            try:
+                self._commit(filepath, batch)
+            except BaseException as e:
+                for change in batch:
+                    if not change.future.done():
+                        change.future.set_exception(e)
+            else:
+                for change in batch:
+                    if not change.future.done():
+                        change.future.set_result(None)
+
+
+__all__ = [
+    'PendingChange',
+    'GroupCommitWriter'
+]
@@ -0,0 +1,505 @@
+"""
+integrity.py - Проверка целостности базы данных и исправление записей
+
+Проверяются:
+    - разбор снимков коллекций (поврежденный снимок переносится в карантин
+      и восстанавливается из последней резервной копии и журналов);
+    - схема записей: обязательные поля, типы, уникальность id;
+    - ссылки: задачи и манифест на проекты, команды и руководители проектов
+      на пользователей, проекты пользователей, токены, дочерние элементы на
+      задачи, файлы задач на загруженные файлы.
+
+Исправление: записи, которые нельзя использовать (нарушена схема, задача
+без проекта, элемент без задачи), переносятся в карантин
+Config.QUARANTINE_PATH/<коллекция>.jsonl и удаляются из коллекции; висячие
+ссылки в списках (команда проекта, проекты пользователя) удаляются из записи.
+Остальные нарушения только сообщаются.
+
+Фоновая проверка (IntegrityChecker) работает в одном процессе из всех рабочих
+и за проход проверяет не больше Config.INTEGRITY_CHECK_BATCH коллекций, у
+которых с прошлой проверки изменились данные или коллекции, на которые они
+ссылаются; обработка запросов проверкой не нагружается.
+"""
+
+import os
+import threading
+import time
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from config import Config
+from app import archive, serializer, task_store
+from app.changes import change_bus
+from app.storage import collection_cache, collection_lock, apply_changes, JsonBackend, thaw
+
+try:
+    import fcntl
+except ImportError:  # Windows: проверка в каждом процессе
+    fcntl = None
+
+
+# Схемы коллекций по виду: поле -> (допустимые типы, обязательное)
+_STR = (str,)
+_OPTIONAL_STR = (str, type(None))
+SCHEMAS: Dict[str, Dict[str, tuple]] = {
+    'users': {'id': (_STR, True), 'username': (_STR, True), 'password': (_STR, True),
+              'role': (_STR, True), 'name': (_OPTIONAL_STR, False), 'projects': ((list,), False)},
+    'projects': {'id': (_STR, True), 'name': (_STR, True), 'status': (_OPTIONAL_STR, False),
+                 'manager_id': (_OPTIONAL_STR, False), 'supervisor_id': (_OPTIONAL_STR, False),
+                 'team': ((list,), False)},
+    'tasks': {'id': (_STR, True), 'project_id': (_STR, True), 'title': (_STR, True),
+              'status': (_OPTIONAL_STR, False), 'assignee_id': (_OPTIONAL_STR, False)},
+    'tokens': {'id': (_STR, True), 'role': (_OPTIONAL_STR, False), 'used': ((bool,), False),
+               'project_id': (_OPTIONAL_STR, False), 'user_id': (_OPTIONAL_STR, False),
+               'expires_at': (_OPTIONAL_STR, False)},
+    'directions': {'id': (_STR, True), 'name': (_STR, True)},
+    'task_manifest': {'id': (_STR, True), 'project_id': (_STR, True)},
+    'schema': {'id': (_STR, True), 'version': ((int,), True)},
+    'task_history': {'id': (_STR, True), 'task_id': (_STR, True), 'data': ((Mapping,), True)},
+    'task_reports': {'id': (_STR, True), 'task_id': (_STR, True), 'data': ((Mapping,), True)},
+    'task_files': {'id': (_STR, True), 'task_id': (_STR, True), 'data': ((Mapping,), True)},
+    'task_subtasks': {'id': (_STR, True), 'task_id': (_STR, True), 'data': ((Mapping,), True)}
+}
+
+# Действия исправления
+QUARANTINE = 'quarantine'
+REPAIR = 'repair'
+RESTORE = 'restore'
+
+
+class IntegrityIssue:
+    """Нарушение целостности и способ его исправления (action=None - только сообщение)"""
+
+    __slots__ = ('filepath', 'record_id', 'problem', 'action', 'fix')
+
+    def __init__(self, filepath: str, record_id: Any, problem: str, action: Optional[str] = None,
+                 fix: Optional[Callable[[dict], Any]] = None):
+        self.filepath = filepath
+        self.record_id = record_id
+        self.problem = problem
+        self.action = action
+        self.fix = fix
+
+    def __repr__(self) -> str:
+        collection = os.path.relpath(self.filepath, Config.DATABASE_PATH)
+        record = f' [{self.record_id}]' if self.record_id is not None else ''
+        action = f' -> {self.action}' if self.action else ''
+        return f'{collection}{record}: {self.problem}{action}'
+
+
+def collection_kind(filepath: str) -> str:
+    """Вид коллекции по пути: tasks__<проект>.json -> tasks"""
+    return os.path.splitext(os.path.basename(filepath))[0].split('__', 1)[0]
+
+
+def dependencies(filepath: str) -> List[str]:
+    """Коллекции, на которые ссылаются записи коллекции (их изменение требует повторной проверки)"""
+    kind = collection_kind(filepath)
+    if kind == 'users':
+        return [Config.PROJECTS_DB]
+    if kind == 'projects':
+        return [Config.USERS_DB, Config.DIRECTIONS_DB]
+    if kind == 'tokens':
+        return [Config.USERS_DB, Config.PROJECTS_DB]
+    if kind == 'task_manifest':
+        return [Config.PROJECTS_DB]
+    if kind == 'tasks':
+        return [Config.PROJECTS_DB, Config.USERS_DB, Config.TASK_MANIFEST_DB]
+    if kind in SCHEMAS and kind.startswith('task_'):
+        # Дочерняя коллекция проекта ссылается на шард задач того же проекта
+        key = os.path.basename(filepath).split('__', 1)[1]
+        return [os.path.join(os.path.dirname(filepath), task_store.SHARD_PREFIX + key)]
+    return []
+
+
+def _check_schema(filepath: str, records: Any) -> List[IntegrityIssue]:
+    schema = SCHEMAS.get(collection_kind(filepath))
+    issues = []
+    seen = set()
+    for position, record in enumerate(records):
+        if not isinstance(record, Mapping):
+            issues.append(IntegrityIssue(filepath, None, f'запись #{position} не является объектом'))
+            continue
+        record_id = record.get('id')
+        if record_id is not None and record_id in seen:
+            issues.append(IntegrityIssue(filepath, record_id, 'повторяющийся id'))
+        seen.add(record_id)
+        for field, (types, required) in (schema or {}).items():
+            if field not in record:
+                if required:
+                    issues.append(IntegrityIssue(filepath, record_id, f'нет обязательного поля {field}',
+                                                 QUARANTINE if record_id is not None else None))
+            elif not isinstance(record[field], types):
+                issues.append(IntegrityIssue(filepath, record_id,
+                                             f'поле {field}: тип {type(record[field]).__name__}',
+                                             QUARANTINE if required and record_id is not None else None))
+    return issues
+
+
+def _ids(filepath: str) -> set:
+    return {record.get('id') for record in collection_cache.get(filepath)}
+
+
+def _project_ids() -> set:
+    """id проектов: рабочие и архивные (на архивный проект ссылаются пользователи и токены)"""
+    ids = _ids(Config.PROJECTS_DB)
+    if ids:
+        ids.update(archive.archived_ids(archive.PROJECTS))
+    return ids
+
+
+def _known(ids: set, value: Any) -> bool:
+    """
+    Ссылка на существующую запись
+
+    Пустая коллекция (например, еще не восстановленная после повреждения) не
+    считается доказательством висячих ссылок: иначе исправление удалило бы их все.
+    """
+    return not ids or value in ids
+
+
+def _remove_from(field: str, missing: set) -> Callable[[dict], Any]:
+    def fix(record):
+        record[field] = [value for value in record.get(field) or [] if value not in missing]
+    return fix
+
+
+def _upload_exists(info: Any) -> bool:
+    if not isinstance(info, Mapping) or not info.get('unique_filename'):
+        return True
+    return os.path.exists(os.path.join(Config.UPLOAD_PATH, info.get('executor_dir') or '',
+                                       info['unique_filename']))
+
+
+def _check_references(filepath: str, records: Any) -> List[IntegrityIssue]:
+    kind = collection_kind(filepath)
+    issues = []
+
+    if kind == 'users':
+        projects = _project_ids()
+        for user in records:
+            missing = {p for p in user.get('projects') or [] if not _known(projects, p)}
+            if missing:
+                issues.append(IntegrityIssue(filepath, user.get('id'), f'несуществующие проекты {sorted(missing)}',
+                                             REPAIR, _remove_from('projects', missing)))
+
+    elif kind == 'projects':
+        users = _ids(Config.USERS_DB)
+        directions = {d.get('name') for d in collection_cache.get(Config.DIRECTIONS_DB)}
+        for project in records:
+            missing = {u for u in project.get('team') or [] if not _known(users, u)}
+            if missing:
+                issues.append(IntegrityIssue(filepath, project.get('id'), f'в команде нет пользователей {sorted(missing)}',
+                                             REPAIR, _remove_from('team', missing)))
+            for field in ('manager_id', 'supervisor_id'):
+                if project.get(field) and not _known(users, project[field]):
+                    issues.append(IntegrityIssue(filepath, project.get('id'), f'{field}: нет пользователя {project[field]}'))
+            if project.get('direction') and project['direction'] not in directions:
+                issues.append(IntegrityIssue(filepath, project.get('id'), f'нет направления {project["direction"]}'))
+
+    elif kind == 'tokens':
+        users, projects = _ids(Config.USERS_DB), _project_ids()
+        for token in records:
+            if token.get('project_id') and not _known(projects, token['project_id']):
+                issues.append(IntegrityIssue(filepath, token.get('id'), f'нет проекта {token["project_id"]}'))
+            if token.get('user_id') and not _known(users, token['user_id']):
+                issues.append(IntegrityIssue(filepath, token.get('id'), f'нет пользователя {token["user_id"]}'))
+
+    elif kind == 'task_manifest':
+        projects = _project_ids()
+        for entry in records:
+            shard = task_store.shard_path(entry.get('project_id'))
+            if collection_cache.index(shard).get(entry.get('id')) is None:
+                issues.append(IntegrityIssue(filepath, entry.get('id'), 'задачи нет в шарде проекта', QUARANTINE))
+            elif not _known(projects, entry.get('project_id')):
+                issues.append(IntegrityIssue(filepath, entry.get('id'), f'нет проекта {entry.get("project_id")}'))
+
+    elif kind == 'tasks':
+        projects, users = _project_ids(), _ids(Config.USERS_DB)
+        manifest = collection_cache.index(Config.TASK_MANIFEST_DB)
+        for task in records:
+            if not _known(projects, task.get('project_id')):
+                issues.append(IntegrityIssue(filepath, task.get('id'), f'нет проекта {task.get("project_id")}', QUARANTINE))
+            entry = manifest.get(task.get('id'))
+            if entry is None or task_store.shard_path(entry.get('project_id')) != filepath:
+                issues.append(IntegrityIssue(filepath, task.get('id'), 'задача не учтена в манифесте'))
+            for field in ('assignee_id', 'created_by'):
+                if task.get(field) and not _known(users, task[field]):
+                    issues.append(IntegrityIssue(filepath, task.get('id'), f'{field}: нет пользователя {task[field]}'))
+
+    elif kind.startswith('task_') and kind in SCHEMAS:
+        tasks = _ids(dependencies(filepath)[0])
+        for record in records:
+            if not _known(tasks, record.get('task_id')):
+                issues.append(IntegrityIssue(filepath, record.get('id'), f'нет задачи {record.get("task_id")}', QUARANTINE))
+                continue
+            data = record.get('data') or {}
+            attached = data if kind == 'task_files' else data.get('file')
+            if not _upload_exists(attached):
+                issues.append(IntegrityIssue(filepath, record.get('id'),
+                                             f'нет загруженного файла {attached.get("unique_filename")}'))
+
+    return issues
+
+
+def _check_decodes(filepath: str) -> Optional[IntegrityIssue]:
+    """Снимок коллекции разбирается (проверяется сам файл, без кэша)"""
+    if not os.path.exists(filepath):
+        return None
+    try:
+        with open(filepath, 'rb') as f:
+            content = f.read()
+        if content.strip():
+            serializer.loads(content)
+    except serializer.JSONDecodeError as e:
+        return IntegrityIssue(filepath, None, f'снимок не разбирается: {e}', RESTORE)
+    return None
+
+
+def check_collection(filepath: str) -> List[IntegrityIssue]:
+    """Проверить одну коллекцию: разбор снимка (JSON), схему и ссылки"""
+    backend = collection_cache.backend
+    if isinstance(backend, JsonBackend):
+        issue = _check_decodes(filepath)
+        if issue is not None:
+            return [issue]
+    records = collection_cache.get(filepath)
+    return _check_schema(filepath, records) + _check_references(filepath, records)
+
+
+def quarantined_collections() -> List[str]:
+    """Коллекции, поврежденные снимки которых перенесены в карантин и еще не восстановлены"""
+    result = []
+    for directory, _, names in os.walk(Config.QUARANTINE_PATH):
+        for name in names:
+            if name.endswith('.corrupt'):
+                relpath = os.path.relpath(os.path.join(directory, name), Config.QUARANTINE_PATH)
+                result.append(os.path.join(Config.DATABASE_PATH, relpath.rsplit('.', 2)[0]))
+    return sorted(set(result))
+
+
+def quarantine_records(filepath: str, records: Iterable[Any], reason: str) -> None:
+    """Дописать записи в карантин коллекции (<коллекция>.jsonl, одна строка на запись)"""
+    relpath = os.path.relpath(filepath, Config.DATABASE_PATH)
+    target = os.path.join(Config.QUARANTINE_PATH, relpath + '.jsonl')
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    stamp = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
+    with open(target, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(serializer.dumps_str({'quarantined_at': stamp, 'reason': reason, 'record': thaw(record)}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def restore_collection(filepath: str) -> bool:
+    """
+    Восстановить коллекцию с поврежденным снимком
+
+    Данные собираются из последней резервной копии (app.backup), в которой
+    есть коллекция, затем применяются журналы из карантина и текущий журнал:
+    записи в журналах полные, поэтому более новые версии заменяют старые.
+
+    Returns:
+        False, если в резервных копиях коллекции нет (данные только из журналов)
+    """
+    from app.backup import list_backups, read_manifest
+
+    backend = collection_cache.backend
+    relpath = os.path.relpath(filepath, Config.DATABASE_PATH)
+    with collection_lock(filepath):
+        if _check_decodes(filepath) is not None:
+            backend.quarantine(filepath)
+
+        data, found = [], False
+        for name in reversed(list_backups()):
+            files = read_manifest(name)['files']
+            key = os.path.join('database', relpath)
+            if key in files or key + '.journal' in files:
+                source = os.path.join(Config.BACKUP_PATH, name, key)
+                data = backend.read_files(source, backend.journal_path(source), files.get(key))
+                found = True
+                break
+
+        batches = []
+        directory = os.path.join(Config.QUARANTINE_PATH, os.path.dirname(relpath))
+        prefix = os.path.basename(relpath) + '.'
+        names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        corrupt = [n for n in names if n.startswith(prefix) and n.endswith('.corrupt')]
+        for name in corrupt:
+            journal = os.path.join(directory, name[:-len('.corrupt')] + '.journal')
+            batches += backend.read_journal(journal, None, check_base=False)
+        batches += backend.read_journal(backend.journal_path(filepath), None, check_base=False)
+        if batches:
+            data = apply_changes(data, batches)
+
+        backend.write(filepath, data)
+        for name in corrupt:
+            # Обработанные файлы остаются в карантине, но больше не считаются невосстановленными
+            path = os.path.join(directory, name)
+            os.replace(path, path[:-len('.corrupt')] + '.restored')
+    collection_cache.invalidate(filepath)
+    change_bus.reset(filepath)
+    return found
+
+
+def repair(issues: Iterable[IntegrityIssue]) -> Dict[str, int]:
+    """
+    Исправить нарушения, для которых задано действие
+
+    Returns:
+        Число исправленных нарушений по действиям
+    """
+    from app.utils import update_record
+
+    done = {QUARANTINE: 0, REPAIR: 0, RESTORE: 0}
+    quarantine: Dict[str, Dict[Any, str]] = {}
+    for issue in issues:
+        if issue.action == RESTORE:
+            restore_collection(issue.filepath)
+            done[RESTORE] += 1
+        elif issue.action == REPAIR and issue.fix is not None:
+            if update_record(issue.filepath, issue.record_id, issue.fix) is not None:
+                done[REPAIR] += 1
+        elif issue.action == QUARANTINE:
+            quarantine.setdefault(issue.filepath, {}).setdefault(issue.record_id, issue.problem)
+
+    for filepath, problems in quarantine.items():
+        with collection_lock(filepath):
+            index = collection_cache.index(filepath)
+            records = [(index.get(record_id), reason) for record_id, reason in problems.items()
+                       if index.get(record_id) is not None]
+            for record, reason in records:
+                quarantine_records(filepath, [record], reason)
+            if records:
+                collection_cache.save_records(filepath, deletes=[record.get('id') for record, _ in records])
+            done[QUARANTINE] += len(records)
+    return done
+
+
+def check_database(collections: Optional[List[str]] = None) -> List[IntegrityIssue]:
+    """Проверить все коллекции базы данных (или указанные) и поврежденные снимки в карантине"""
+    from app.utils import database_collections
+
+    issues = [IntegrityIssue(filepath, None, 'снимок в карантине', RESTORE) for filepath in quarantined_collections()]
+    for filepath in collections or database_collections():
+        issues += check_collection(filepath)
+    return issues
+
+
+class IntegrityChecker:
+    """
+    Фоновая инкрементальная проверка целостности
+
+    Проверка выполняется одним процессом: остальные процессы не получают
+    файловую блокировку Config.DATABASE_PATH/integrity.lock и пропускают проход.
+    Поврежденные снимки восстанавливаются всегда, записи исправляются
+    при Config.INTEGRITY_REPAIR.
+    """
+
+    def __init__(self, interval: float, batch: int, repair_records: bool):
+        self.interval = interval
+        self.batch = batch
+        self.repair_records = repair_records
+        # Коллекция -> сигнатуры коллекции и ее зависимостей при последней проверке
+        self._checked: Dict[str, Any] = {}
+        # Коллекция -> нарушения последней проверки
+        self.issues: Dict[str, List[IntegrityIssue]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock_file = None
+
+    def start(self) -> None:
+        """Запустить поток проверки в текущем процессе (повторный вызов ничего не делает)"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._checked = {}
+        self._thread = threading.Thread(target=self._run, name='integrity-checker', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self._acquire():
+                    self.run_once()
+            except Exception as e:
+                print(f"Integrity check failed: {e}")
+
+    def _acquire(self) -> bool:
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(os.path.join(Config.DATABASE_PATH, 'integrity.lock'), 'a')
+            try:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                return False
+        return True
+
+    def _key(self, filepath: str) -> Any:
+        backend = collection_cache.backend
+        return tuple(backend.signature(path) for path in [filepath] + dependencies(filepath))
+
+    def run_once(self) -> List[IntegrityIssue]:
+        """Проверить до batch коллекций, изменившихся с прошлой проверки"""
+        from app.utils import database_collections
+
+        found = []
+        for filepath in quarantined_collections():
+            print(f"Integrity: restoring {filepath}")
+            restore_collection(filepath)
+
+        checked = 0
+        for filepath in database_collections():
+            if checked >= self.batch:
+                break
+            key = self._key(filepath)
+            if self._checked.get(filepath) == key:
+                continue
+            checked += 1
+            issues = check_collection(filepath)
+            fixable = [i for i in issues if i.action == RESTORE or self.repair_records and i.action]
+            if fixable:
+                repair(fixable)
+                issues = check_collection(filepath)
+                key = self._key(filepath)
+            for issue in issues:
+                print(f"Integrity: {issue!r}")
+            self.issues[filepath] = issues
+            self._checked[filepath] = key
+            found += issues
+        return found
+
+
+integrity_checker = IntegrityChecker(Config.INTEGRITY_CHECK_INTERVAL, Config.INTEGRITY_CHECK_BATCH,
+                                     Config.INTEGRITY_REPAIR)
+
+
+def init_app(app) -> None:
+    """Запускать фоновую проверку в каждом рабочем процессе при первом запросе"""
+    if Config.INTEGRITY_CHECK_INTERVAL <= 0:
+        return
+
+    @app.before_request
+    def _start_integrity_checker():
+        integrity_checker.start()
+
+
+__all__ = [
+    'SCHEMAS',
+    'IntegrityIssue',
+    'dependencies',
+    'check_collection',
+    'check_database',
+    'quarantined_collections',
+    'quarantine_records',
+    'restore_collection',
+    'repair',
+    'IntegrityChecker',
+    'integrity_checker',
+    'init_app'
+]
@@ -0,0 +1,282 @@
+"""
+migrations.py - Версии схемы коллекций и миграции без остановки приложения
+
+Миграция - пронумерованная функция, обновляющая одну запись на месте, для
+коллекций указанных видов (tasks, projects, ...). Для каждой коллекции в
+Config.SCHEMA_DB хранится номер последней примененной миграции; запись '*'
+задает версию коллекций, у которых нет собственной записи (созданных
+приложением после полного прохода миграций).
+
+Записи коллекции, версия которой отстает, обновляются при чтении: кэш
+коллекций (CollectionCache.upgrader) и потоковые чтения app.utils
+применяют к ним недостающие миграции, поэтому приложение сразу работает с
+данными новой версии, а любая запись сохраняет их уже обновленными.
+
+`python manage.py migrate` переписывает остальные записи, не останавливая
+приложение: коллекция читается потоком, измененные записи сохраняются
+пакетами по Config.MIGRATION_BATCH с проверкой, что запись не изменилась с
+момента чтения (запись, измененную параллельным запросом, тот уже сохранил
+в новой версии). После прохода коллекции записывается ее версия, и
+обновление при чтении для нее отключается.
+
+Требования к миграции:
+    - идемпотентность: запись может быть обновлена при чтении несколько раз;
+    - запись может содержать только часть полей (чтение отдельных полей
+      для отчетов), отсутствующие поля пропускаются.
+Архив завершенных записей (app.archive) миграциями не переписывается.
+"""
+
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from config import Config
+from app.integrity import collection_kind
+from app.storage import collection_cache, ConflictError
+
+
+# Ключ версии коллекций без собственной записи
+ALL = '*'
+
+
+class Migration:
+    """Миграция схемы: номер, описание, виды коллекций и обновление записи"""
+
+    __slots__ = ('number', 'name', 'kinds', 'upgrade')
+
+    def __init__(self, number: int, name: str, kinds: Iterable[str], upgrade: Callable[[Dict[str, Any]], bool]):
+        self.number = number
+        self.name = name
+        self.kinds = tuple(kinds)
+        self.upgrade = upgrade
+
+    def __repr__(self) -> str:
+        return f"{self.number:04d} {self.name} ({', '.join(self.kinds)})"
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(number: int, name: str, kinds: Iterable[str]):
+    """
+    Декоратор регистрации миграции
+
+    Функция получает запись (dict), изменяет ее на месте и возвращает True,
+    если запись изменена.
+    """
+    def register(upgrade: Callable[[Dict[str, Any]], bool]):
+        if any(m.number == number for m in MIGRATIONS):
+            raise ValueError(f"Миграция {number} уже зарегистрирована")
+        MIGRATIONS.append(Migration(number, name, kinds, upgrade))
+        MIGRATIONS.sort(key=lambda m: m.number)
+        return upgrade
+    return register
+
+
+def latest_version() -> int:
+    """Номер последней миграции (версия схемы кода)"""
+    return MIGRATIONS[-1].number if MIGRATIONS else 0
+
+
+def collection_key(filepath: str) -> str:
+    """Ключ коллекции в таблице версий: путь относительно каталога базы данных"""
+    return os.path.relpath(filepath, Config.DATABASE_PATH)
+
+
+def collection_version(filepath: str) -> int:
+    """Версия схемы, в которой хранятся записи коллекции"""
+    versions = collection_cache.index(Config.SCHEMA_DB)
+    entry = versions.get(collection_key(filepath))
+    if entry is None:
+        entry = versions.get(ALL)
+    return entry['version'] if entry is not None else 0
+
+
+def pending(filepath: str) -> List[Migration]:
+    """Миграции, еще не примененные к записям коллекции"""
+    kind = collection_kind(filepath)
+    migrations = [m for m in MIGRATIONS if kind in m.kinds]
+    if not migrations:
+        return []
+    version = collection_version(filepath)
+    return [m for m in migrations if m.number > version]
+
+
+def _apply(migrations: List[Migration], record: Any) -> bool:
+    if not isinstance(record, dict):
+        return False
+    changed = False
+    for m in migrations:
+        if m.upgrade(record):
+            changed = True
+    return changed
+
+
+def upgrader(filepath: str) -> Optional[Callable[[Dict[str, Any]], bool]]:
+    """Обновление записи коллекции до текущей версии (None, если коллекция актуальна)"""
+    migrations = pending(filepath)
+    if not migrations:
+        return None
+    return lambda record: _apply(migrations, record)
+
+
+def upgrade_records(filepath: str, records: Iterable[Any]) -> Iterable[Any]:
+    """Записи, прочитанные из коллекции в обход кэша, в текущей версии схемы"""
+    upgrade = upgrader(filepath)
+    if upgrade is None:
+        return records
+    return _upgraded(upgrade, records)
+
+
+def _upgraded(upgrade: Callable[[Dict[str, Any]], bool], records: Iterable[Any]) -> Iterator[Any]:
+    for record in records:
+        upgrade(record)
+        yield record
+
+
+def set_version(filepath: Optional[str], version: int) -> None:
+    """Записать версию коллекции (filepath=None - версия коллекций без собственной записи)"""
+    key = ALL if filepath is None else collection_key(filepath)
+    collection_cache.save_records(Config.SCHEMA_DB, upserts=[{'id': key, 'version': version}])
+
+
+def stamp() -> None:
+    """Отметить все коллекции текущей версией (новая база данных создается в ней)"""
+    collection_cache.save(Config.SCHEMA_DB, [{'id': ALL, 'version': latest_version()}])
+
+
+def _save_batch(filepath: str, records: List[Dict[str, Any]]) -> int:
+    """Сохранить обновленные записи; записи, измененные с момента чтения, пропускаются"""
+    expected = {record['id']: record for record in records if record.get('id') is not None}
+    while expected:
+        try:
+            collection_cache.save_records(filepath, upserts=list(expected.values()), expected=expected)
+            return len(expected)
+        except ConflictError as e:
+            # Параллельный запрос сохранил запись, прочитанную уже в новой версии
+            expected.pop(e.record_id, None)
+    return 0
+
+
+def migrate_collection(filepath: str, batch_size: Optional[int] = None) -> int:
+    """
+    Применить недостающие миграции ко всем записям коллекции
+
+    Returns:
+        Число обновленных записей
+    """
+    migrations = pending(filepath)
+    if not migrations:
+        return 0
+    batch_size = batch_size or Config.MIGRATION_BATCH
+    backend = collection_cache.backend
+    changed = 0
+    if backend.exists(filepath):
+        batch = []
+        for record in backend.iter_read(filepath):
+            if _apply(migrations, record):
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    changed += _save_batch(filepath, batch)
+                    batch = []
+        if batch:
+            changed += _save_batch(filepath, batch)
+    set_version(filepath, latest_version())
+    return changed
+
+
+def migrate_database(batch_size: Optional[int] = None) -> Dict[str, int]:
+    """
+    Применить недостающие миграции ко всем коллекциям базы данных
+
+    Returns:
+        Ключ коллекции -> число обновленных записей (для коллекций, к которым
+        применялись миграции)
+    """
+    from app.utils import database_collections
+
+    collections = database_collections()
+    result = {}
+    for filepath in collections:
+        if pending(filepath):
+            result[collection_key(filepath)] = migrate_collection(filepath, batch_size)
+
+    # Коллекции, созданные после прохода, приложение пишет уже в текущей версии;
+    # версии удаленных коллекций (например, шардов архивных проектов) не нужны
+    keys = {collection_key(filepath) for filepath in collections}
+    stale = [entry['id'] for entry in collection_cache.get(Config.SCHEMA_DB)
+             if entry['id'] != ALL and entry['id'] not in keys]
+    collection_cache.save_records(Config.SCHEMA_DB, upserts=[{'id': ALL, 'version': latest_version()}],
+                                  deletes=stale)
+    return result
+
+
+def schema_status() -> List[Any]:
+    """Коллекции базы данных с недостающими миграциями: (ключ, версия, [миграции])"""
+    from app.utils import database_collections
+
+    return [(collection_key(filepath), collection_version(filepath), pending(filepath))
+            for filepath in database_collections() if pending(filepath)]
+
+
+# Подключение обновления при чтении к кэшу коллекций
+collection_cache.upgrader = upgrader
+
+
+# ---------------------------------------------------------------- миграции
+
+def convert_date_format(date_str):
+    """Конвертирует дату из формата YYYY-MM-DD или DD/MM/YYYY в DD.MM.YYYY"""
+    if not date_str or not isinstance(date_str, str):
+        return date_str
+
+    # Проверяем, является ли строка датой в формате YYYY-MM-DD
+    if '-' in date_str and len(date_str) == 10:
+        try:
+            return datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')
+        except ValueError:
+            # Если не получилось распознать формат, возвращаем как есть
+            return date_str
+    elif '/' in date_str and len(date_str) <= 10:
+        # Если формат DD/MM/YYYY, конвертируем в DD.MM.YYYY
+        try:
+            return datetime.strptime(date_str, '%d/%m/%Y').strftime('%d.%m.%Y')
+        except ValueError:
+            return date_str
+    return date_str
+
+
+_DATE_FIELDS = ('start_date', 'end_date', 'deadline', 'created_at', 'completion_date')
+
+
+@migration(1, 'Даты проектов и задач в формате ДД.ММ.ГГГГ', kinds=('projects', 'tasks'))
+def _dates_ddmmyyyy(record):
+    changed = False
+    for field in _DATE_FIELDS:
+        value = record.get(field)
+        if value:
+            converted = convert_date_format(value)
+            if converted != value:
+                record[field] = converted
+                changed = True
+    return changed
+
+
+__all__ = [
+    'ALL',
+    'Migration',
+    'MIGRATIONS',
+    'migration',
+    'latest_version',
+    'collection_key',
+    'collection_version',
+    'pending',
+    'upgrader',
+    'upgrade_records',
+    'set_version',
+    'stamp',
+    'migrate_collection',
+    'migrate_database',
+    'schema_status',
+    'convert_date_format'
+]
@@ -1,38 +1,46 @@
+import threading
+
 from flask_login import UserMixin
-import json
-import os
+from app.directory import user_directory
 from config import Config
 
 app_config = Config()
 
-def load_data(file_path):
-    if not os.path.exists(file_path):
-        return []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def save_data(file_path, data):
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
 class User(UserMixin):
-    def __init__(self, id, username, name, role, token=None):
+    def __init__(self, id, username, name, role, token=None, entry=None):
         self.id = id
         self.username = username
         self.name = name
         self.role = role
         self.token = token
+        # Запись справочника, из которой построен объект (см. load_user)
+        self.entry = entry
         
     def get_projects(self):
-        users = load_data(app_config.USERS_DB)
-        user = next((u for u in users if u['id'] == self.id), None)
-        if user and 'projects' in user:
-            return user['projects']
+        entry = user_directory.get(self.id)
+        if entry is not None and 'projects' in entry:
+            return list(entry['projects'])
         return []
 
+
+# Пользователи, загруженные для сессий: id -> User. Запись справочника
+# заменяется при изменении пользователя (edit_user, смена токена) и удаляется
+# вместе с ним, поэтому объект действителен, пока его запись - текущая.
+# Справочник сверяется с users.json не чаще раза за запрос (app.directory),
+# так что загрузка пользователя сессии - поиск в словаре.
+_users = {}
+_users_lock = threading.Lock()
+
+
 def load_user(user_id):
-    users = load_data(app_config.USERS_DB)
-    user = next((u for u in users if u['id'] == user_id), None)
-    if user:
-        return User(user['id'], user['username'], user['name'], user['role'], user.get('token'))
-    return None
+    entry = user_directory.get(user_id)
+    if entry is None:
+        with _users_lock:
+            _users.pop(user_id, None)
+        return None
+    user = _users.get(user_id)
+    if user is None or user.entry is not entry:
+        user = User(entry['id'], entry['username'], entry.get('name'), entry['role'], entry.get('token'), entry)
+        with _users_lock:
+            _users[user_id] = user
+    return user
@@ -0,0 +1,284 @@
+"""
+packed.py - Упакованное представление коллекций для чтения отдельных полей
+
+Файл <коллекция>.packed строится из JSON-коллекции и содержит заголовок,
+таблицу смещений (для каждой записи и каждого поля - смещение и длина) и
+закодированные в JSON значения полей, сгруппированные по полям. Файл читается через mmap, поэтому при
+переборе разбираются только нужные поля, а сами данные остаются в страничном
+кэше ОС и не увеличивают память рабочего процесса.
+
+Файл является производным: он перестраивается, когда сигнатура исходной
+коллекции (снимок и журнал) перестает совпадать с сохраненной в заголовке.
+"""
+
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app import serializer
+from app.storage import collection_lock
+
+
+MAGIC = b'WMSPACK1'
+
+# Смещения и длины хранятся как uint32 в порядке байт текущей машины:
+# файл используется только там, где построен
+_ITEM = 'I'
+_HEADER = struct.Struct('<8sI')
+
+
+def packed_path(filepath: str) -> str:
+    """Путь к упакованному файлу коллекции"""
+    return filepath + '.packed'
+
+
+def _normalize(signature: Any) -> Any:
+    """Сигнатура в том виде, в котором она сохраняется в заголовке (кортежи -> списки)"""
+    return serializer.loads(serializer.dumps(signature))
+
+
+def write_packed(path: str, records: Iterable[Any], source: Any) -> None:
+    """
+    Построение упакованного файла (атомарно, через временный файл)
+
+    Значения каждого поля записываются подряд в виде JSON-массива (отсутствующие
+    значения - null), а таблица смещений указывает на значение каждой записи
+    внутри него. Поэтому поле разбирается целиком одним вызовом loads(), а
+    отдельная запись читается по смещениям без разбора остальных.
+
+    Записи перебираются один раз, поэтому их можно передавать потоком
+    (JsonBackend.iter_read): в памяти остаются только закодированные значения.
+
+    Args:
+        path: Путь к упакованному файлу
+        records: Записи коллекции
+        source: Сигнатура исходной коллекции, из которой получены записи
+    """
+    fields: Dict[str, int] = {}
+    # Для каждого поля: значения, смещения внутри колонки и длины по позициям записей
+    columns: List[bytearray] = []
+    offsets: List[array] = []
+    lengths: List[array] = []
+    count = 0
+    for record in records:
+        if isinstance(record, dict):
+            for name, value in record.items():
+                column = fields.get(name)
+                if column is None:
+                    # Поле впервые встретилось - в предыдущих записях его нет
+                    column = fields[name] = len(fields)
+                    columns.append(bytearray(b'[' + b','.join([b'null'] * count)))
+                    offsets.append(array(_ITEM, bytes(array(_ITEM).itemsize * count)))
+                    lengths.append(array(_ITEM, bytes(array(_ITEM).itemsize * count)))
+                blob = serializer.dumps(value)
+                data = columns[column]
+                if count:
+                    data += b','
+                offsets[column].append(len(data))
+                lengths[column].append(len(blob))
+                data += blob
+        count += 1
+        if isinstance(record, dict) and len(record) == len(columns):
+            continue
+        for column, data in enumerate(columns):
+            if len(lengths[column]) < count:
+                if count > 1:
+                    data += b','
+                data += b'null'
+                offsets[column].append(0)
+                lengths[column].append(0)
+
+    width = len(fields)
+    index = array(_ITEM, bytes(array(_ITEM).itemsize * 2 * width * count))
+    blobs = bytearray()
+    ranges = []
+    for column, data in enumerate(columns):
+        start = len(blobs)
+        blobs += data
+        blobs += b']'
+        column_lengths = lengths[column]
+        column_offsets = offsets[column]
+        complete = True
+        for position in range(count):
+            length = column_lengths[position]
+            if length:
+                cell = (position * width + column) * 2
+                index[cell] = start + column_offsets[position]
+                index[cell + 1] = length
+            else:
+                complete = False
+        ranges.append([start, len(blobs), complete])
+        columns[column] = None
+
+    header = serializer.dumps({'source': source, 'fields': list(fields), 'columns': ranges,
+                               'count': count})
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, len(header)))
+            f.write(header)
+            index.tofile(f)
+            f.write(blobs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class PackedCollection:
+    """Упакованная коллекция, отображенная в память"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size:
+                raise ValueError(f"Поврежденный файл: {path}")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_size = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Неизвестный формат файла: {path}")
+        start = _HEADER.size + header_size
+        header = serializer.loads(self._map[_HEADER.size:start])
+
+        self.source = header['source']
+        self.fields: List[str] = header['fields']
+        self._column_ranges = header['columns']
+        self._columns = {name: i for i, name in enumerate(self.fields)}
+        self._count = header['count']
+
+        end = start + array(_ITEM).itemsize * 2 * len(self.fields) * self._count
+        if end > size:
+            raise ValueError(f"Поврежденный файл: {path}")
+        self._index = memoryview(self._map)[start:end].cast(_ITEM)
+        self._blobs = end
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, position: int, fields: Iterable[str]) -> Dict[str, Any]:
+        """Указанные поля одной записи по ее позиции (разбираются только они)"""
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        base = position * len(self.fields) * 2
+        record = {}
+        for name in fields:
+            column = self._columns.get(name)
+            if column is None:
+                continue
+            length = self._index[base + column * 2 + 1]
+            if length:
+                offset = self._blobs + self._index[base + column * 2]
+                record[name] = serializer.loads(self._map[offset:offset + length])
+        return record
+
+    def scan(self, fields: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """
+        Перебор записей с разбором только указанных полей
+
+        Args:
+            fields: Имена нужных полей
+
+        Yields:
+            Словари с запрошенными полями (отсутствующие в записи поля пропускаются)
+        """
+        names, values, sparse = [], [], []
+        for name in fields:
+            column = self._columns.get(name)
+            if column is None:
+                continue
+            start, end, complete = self._column_ranges[column]
+            names.append(name)
+            values.append(serializer.loads(self._map[self._blobs + start:self._blobs + end]))
+            if not complete:
+                sparse.append((len(names) - 1, column * 2 + 1))
+
+        if not names:
+            for _ in range(self._count):
+                yield {}
+            return
+        if not sparse:
+            for row in zip(*values):
+                yield dict(zip(names, row))
+            return
+
+        # В неполных колонках null может означать отсутствие поля - проверяем длину
+        index, width = self._index, len(self.fields) * 2
+        for position, row in enumerate(zip(*values)):
+            record = dict(zip(names, row))
+            base = position * width
+            for i, cell in sparse:
+                if not index[base + cell]:
+                    del record[names[i]]
+            yield record
+
+
+_opened: Dict[str, Tuple[Any, PackedCollection]] = {}
+_opened_lock = threading.Lock()
+
+
+def open_packed(filepath: str, backend) -> PackedCollection:
+    """
+    Получить актуальное упакованное представление коллекции
+
+    Файл перестраивается из бэкенда, если его нет или он построен из другой
+    версии коллекции. Открытые отображения кэшируются по сигнатуре.
+
+    Args:
+        filepath: Путь к файлу коллекции
+        backend: Бэкенд хранения JSON (JsonBackend)
+    """
+    signature = _normalize(backend.signature(filepath))
+    opened = _opened.get(filepath)
+    if opened is not None and opened[0] == signature:
+        return opened[1]
+
+    with _opened_lock:
+        opened = _opened.get(filepath)
+        if opened is not None and opened[0] == signature:
+            return opened[1]
+
+        path = packed_path(filepath)
+        packed: Optional[PackedCollection] = None
+        try:
+            packed = PackedCollection(path)
+        except (OSError, ValueError, KeyError, serializer.JSONDecodeError):
+            packed = None
+
+        if packed is None or packed.source != signature:
+            with collection_lock(filepath, exclusive=False):
+                # Сигнатура снимается до чтения: если коллекция изменится во время
+                # чтения, следующий вызов увидит расхождение и перестроит файл
+                signature = _normalize(backend.signature(filepath))
+                if not backend.exists(filepath):
+                    records = []
+                elif backend.streamed(filepath):
+                    # Снимок открыт и журнал прочитан под блокировкой, разбор - после нее
+                    records = backend.iter_read(filepath)
+                else:
+                    records = backend.read(filepath)
+            write_packed(path, records, signature)
+            packed = PackedCollection(path)
+
+        # Прежнее отображение закрывается сборщиком мусора, когда
+        # завершатся начатые по нему переборы
+        _opened[filepath] = (signature, packed)
+        return packed
+
+
+def scan_packed(filepath: str, backend, fields: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Перебор записей коллекции через упакованный файл (см. PackedCollection.scan)"""
+    return open_packed(filepath, backend).scan(list(fields))
+
+
+__all__ = [
+    'packed_path',
+    'write_packed',
+    'PackedCollection',
+    'open_packed',
+    'scan_packed'
+]
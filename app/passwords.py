@@ -0,0 +1,132 @@
+"""
+passwords.py - Хэширование и проверка паролей
+
+Политика хэширования задается Config.PASSWORD_HASH_METHOD и
+Config.PASSWORD_SALT_LENGTH (методы werkzeug.security). Хэш, созданный по
+другой политике (старый метод, короткая соль), пересчитывается при
+следующем успешном входе пользователя.
+
+Проверка пароля при входе выполняется в ограниченном пуле потоков
+(Config.PASSWORD_WORKERS): при массовом входе хэши считаются не больше чем
+в PASSWORD_WORKERS потоках, а остальные запросы приложения обслуживаются
+как обычно. В очереди пула - не больше Config.PASSWORD_QUEUE проверок,
+с одного адреса клиента - не больше PASSWORD_PER_CLIENT (0 - без лимита на
+клиента; за обратным прокси он имеет смысл только с PROXY_FIX_X_FOR, иначе
+все входы идут с адреса прокси); сверх этого проверка отклоняется
+(PasswordPoolBusy) без вычисления хэша.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from config import Config
+
+
+def hash_password(password: str) -> str:
+    """Хэш пароля по текущей политике"""
+    return generate_password_hash(password, method=Config.PASSWORD_HASH_METHOD,
+                                  salt_length=Config.PASSWORD_SALT_LENGTH)
+
+
+def hash_passwords(passwords: List[str], workers: int) -> List[str]:
+    """Хэши паролей по текущей политике, вычисленные в workers потоках (для массовой загрузки)"""
+    if workers <= 1 or len(passwords) <= 1:
+        return [hash_password(password) for password in passwords]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-bulk') as executor:
+        return list(executor.map(hash_password, passwords))
+
+
+_policy_method: Optional[str] = None
+
+
+def _method(password_hash: str) -> str:
+    return password_hash.split('$', 1)[0]
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """Создан ли хэш не по текущей политике (метод с параметрами или длина соли)"""
+    global _policy_method
+    if _policy_method is None:
+        # Полное имя метода с параметрами по умолчанию (например, scrypt:32768:8:1)
+        _policy_method = _method(hash_password(''))
+    parts = password_hash.split('$')
+    return len(parts) != 3 or parts[0] != _policy_method or len(parts[1]) < Config.PASSWORD_SALT_LENGTH
+
+
+class PasswordPoolBusy(Exception):
+    """Превышено число одновременных проверок паролей (с адреса клиента или всего)"""
+
+
+class PasswordPool:
+    """Ограниченный пул потоков для проверки паролей с лимитом на клиента"""
+
+    def __init__(self, workers: int, per_client: int, queue: int):
+        self.workers = workers
+        self.per_client = per_client
+        self.queue = queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Адрес клиента -> число его проверок в работе; всего проверок в пуле
+        self._clients: Dict[Any, int] = {}
+        self._pending = 0
+
+    def verify(self, password_hash: str, password: str, client: Any = None) -> bool:
+        """
+        Проверить пароль в пуле (вызывающий поток ждет результата)
+
+        Raises:
+            PasswordPoolBusy: лимит проверок клиента или очереди пула исчерпан
+        """
+        self._enter(client)
+        try:
+            return self._submit(check_password_hash, password_hash, password)
+        finally:
+            self._leave(client)
+
+    def hash(self, password: str) -> str:
+        """Хэш пароля по текущей политике, вычисленный в пуле"""
+        return self._submit(hash_password, password)
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # Потоки пула не переживают fork рабочего процесса
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+            executor = self._executor
+        return executor.submit(fn, *args).result()
+
+    def _enter(self, client: Any) -> None:
+        with self._lock:
+            active = self._clients.get(client, 0)
+            if self._pending >= self.queue or 0 < self.per_client <= active:
+                raise PasswordPoolBusy(client)
+            self._clients[client] = active + 1
+            self._pending += 1
+
+    def _leave(self, client: Any) -> None:
+        with self._lock:
+            self._pending -= 1
+            active = self._clients.get(client, 0) - 1
+            if active > 0:
+                self._clients[client] = active
+            else:
+                self._clients.pop(client, None)
+
+
+password_pool = PasswordPool(Config.PASSWORD_WORKERS, Config.PASSWORD_PER_CLIENT, Config.PASSWORD_QUEUE)
+
+
+__all__ = [
+    'hash_password',
+    'hash_passwords',
+    'needs_rehash',
+    'PasswordPoolBusy',
+    'PasswordPool',
+    'password_pool'
+]
@@ -0,0 +1,209 @@
+"""
+provisioning.py - Массовое создание пользователей и приглашений
+
+Пакет - список строк: JSON-массив объектов (или {"users": [...]}) либо CSV
+с заголовком. Поля строки:
+    username - логин; строка без логина выдает токен приглашения
+    name     - имя пользователя (по умолчанию логин)
+    role     - роль (id из get_available_roles)
+    password - пароль; если не задан, генерируется и возвращается в результате
+    projects - id проектов (в CSV - через ';'): пользователь добавляется в их
+               команды; приглашение выдается в проект (не больше одного)
+
+Пакет сначала проверяется целиком (роли, проекты, повторяющиеся и занятые
+логины); при ошибках не записывается ничего. Затем пароли хэшируются
+параллельно, и пользователи, токены и команды проектов записываются одной
+транзакцией - по одной записи в каждую коллекцию независимо от размера пакета.
+"""
+
+import csv
+import io
+import json
+import secrets
+import uuid
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from app.passwords import hash_passwords
+from app.storage import collection_cache, collection_locks, thaw
+from app.tokens import token_store
+
+
+# Длина генерируемого пароля (символов)
+PASSWORD_LENGTH = 12
+
+_FIELDS = ('username', 'name', 'role', 'password', 'projects')
+
+
+class ProvisionResult:
+    """Итог массового создания: созданные пользователи, приглашения и ошибки пакета"""
+
+    __slots__ = ('users', 'invitations', 'errors')
+
+    def __init__(self):
+        # {'id', 'username', 'name', 'role', 'projects'} и 'password', если он сгенерирован
+        self.users: List[Dict[str, Any]] = []
+        # {'token', 'role', 'project_id'}
+        self.invitations: List[Dict[str, Any]] = []
+        # 'строка N: ...'
+        self.errors: List[str] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'users': self.users, 'invitations': self.invitations, 'errors': self.errors}
+
+
+def _row(raw: Any) -> Dict[str, Any]:
+    if not isinstance(raw, dict):
+        raise ValueError('строка пакета должна быть объектом')
+    row = {field: (raw.get(field) or '') for field in _FIELDS}
+    for field in ('username', 'name', 'role', 'password'):
+        row[field] = str(row[field]).strip()
+    projects = row['projects']
+    if isinstance(projects, str):
+        projects = projects.split(';')
+    row['projects'] = [str(project_id).strip() for project_id in projects if str(project_id).strip()]
+    return row
+
+
+def parse_batch(text: str, fmt: str) -> List[Dict[str, Any]]:
+    """
+    Разобрать пакет в формате fmt ('json' или 'csv')
+
+    Raises:
+        ValueError: пакет не разбирается или формат неизвестен
+    """
+    if fmt == 'json':
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'некорректный JSON: {e}')
+        if isinstance(data, dict):
+            data = data.get('users')
+        if not isinstance(data, list):
+            raise ValueError('ожидается массив пользователей')
+        return [_row(raw) for raw in data]
+    if fmt == 'csv':
+        return [_row(raw) for raw in csv.DictReader(io.StringIO(text))]
+    raise ValueError(f'неизвестный формат пакета: {fmt}')
+
+
+def validate(rows: List[Dict[str, Any]]) -> List[str]:
+    """Ошибки пакета (пустой список - пакет можно загружать)"""
+    from app.utils import get_available_roles
+
+    roles = {role['id'] for role in get_available_roles()}
+    users = collection_cache.index(Config.USERS_DB)
+    projects = collection_cache.index(Config.PROJECTS_DB)
+    errors = []
+    seen = set()
+    for number, row in enumerate(rows, start=1):
+        if row['role'] not in roles:
+            errors.append(f"строка {number}: неизвестная роль '{row['role']}'")
+        for project_id in row['projects']:
+            if projects.get(project_id) is None:
+                errors.append(f"строка {number}: нет проекта {project_id}")
+        username = row['username']
+        if not username:
+            if row['password']:
+                errors.append(f"строка {number}: пароль задан для приглашения без логина")
+            if len(row['projects']) > 1:
+                errors.append(f"строка {number}: приглашение выдается не больше чем в один проект")
+            continue
+        if username in seen:
+            errors.append(f"строка {number}: логин {username} повторяется в пакете")
+        elif users.filter('username', username):
+            errors.append(f"строка {number}: пользователь {username} уже существует")
+        seen.add(username)
+    return errors
+
+
+def _user_id(taken: Any, batch: set) -> str:
+    while True:
+        user_id = str(uuid.uuid4())[:8]
+        if user_id not in batch and taken.get(user_id) is None:
+            batch.add(user_id)
+            return user_id
+
+
+def provision(rows: List[Dict[str, Any]], workers: Optional[int] = None, dry_run: bool = False) -> ProvisionResult:
+    """
+    Создать пользователей и приглашения пакета
+
+    Args:
+        rows: Строки пакета (см. parse_batch)
+        workers: Число потоков хэширования паролей (по умолчанию Config.PASSWORD_WORKERS)
+        dry_run: Только проверить пакет
+
+    Returns:
+        ProvisionResult; если в нем есть ошибки, ничего не записано
+    """
+    result = ProvisionResult()
+    result.errors = validate(rows)
+    if result.errors or dry_run:
+        return result
+
+    accounts = [row for row in rows if row['username']]
+    generated = {}
+    for index, row in enumerate(accounts):
+        if not row['password']:
+            generated[index] = secrets.token_urlsafe(PASSWORD_LENGTH)[:PASSWORD_LENGTH]
+    # Хэширование - до блокировок коллекций: оно занимает большую часть времени
+    hashes = hash_passwords([row['password'] or generated[index] for index, row in enumerate(accounts)],
+                            workers or Config.PASSWORD_WORKERS)
+
+    with collection_locks([Config.USERS_DB, Config.TOKENS_DB, Config.PROJECTS_DB]):
+        # Пакет мог устареть, пока считались хэши (параллельная регистрация, удаление проекта)
+        result.errors = validate(rows)
+        if result.errors:
+            return result
+
+        users_index = collection_cache.index(Config.USERS_DB)
+        projects_index = collection_cache.index(Config.PROJECTS_DB)
+        user_ids = set()
+        users, tokens, teams = [], [], {}
+        for index, row in enumerate(accounts):
+            user = {
+                'id': _user_id(users_index, user_ids),
+                'username': row['username'],
+                'password': hashes[index],
+                'name': row['name'] or row['username'],
+                'role': row['role'],
+                'token': str(uuid.uuid4())[:8].upper(),
+                'projects': []
+            }
+            users.append(user)
+            for project_id in row['projects']:
+                if project_id not in teams:
+                    teams[project_id] = thaw(projects_index.get(project_id))
+                team = teams[project_id].setdefault('team', [])
+                if user['id'] not in team:
+                    team.append(user['id'])
+            created = {field: user[field] for field in ('id', 'username', 'name', 'role')}
+            created['projects'] = row['projects']
+            if index in generated:
+                created['password'] = generated[index]
+            result.users.append(created)
+
+        for row in rows:
+            if row['username']:
+                continue
+            project_id = row['projects'][0] if row['projects'] else None
+            token = token_store.new(role=row['role'], project_id=project_id)
+            tokens.append(token)
+            result.invitations.append({'token': token['id'], 'role': row['role'], 'project_id': project_id})
+
+        collection_cache.save_transaction({
+            Config.USERS_DB: (users, []),
+            Config.TOKENS_DB: (tokens, []),
+            Config.PROJECTS_DB: (list(teams.values()), [])
+        })
+    return result
+
+
+__all__ = [
+    'PASSWORD_LENGTH',
+    'ProvisionResult',
+    'parse_batch',
+    'validate',
+    'provision'
+]
@@ -0,0 +1,322 @@
+"""
+records.py - Компактные классы записей коллекций (__slots__)
+
+Записи задач, проектов, пользователей, токенов и дочерних коллекций задач
+хранятся в кэше процесса не словарями, а объектами со слотами: имена полей
+не повторяются в каждой записи, а даты хранятся разобранными (date/datetime).
+
+Снаружи запись ведет себя как неизменяемый словарь: get(), [], in, keys(),
+items(), сравнение со словарем. Даты при этом возвращаются в исходном
+строковом виде, поэтому шаблоны, jsonify и код, разбирающий строки дат,
+работают как раньше; разобранное значение доступно через date().
+Изменяемая копия (обычный dict) - thaw() из app.storage или to_dict().
+"""
+
+import os
+import sys
+from collections.abc import Mapping
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+
+# Форматы дат в коллекциях
+DATE = '%d.%m.%Y'
+DATETIME = '%d.%m.%Y %H:%M:%S'
+
+_MISSING = object()
+
+
+def _parse_date(value: Any, fmt: str) -> Any:
+    """
+    Разбор строки даты в date/datetime
+
+    Разбирается только строка ровно в формате fmt (с ведущими нулями), чтобы
+    обратное форматирование давало ту же строку; иначе значение хранится как есть.
+    """
+    if not isinstance(value, str) or not value.isascii():
+        return value
+    try:
+        if fmt == DATE and len(value) == 10 and value[2] == value[5] == '.':
+            day, month, year = value[:2], value[3:5], value[6:]
+            if (day + month + year).isdigit():
+                return date(int(year), int(month), int(day))
+        elif fmt == DATETIME and len(value) == 19 and value[2] == value[5] == '.' \
+                and value[10] == ' ' and value[13] == value[16] == ':':
+            parts = (value[6:10], value[3:5], value[:2], value[11:13], value[14:16], value[17:19])
+            if ''.join(parts).isdigit():
+                return datetime(*map(int, parts))
+    except ValueError:
+        pass
+    return value
+
+
+def _format_date(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return (f'{value.day:02d}.{value.month:02d}.{value.year:04d} '
+                f'{value.hour:02d}:{value.minute:02d}:{value.second:02d}')
+    if isinstance(value, date):
+        return f'{value.day:02d}.{value.month:02d}.{value.year:04d}'
+    return value
+
+
+def _date_getter(field: str):
+    def getter(self):
+        value = self._value(field)
+        if value is _MISSING:
+            raise AttributeError(field)
+        return value
+    return getter
+
+
+class Record(Mapping):
+    """
+    Базовый класс записи коллекции
+
+    В подклассах:
+        __slots__: имена полей; поля-даты записываются с префиксом '_'
+        DATES: поле-дата -> формат (DATE или DATETIME)
+        INTERN: строковые поля с повторяющимися значениями (id связей, статусы),
+            значения которых интернируются и хранятся в одном экземпляре
+        NESTED: поле -> класс записи для вложенного словаря
+
+    Отсутствующее в записи поле - незаполненный слот; поля, не описанные
+    в классе, хранятся в словаре _extra.
+    """
+
+    __slots__ = ('_extra',)
+
+    DATES: Dict[str, str] = {}
+    INTERN: Tuple[str, ...] = ()
+    NESTED: Dict[str, type] = {}
+
+    # Заполняются в __init_subclass__: поле -> имя слота (в порядке полей),
+    # поле -> функция записи слота
+    _SLOTS: Dict[str, str] = {}
+    _SETTERS: Dict[str, Any] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        slots = {}
+        for klass in reversed(cls.__mro__):
+            for slot in klass.__dict__.get('__slots__', ()):
+                if slot == '_extra':
+                    continue
+                field = slot[1:] if slot.startswith('_') else slot
+                slots[field] = slot
+        for field in cls.DATES:
+            if slots.get(field) != '_' + field:
+                raise TypeError(f"{cls.__name__}: поле-дата {field} должно храниться в слоте _{field}")
+        cls._SLOTS = slots
+        cls._SETTERS = {field: getattr(cls, slot).__set__ for field, slot in slots.items()}
+        for field in cls.DATES:
+            # Атрибут с именем поля (например, task.deadline в шаблонах) - исходная строка
+            setattr(cls, field, property(_date_getter(field)))
+
+    def __init__(self, items: Union[Mapping, Iterable[Tuple[str, Any]]] = ()):
+        if isinstance(items, Mapping):
+            items = items.items()
+        extra = None
+        setters, dates, interned = self._SETTERS, self.DATES, self.INTERN
+        for key, value in items:
+            setter = setters.get(key)
+            if setter is None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+                continue
+            if key in dates:
+                value = _parse_date(value, dates[key])
+            elif key in interned and type(value) is str:
+                value = sys.intern(value)
+            setter(self, value)
+        object.__setattr__(self, '_extra', extra)
+
+    def __setattr__(self, name, value):
+        raise TypeError('Данные из кэша доступны только для чтения, используйте load_data() для изменения')
+
+    __delattr__ = __setattr__
+
+    def _value(self, key: str) -> Any:
+        slot = self._SLOTS.get(key)
+        if slot is None:
+            extra = self._extra
+            return extra.get(key, _MISSING) if extra else _MISSING
+        value = getattr(self, slot, _MISSING)
+        if value is not _MISSING and key in self.DATES:
+            value = _format_date(value)
+        return value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._value(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._value(key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key: object) -> bool:
+        slot = self._SLOTS.get(key)
+        if slot is None:
+            return bool(self._extra) and key in self._extra
+        return hasattr(self, slot)
+
+    def __iter__(self) -> Iterator[str]:
+        for field, slot in self._SLOTS.items():
+            if hasattr(self, slot):
+                yield field
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.to_dict() == other.to_dict()
+        if isinstance(other, Mapping):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Словарь с полями записи (вложенные значения не копируются)"""
+        return {key: self[key] for key in self}
+
+    def copy(self) -> Dict[str, Any]:
+        """Поверхностная изменяемая копия (как dict.copy())"""
+        return self.to_dict()
+
+    def __copy__(self):
+        return self.to_dict()
+
+    def __deepcopy__(self, memo):
+        from app.storage import thaw
+        return thaw(self)
+
+    def __reduce__(self):
+        from app.storage import thaw
+        return (type(self), (thaw(self),))
+
+    def date(self, field: str) -> Optional[Union[date, datetime]]:
+        """
+        Разобранное значение поля-даты
+
+        Returns:
+            date/datetime или None, если поле отсутствует, пусто или не в формате DATES
+        """
+        slot = self._SLOTS.get(field)
+        value = getattr(self, slot, None) if slot is not None else None
+        return value if isinstance(value, date) else None
+
+
+class Task(Record):
+    """Задача (без дочерних списков - они хранятся в отдельных коллекциях)"""
+
+    __slots__ = ('id', 'project_id', 'title', 'description', 'assignee_id', 'created_by',
+                 '_created_at', '_start_date', '_deadline', 'status', '_completion_date')
+    DATES = {'created_at': DATE, 'start_date': DATE, 'deadline': DATE, 'completion_date': DATE}
+    INTERN = ('project_id', 'assignee_id', 'created_by', 'status')
+
+
+class Subtask(Record):
+    """Подзадача"""
+
+    __slots__ = ('id', 'title', 'completed', '_planned_date', '_completed_date', 'report', 'file',
+                 '_created_at', 'created_by')
+    DATES = {'planned_date': DATE, 'completed_date': DATE, 'created_at': DATETIME}
+    INTERN = ('created_by',)
+
+
+class Project(Record):
+    """Проект"""
+
+    __slots__ = ('id', 'name', 'description', 'direction', 'expected_result', '_start_date',
+                 '_end_date', '_last_activity', 'status', 'supervisor_id', 'manager_id', 'team',
+                 'initiator_type', 'initiator_name')
+    DATES = {'start_date': DATE, 'end_date': DATE, 'last_activity': DATE}
+    INTERN = ('direction', 'status', 'supervisor_id', 'manager_id', 'initiator_type')
+
+
+class User(Record):
+    """Пользователь"""
+
+    __slots__ = ('id', 'username', 'password', 'name', 'role', 'token', 'projects')
+    INTERN = ('role',)
+
+
+class Token(Record):
+    """Токен приглашения"""
+
+    __slots__ = ('id', 'role', 'project_id', '_created_at', '_expires_at', 'used', 'user_id')
+    DATES = {'created_at': DATETIME, 'expires_at': DATETIME}
+    INTERN = ('role', 'project_id', 'user_id')
+
+
+class TaskManifestEntry(Record):
+    """Запись манифеста задач: task_id -> project_id"""
+
+    __slots__ = ('id', 'project_id')
+    INTERN = ('project_id',)
+
+
+class TaskChild(Record):
+    """Элемент дочернего списка задачи (история, отчеты, файлы)"""
+
+    __slots__ = ('id', 'task_id', 'data')
+    INTERN = ('task_id',)
+
+
+class TaskSubtask(TaskChild):
+    """Подзадача в коллекции подзадач"""
+
+    __slots__ = ()
+    NESTED = {'data': Subtask}
+
+
+# Вид коллекции (имя файла до '__') -> класс записей
+RECORD_CLASSES = {
+    'tasks': Task,
+    'projects': Project,
+    'users': User,
+    'tokens': Token,
+    'task_manifest': TaskManifestEntry,
+    'task_history': TaskChild,
+    'task_reports': TaskChild,
+    'task_files': TaskChild,
+    'task_subtasks': TaskSubtask
+}
+
+
+def record_class(filepath: str) -> Optional[type]:
+    """Класс записей коллекции по пути к ее файлу (None - записи остаются словарями)"""
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    return RECORD_CLASSES.get(name.split('__', 1)[0])
+
+
+__all__ = [
+    'DATE',
+    'DATETIME',
+    'Record',
+    'Task',
+    'Subtask',
+    'Project',
+    'User',
+    'Token',
+    'TaskManifestEntry',
+    'TaskChild',
+    'TaskSubtask',
+    'RECORD_CLASSES',
+    'record_class'
+]
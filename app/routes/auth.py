@@ -1,8 +1,9 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from app.models import User, load_user
-from app.utils import load_data, save_data, init_database, validate_token, mark_token_as_used, get_available_roles, load_directions, save_directions
+from app.passwords import hash_password, needs_rehash, password_pool, PasswordPoolBusy
+from app.provisioning import parse_batch, provision
+from app.utils import load_view, load_index, load_record, find_user, find_user_by_username, save_record, update_record, delete_record, init_database, validate_token, mark_token_as_used, get_available_roles, load_directions
 import uuid
 from datetime import datetime
 from config import Config
@@ -27,8 +28,7 @@ def register():
             flash('Неверный или использованный токен')
             return render_template('register.html', roles=get_available_roles())
         
-        users = load_data(app_config.USERS_DB)
-        if any(user['username'] == username for user in users):
+        if find_user_by_username(username) is not None:
             flash('Пользователь с таким логином уже существует')
             return render_template('register.html', roles=get_available_roles())
         
@@ -36,26 +36,23 @@ def register():
         new_user = {
             "id": str(uuid.uuid4())[:8],
             "username": username,
-            "password": generate_password_hash(password),
+            "password": hash_password(password),
             "name": name,
             "role": token_info['role'],
             "token": display_token,
             "projects": []
         }
         
-        users.append(new_user)
-        save_data(app_config.USERS_DB, users)
+        save_record(app_config.USERS_DB, new_user)
         
         if token_info['role'] == 'worker' and token_info['project_id']:
-            projects = load_data(app_config.PROJECTS_DB)
-            for project in projects:
-                if project['id'] == token_info['project_id']:
-                    team = project.get('team', [])
-                    if new_user['id'] not in team:
-                        team.append(new_user['id'])
-                        project['team'] = team
-                    break
-            save_data(app_config.PROJECTS_DB, projects)
+            def join_team(project):
+                team = project.get('team', [])
+                if new_user['id'] not in team:
+                    team.append(new_user['id'])
+                    project['team'] = team
+
+            update_record(app_config.PROJECTS_DB, token_info['project_id'], join_team)
         
         mark_token_as_used(token)
         
@@ -78,19 +75,30 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        users = load_data(app_config.USERS_DB)
-        
-        if not users:
+        if not load_index(app_config.USERS_DB).ids():
             flash('База данных пользователей пуста. Обратитесь к администратору.')
             return render_template('login.html')
         
-        user = None
-        for u in users:
-            if u['username'] == username:
-                user = u
-                break
+        user = find_user_by_username(username)
         
-        if user and check_password_hash(user['password'], password):
+        try:
+            verified = user is not None and password_pool.verify(user['password'], password, request.remote_addr)
+        except PasswordPoolBusy:
+            flash('Слишком много одновременных попыток входа. Повторите через несколько секунд.')
+            return render_template('login.html'), 429
+        
+        if verified:
+            if needs_rehash(user['password']):
+                # Хэш по старой политике заменяется, пока известен пароль
+                old_hash, password_hash = user['password'], password_pool.hash(password)
+                
+                def rehash(record):
+                    if record.get('password') != old_hash:
+                        return False
+                    record['password'] = password_hash
+                
+                update_record(app_config.USERS_DB, user['id'], rehash)
+            
             user_id = user.get('id', str(uuid.uuid4())[:8])
             username = user.get('username', 'unknown')
             name = user.get('name', username)
@@ -117,18 +125,19 @@ def logout():
 @auth_bp.route('/profile')
 @login_required
 def profile():
-    users = load_data(app_config.USERS_DB)
-    user_data = next((u for u in users if u['id'] == current_user.id), None)
-    projects = load_data(app_config.PROJECTS_DB)
+    user_data = find_user(current_user.id)
+    projects_index = load_index(app_config.PROJECTS_DB)
     
     if current_user.role == 'admin':
-        visible_projects = projects
+        visible_projects = load_view(app_config.PROJECTS_DB)
     elif current_user.role == 'manager':
-        visible_projects = [p for p in projects if p.get('manager_id', '') == current_user.id or p.get('supervisor_id', '') == current_user.id]
+        managed = projects_index.filter('manager_id', current_user.id)
+        supervised = [p for p in projects_index.filter('supervisor_id', current_user.id) if p not in managed]
+        visible_projects = list(managed) + supervised
     elif current_user.role == 'supervisor':
-        visible_projects = [p for p in projects if p.get('supervisor_id', '') == current_user.id]
+        visible_projects = list(projects_index.filter('supervisor_id', current_user.id))
     else:
-        visible_projects = [p for p in projects if current_user.id in p.get('team', [])]
+        visible_projects = list(projects_index.filter('team', current_user.id))
     
     return render_template('profile.html', user_data=user_data, projects=visible_projects)
 
@@ -140,10 +149,30 @@ def admin_users():
         flash('У вас нет доступа к этой странице')
         return redirect(url_for('dashboard.dashboard'))
     
-    users = load_data(app_config.USERS_DB)
+    users = load_view(app_config.USERS_DB)
     return render_template('admin_users.html', users=users)
 
 
+@auth_bp.route('/admin/users/provision', methods=['POST'])
+@login_required
+def provision_users():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Нет доступа'}), 403
+    
+    # Пакет - JSON в теле запроса или файл CSV/JSON в поле file (см. app/provisioning.py)
+    upload = request.files.get('file')
+    try:
+        if upload is not None:
+            fmt = 'csv' if (upload.filename or '').lower().endswith('.csv') else 'json'
+            rows = parse_batch(upload.read().decode('utf-8-sig'), fmt)
+        else:
+            rows = parse_batch(request.get_data(as_text=True), 'json')
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': f'Не удалось разобрать пакет: {e}'}), 400
+    
+    result = provision(rows, dry_run=request.args.get('dry_run') == 'true')
+    return jsonify(result.to_dict()), 400 if result.errors else 200
+
 @auth_bp.route('/admin/directions')
 @login_required
 def admin_directions():
@@ -166,10 +195,8 @@ def add_direction():
         flash('Название направления не может быть пустым')
         return redirect(url_for('auth.admin_directions'))
     
-    directions = load_directions()
     new_id = str(uuid.uuid4())[:8]
-    directions.append({'id': new_id, 'name': name})
-    save_directions(directions)
+    save_record(app_config.DIRECTIONS_DB, {'id': new_id, 'name': name})
     
     flash('Направление успешно добавлено')
     return redirect(url_for('auth.admin_directions'))
@@ -181,9 +208,7 @@ def delete_direction(direction_id):
     if current_user.role != 'admin':
         return jsonify({'error': 'Нет доступа'}), 403
     
-    directions = load_directions()
-    directions = [d for d in directions if d['id'] != direction_id]
-    save_directions(directions)
+    delete_record(app_config.DIRECTIONS_DB, direction_id)
     
     flash('Направление успешно удалено')
     return redirect(url_for('auth.admin_directions'))
@@ -196,26 +221,23 @@ def edit_user(user_id):
         flash('У вас нет доступа к этой странице')
         return redirect(url_for('dashboard.dashboard'))
     
-    users = load_data(app_config.USERS_DB)
-    user = next((u for u in users if u['id'] == user_id), None)
+    user = load_record(app_config.USERS_DB, user_id)
     
     if not user:
         flash('Пользователь не найден')
         return redirect(url_for('auth.admin_users'))
     
     if request.method == 'POST':
-        user['name'] = request.form['name'].strip()
-        user['role'] = request.form['role']
-        
-        if request.form['password']:
-            user['password'] = generate_password_hash(request.form['password'])
+        password_hash = hash_password(request.form['password']) if request.form['password'] else None
         
-        for i, u in enumerate(users):
-            if u['id'] == user_id:
-                users[i] = user
-                break
+        def apply_form(user):
+            user['name'] = request.form['name'].strip()
+            user['role'] = request.form['role']
+            
+            if password_hash:
+                user['password'] = password_hash
         
-        save_data(app_config.USERS_DB, users)
+        update_record(app_config.USERS_DB, user_id, apply_form)
         flash('Пользователь успешно обновлен')
         return redirect(url_for('auth.admin_users'))
     
@@ -229,9 +251,7 @@ def delete_user(user_id):
         flash('У вас нет доступа к этой странице')
         return redirect(url_for('dashboard.dashboard'))
     
-    users = load_data(app_config.USERS_DB)
-    
-    user = next((u for u in users if u['id'] == user_id), None)
+    user = find_user(user_id)
     if not user:
         flash('Пользователь не найден')
         return redirect(url_for('auth.admin_users'))
@@ -240,8 +260,7 @@ def delete_user(user_id):
         flash('Нельзя удалить самого себя')
         return redirect(url_for('auth.admin_users'))
     
-    users = [u for u in users if u['id'] != user_id]
-    save_data(app_config.USERS_DB, users)
+    delete_record(app_config.USERS_DB, user_id)
     
     flash('Пользователь успешно удален')
     return redirect(url_for('auth.admin_users'))
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import login_required, current_user
-from app.utils import load_data, save_data, can_access_project, get_available_roles
+from app.utils import load_view, load_index, load_tasks, load_tasks_index, load_project_tasks, load_archived_projects, scan_records, scan_tasks
+from app.directory import user_directory
 from config import Config
 import uuid
 from datetime import datetime
@@ -18,9 +19,9 @@ def index():
 @dashboard_bp.route('/dashboard')
 @login_required
 def dashboard():
-    projects = load_data(app_config.PROJECTS_DB)
-    tasks = load_data(app_config.TASKS_DB)
-    users = load_data(app_config.USERS_DB)
+    projects = load_view(app_config.PROJECTS_DB)
+    users = load_view(app_config.USERS_DB)
+    projects_index = load_index(app_config.PROJECTS_DB)
     
     # Получаем параметры фильтрации из запроса
     search_query = request.args.get('search', '').strip().lower()
@@ -39,11 +40,11 @@ def dashboard():
     if role == 'admin':
         visible_projects = projects
     elif role == 'curator':
-        visible_projects = [p for p in projects if p.get('supervisor_id', '') == current_user.id]
+        visible_projects = list(projects_index.filter('supervisor_id', current_user.id))
     elif role == 'manager':
-        visible_projects = [p for p in projects if p.get('manager_id', '') == current_user.id]
+        visible_projects = list(projects_index.filter('manager_id', current_user.id))
     else:  # executor
-        visible_projects = [p for p in projects if current_user.id in p.get('team', [])]
+        visible_projects = list(projects_index.filter('team', current_user.id))
 
     # Применяем фильтры поиска
     filtered_projects = visible_projects
@@ -67,12 +68,11 @@ def dashboard():
     # таски
     user_tasks = []
     if role == 'admin':
-        user_tasks = tasks
+        user_tasks = load_tasks()
     elif role in ['curator', 'manager']:
-        project_ids = [p['id'] for p in visible_projects]
-        user_tasks = [t for t in tasks if t['project_id'] in project_ids]
+        user_tasks = [t for p in visible_projects for t in load_project_tasks(p['id'])]
     else:  # executor
-        user_tasks = [t for t in tasks if t['assignee_id'] == current_user.id]
+        user_tasks = list(load_tasks_index().filter('assignee_id', current_user.id))
     
     # Подготовка статистики в зависимости от роли
     stats = {}
@@ -90,7 +90,7 @@ def dashboard():
     elif role == 'curator':
         # Статистика для куратора
         my_projects = visible_projects
-        my_project_tasks = [t for t in tasks if t['project_id'] in [p['id'] for p in my_projects]]
+        my_project_tasks = user_tasks
         
         stats = {
             'my_active_projects': len([p for p in my_projects if p['status'] == 'в работе']),
@@ -102,12 +102,12 @@ def dashboard():
     elif role == 'manager':
         # Статистика для менеджера
         my_projects = visible_projects
-        my_project_tasks = [t for t in tasks if t['project_id'] in [p['id'] for p in my_projects]]
+        my_project_tasks = user_tasks
         
         stats = {
             'my_manager_active_projects': len([p for p in my_projects if p['status'] == 'в работе']),
             'my_manager_paused_projects': len([p for p in my_projects if p['status'] in ['приостановлен', 'отложен']]),
-            'projects_with_overdue_tasks_count': len(get_projects_with_overdue_tasks(my_projects, tasks)),
+            'projects_with_overdue_tasks_count': len(get_projects_with_overdue_tasks(my_projects, my_project_tasks)),
             'my_manager_executors_count': len(set([uid for p in my_projects for uid in p.get('team', [])]))
         }
     else:  # executor
@@ -122,20 +122,33 @@ def dashboard():
             'executor_overdue_tasks': len(get_overdue_tasks_for_executor(current_user.id, my_tasks))
         }
     
+    # Завершенные проекты из архива (app.archive) читаются, только если их нужно показать
+    listed_projects = visible_projects
+    if show_completed:
+        if role == 'admin':
+            archived_projects = load_archived_projects()
+        elif role == 'curator':
+            archived_projects = load_archived_projects(('supervisor_id', current_user.id))
+        elif role == 'manager':
+            archived_projects = load_archived_projects(('manager_id', current_user.id))
+        else:
+            archived_projects = load_archived_projects(('team', current_user.id))
+        listed_projects = list(visible_projects) + archived_projects
+
     # Добавляем информацию о пользователях к каждому проекту
     enhanced_projects = []
-    for project in visible_projects:
+    for project in listed_projects:
         # Получаем информацию о кураторе (руководителе направления)
         manager_info = None
         if project.get('manager_id'):
-            manager = next((u for u in users if u.get('id') == project['manager_id']), None)
+            manager = user_directory.get(project['manager_id'])
             if manager:
                 manager_info = {'id': manager['id'], 'name': manager.get('name', manager.get('full_name', 'Не указано'))}
         
         # Получаем информацию о руководителе проекта
         supervisor_info = None
         if project.get('supervisor_id'):
-            supervisor = next((u for u in users if u.get('id') == project['supervisor_id']), None)
+            supervisor = user_directory.get(project['supervisor_id'])
             if supervisor:
                 supervisor_info = {'id': supervisor['id'], 'name': supervisor.get('name', supervisor.get('full_name', 'Не указано'))}
         
@@ -182,13 +195,14 @@ def get_overdue_projects(projects):
 def get_projects_with_overdue_tasks(projects, tasks):
     """Получить проекты с просроченными задачами"""
     project_ids_with_overdue_tasks = set()
+    project_ids = {p['id'] for p in projects}
     today = datetime.now().date()
     
     for task in tasks:
         if 'deadline' in task and task['deadline']:
             try:
                 deadline_date = datetime.strptime(task['deadline'], '%Y-%m-%d').date()
-                if deadline_date < today and task['project_id'] in [p['id'] for p in projects]:
+                if deadline_date < today and task['project_id'] in project_ids:
                     project_ids_with_overdue_tasks.add(task['project_id'])
             except ValueError:
                 # Если формат даты некорректный, пропускаем
@@ -218,7 +232,7 @@ def get_overdue_tasks_for_executor(executor_id, tasks):
 @login_required
 def api_overdue_projects():
     """API для получения списка просроченных проектов"""
-    projects = load_data(app_config.PROJECTS_DB)
+    projects = scan_records(app_config.PROJECTS_DB, 'id', 'name', 'end_date')
     overdue_projects = get_overdue_projects(projects)
     
     # Подготовим данные для ответа
@@ -236,8 +250,8 @@ def api_overdue_projects():
 @login_required
 def api_curators_list():
     """API для получения списка кураторов"""
-    users = load_data(app_config.USERS_DB)
-    projects = load_data(app_config.PROJECTS_DB)
+    users = load_view(app_config.USERS_DB)
+    projects = load_view(app_config.PROJECTS_DB)
     
     # Получаем ID кураторов из проектов
     curator_ids = set([p['supervisor_id'] for p in projects if p.get('supervisor_id')])
@@ -259,10 +273,8 @@ def api_curators_list():
 @login_required
 def api_my_overdue_projects():
     """API для получения списка просроченных проектов для куратора"""
-    projects = load_data(app_config.PROJECTS_DB)
-    
     # Фильтруем проекты, принадлежащие текущему куратору
-    my_projects = [p for p in projects if p.get('supervisor_id', '') == current_user.id]
+    my_projects = load_index(app_config.PROJECTS_DB).filter('supervisor_id', current_user.id)
     overdue_projects = get_overdue_projects(my_projects)
     
     # Подготовим данные для ответа
@@ -280,12 +292,10 @@ def api_my_overdue_projects():
 @login_required
 def api_projects_with_overdue_tasks():
     """API для получения списка проектов с просроченными задачами"""
-    projects = load_data(app_config.PROJECTS_DB)
-    tasks = load_data(app_config.TASKS_DB)
-    
     # Фильтруем проекты, принадлежащие текущему менеджеру
-    my_projects = [p for p in projects if p.get('manager_id', '') == current_user.id]
-    projects_with_overdue_tasks = get_projects_with_overdue_tasks(my_projects, tasks)
+    my_projects = load_index(app_config.PROJECTS_DB).filter('manager_id', current_user.id)
+    my_tasks = [t for p in my_projects for t in load_project_tasks(p['id'])]
+    projects_with_overdue_tasks = get_projects_with_overdue_tasks(my_projects, my_tasks)
     
     # Подготовим данные для ответа
     result = []
@@ -302,11 +312,9 @@ def api_projects_with_overdue_tasks():
 @login_required
 def api_overdue_executor_tasks():
     """API для получения списка просроченных задач для исполнителя"""
-    tasks = load_data(app_config.TASKS_DB)
-    
     # Фильтруем задачи, принадлежащие текущему исполнителю
-    my_tasks = [t for t in tasks if t.get('assignee_id') == current_user.id]
-    overdue_tasks = get_overdue_tasks_for_executor(current_user.id, my_tasks)
+    tasks = scan_tasks('id', 'title', 'assignee_id', 'deadline')
+    overdue_tasks = get_overdue_tasks_for_executor(current_user.id, tasks)
     
     # Подготовим данные для ответа
     result = []
@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import login_required, current_user
-from app.utils import load_data, save_data, can_access_project, can_access_task, load_directions
+from app.utils import load_view, load_record, load_project_tasks, find_project, find_user, save_record, update_record, can_access_project, load_directions
 from config import Config
 import uuid
 from datetime import datetime
@@ -17,11 +17,8 @@ def calculate_project_statistics(project_id):
     - % выполненных задач в срок
     - количество сотрудников
     """
-    tasks = load_data(app_config.TASKS_DB)
-    users = load_data(app_config.USERS_DB)
-    
     # Получаем задачи проекта
-    project_tasks = [t for t in tasks if t.get('project_id') == project_id]
+    project_tasks = load_project_tasks(project_id, archived=True)
     
     total_tasks = len(project_tasks)
     completed_tasks = [t for t in project_tasks if t.get('status') == 'завершена']
@@ -50,8 +47,7 @@ def calculate_project_statistics(project_id):
         percent_completed_on_time = (completed_on_time / len(completed_tasks)) * 100
     
     # Получаем команду проекта
-    projects = load_data(app_config.PROJECTS_DB)
-    project = next((p for p in projects if p.get('id') == project_id), None)
+    project = find_project(project_id, archived=True)
     team_members = project.get('team', []) if project else []
     employee_count = len(team_members)
     
@@ -68,21 +64,17 @@ def calculate_employee_statistics(project_id):
     - сколько всего задач выполнено
     - % выполненных задач в срок
     """
-    tasks = load_data(app_config.TASKS_DB)
-    users = load_data(app_config.USERS_DB)
-    
     # Получаем задачи проекта
-    project_tasks = [t for t in tasks if t.get('project_id') == project_id]
+    project_tasks = load_project_tasks(project_id, archived=True)
     
     # Получаем команду проекта
-    projects = load_data(app_config.PROJECTS_DB)
-    project = next((p for p in projects if p.get('id') == project_id), None)
+    project = find_project(project_id, archived=True)
     team_member_ids = project.get('team', []) if project else []
     
     employee_stats = []
     
     for user_id in team_member_ids:
-        user = next((u for u in users if u.get('id') == user_id), None)
+        user = find_user(user_id)
         if user:
             # Все задачи пользователя в проекте
             user_tasks = [t for t in project_tasks if t.get('assignee_id') == user_id]
@@ -125,22 +117,20 @@ def project_detail(project_id):
         flash('У вас нет доступа к этому проекту')
         return redirect(url_for('dashboard.dashboard'))
 
-    projects = load_data(app_config.PROJECTS_DB)
-    tasks = load_data(app_config.TASKS_DB)
-    users = load_data(app_config.USERS_DB)
+    users = load_view(app_config.USERS_DB)
 
-    project = next((p for p in projects if p.get('id') == project_id), None)
+    project = find_project(project_id, archived=True)
     if not project:
         flash('Проект не найден')
         return redirect(url_for('dashboard.dashboard'))
 
-    project_tasks = [t for t in tasks if t.get('project_id') == project_id]
+    project_tasks = list(load_project_tasks(project_id, archived=True))
 
-    supervisor = next((u for u in users if u.get('id') == project.get('supervisor_id', '')), None) if project.get('supervisor_id') else None
-    manager = next((u for u in users if u.get('id') == project.get('manager_id', '')), None) if project.get('manager_id') else None
+    supervisor = find_user(project.get('supervisor_id', '')) if project.get('supervisor_id') else None
+    manager = find_user(project.get('manager_id', '')) if project.get('manager_id') else None
     team_members = []
     if project.get('team'):
-        team_members = [next((u for u in users if u.get('id') == member_id), None) for member_id in project.get('team', [])]
+        team_members = [find_user(member_id) for member_id in project.get('team', [])]
         team_members = [m for m in team_members if m]
 
     # Получаем статистику проекта
@@ -181,7 +171,7 @@ def create_project():
         flash('У вас нет прав на создание проектов')
         return redirect(url_for('dashboard.dashboard'))
 
-    users = load_data(app_config.USERS_DB)
+    users = load_view(app_config.USERS_DB)
     managers = [u for u in users if u['role'] in ['admin', 'manager']]
     curators = [u for u in users if u['role'] in ['admin', 'supervisor', 'manager']]
     directions = load_directions()
@@ -244,9 +234,7 @@ def create_project():
             "initiator_name": initiator_name if initiator_name else None
         }
 
-        projects = load_data(app_config.PROJECTS_DB)
-        projects.append(new_project)
-        save_data(app_config.PROJECTS_DB, projects)
+        save_record(app_config.PROJECTS_DB, new_project)
 
         flash('Проект успешно создан')
         return redirect(url_for('projects.project_detail', project_id=project_id))
@@ -261,8 +249,7 @@ def edit_project(project_id):
         flash('У вас нет доступа к этому проекту')
         return redirect(url_for('dashboard.dashboard'))
 
-    projects = load_data(app_config.PROJECTS_DB)
-    project = next((p for p in projects if p['id'] == project_id), None)
+    project = load_record(app_config.PROJECTS_DB, project_id)
 
     if not project:
         flash('Проект не найден')
@@ -272,17 +259,12 @@ def edit_project(project_id):
         flash('У вас нет прав на редактирование этого проекта')
         return redirect(url_for('projects.project_detail', project_id=project_id))
 
-    users = load_data(app_config.USERS_DB)
+    users = load_view(app_config.USERS_DB)
     managers = [u for u in users if u['role'] in ['admin', 'manager']]
     directions = load_directions()
 
     if request.method == 'POST':
-        project['name'] = request.form['name'].strip()
-        project['description'] = request.form['description'].strip()
-        project['direction'] = request.form['direction'].strip()
-        project['expected_result'] = request.form['expected_result'].strip()
-        
-        # Обновляем данные об инициаторе
+        # Проверяем форму до изменения проекта
         initiator_type = request.form.get('initiator_type', '').strip()
         initiator_name = request.form.get('initiator_name', '').strip()
         
@@ -293,36 +275,38 @@ def edit_project(project_id):
         if initiator_type in ['deputy_director', 'department_head', 'teacher'] and not initiator_name:
             flash('Для выбранного типа инициатора необходимо указать ФИО')
             return render_template('edit_project.html', project=project, users=users, managers=managers, directions=directions)
-        
-        project['initiator_type'] = initiator_type
-        project['initiator_name'] = initiator_name if initiator_name else None
 
         end_date = request.form.get('end_date', None)
         if end_date:
             try:
                 end_dt = parse_date(end_date)
                 end_date = end_dt.strftime("%d.%m.%Y")
-                project['end_date'] = end_date
             except:
                 flash('Некорректный формат даты окончания')
                 return render_template('edit_project.html', project=project, users=users, managers=managers, directions=directions)
-        else:
-            project['end_date'] = end_date
-        
-        team_members = request.form.get('team_members', '')
-        project['team'] = team_members.split(',') if team_members else []
-        
-        project['status'] = request.form.get('status', 'в работе')
-        project['supervisor_id'] = request.form.get('supervisor_id', None)
-        project['manager_id'] = request.form.get('manager_id', None)
-        project['last_activity'] = datetime.now().strftime("%d.%m.%Y")
 
-        for i, p in enumerate(projects):
-            if p['id'] == project_id:
-                projects[i] = project
-                break
-
-        save_data(app_config.PROJECTS_DB, projects)
+        def apply_form(project):
+            project['name'] = request.form['name'].strip()
+            project['description'] = request.form['description'].strip()
+            project['direction'] = request.form['direction'].strip()
+            project['expected_result'] = request.form['expected_result'].strip()
+            
+            # Обновляем данные об инициаторе
+            project['initiator_type'] = initiator_type
+            project['initiator_name'] = initiator_name if initiator_name else None
+            project['end_date'] = end_date
+            
+            team_members = request.form.get('team_members', '')
+            project['team'] = team_members.split(',') if team_members else []
+            
+            project['status'] = request.form.get('status', 'в работе')
+            project['supervisor_id'] = request.form.get('supervisor_id', None)
+            project['manager_id'] = request.form.get('manager_id', None)
+            project['last_activity'] = datetime.now().strftime("%d.%m.%Y")
+
+        if not update_record(app_config.PROJECTS_DB, project_id, apply_form):
+            flash('Проект не найден')
+            return redirect(url_for('dashboard.dashboard'))
         flash('Проект успешно обновлен')
         return redirect(url_for('projects.project_detail', project_id=project_id))
 
@@ -335,10 +319,7 @@ def api_get_project_team(project_id):
     if not can_access_project(project_id):
         return jsonify({'error': 'У вас нет доступа к этому проекту'}), 403
 
-    projects = load_data(app_config.PROJECTS_DB)
-    users = load_data(app_config.USERS_DB)
-
-    project = next((p for p in projects if p['id'] == project_id), None)
+    project = find_project(project_id)
     if not project:
         return jsonify({'error': 'Проект не найден'}), 404
 
@@ -346,7 +327,7 @@ def api_get_project_team(project_id):
     team_members = []
 
     for user_id in team_member_ids:
-        user = next((u for u in users if u['id'] == user_id), None)
+        user = find_user(user_id)
         if user:
             from app.utils import get_user_token
             token = get_user_token(user_id, project_id)
@@ -367,8 +348,7 @@ def add_project_member(project_id):
     if not can_access_project(project_id):
         return jsonify({'error': 'У вас нет доступа к этому проекту'}), 403
 
-    projects = load_data(app_config.PROJECTS_DB)
-    project = next((p for p in projects if p['id'] == project_id), None)
+    project = find_project(project_id)
     if not project:
         return jsonify({'error': 'Проект не найден'}), 404
 
@@ -382,22 +362,18 @@ def add_project_member(project_id):
     if not user_id:
         return jsonify({'error': 'Не указан ID пользователя'}), 400
 
-    users = load_data(app_config.USERS_DB)
-    user = next((u for u in users if u['id'] == user_id), None)
+    user = find_user(user_id)
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
 
-    team = project.get('team', [])
-    if user_id not in team:
+    def add_member(project):
+        team = project.get('team', [])
+        if user_id in team:
+            return False
         team.append(user_id)
         project['team'] = team
 
-        for i, p in enumerate(projects):
-            if p['id'] == project_id:
-                projects[i] = project
-                break
-        save_data(app_config.PROJECTS_DB, projects)
-
+    if update_record(app_config.PROJECTS_DB, project_id, add_member):
         return jsonify({'success': True, 'message': 'Участник успешно добавлен в проект'})
     else:
         return jsonify({'error': 'Пользователь уже является участником проекта'}), 400
@@ -409,8 +385,7 @@ def remove_project_member(project_id, user_id):
     if not can_access_project(project_id):
         return jsonify({'error': 'У вас нет доступа к этому проекту'}), 403
 
-    projects = load_data(app_config.PROJECTS_DB)
-    project = next((p for p in projects if p['id'] == project_id), None)
+    project = find_project(project_id)
     if not project:
         return jsonify({'error': 'Проект не найден'}), 404
 
@@ -420,22 +395,18 @@ def remove_project_member(project_id, user_id):
     if current_user.role == 'supervisor' and project.get('supervisor_id') != current_user.id:
         return jsonify({'error': 'Вы не являетесь куратором этого проекта'}), 403
 
-    users = load_data(app_config.USERS_DB)
-    user = next((u for u in users if u['id'] == user_id), None)
+    user = find_user(user_id)
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
 
-    team = project.get('team', [])
-    if user_id in team:
+    def remove_member(project):
+        team = project.get('team', [])
+        if user_id not in team:
+            return False
         team.remove(user_id)
         project['team'] = team
 
-        for i, p in enumerate(projects):
-            if p['id'] == project_id:
-                projects[i] = project
-                break
-        save_data(app_config.PROJECTS_DB, projects)
-
+    if update_record(app_config.PROJECTS_DB, project_id, remove_member):
         return jsonify({'success': True, 'message': 'Участник успешно удален из проекта'})
     else:
         return jsonify({'error': 'Пользователь не является участником проекта'}), 400
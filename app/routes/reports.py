@@ -4,13 +4,17 @@ import time
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from flask_login import login_required, current_user
-from app.utils import load_data
+from app.utils import scan_projects, scan_tasks
 from app.tables import create_projects_table, create_tasks_table
 from config import Config
 
 app_config = Config()
 reports_bp = Blueprint('reports', __name__)
 
+# Поля записей, которые нужны для построения таблиц отчетов
+PROJECT_REPORT_FIELDS = ('name', 'status', 'start_date', 'end_date', 'supervisor_id', 'manager_id')
+TASK_REPORT_FIELDS = ('title', 'status', 'start_date', 'deadline', 'completion_date', 'assignee_id', 'project_id')
+
 
 @reports_bp.route('/reports')
 @login_required
@@ -38,11 +42,10 @@ def get_projects_report():
     if current_user.role != 'admin':
         return jsonify({'error': 'У вас нет прав доступа к этой странице'}), 403
     
-    projects = load_data(app_config.PROJECTS_DB)
-    users = load_data(app_config.USERS_DB)
+    projects = scan_projects(*PROJECT_REPORT_FIELDS, archived=True)
     
     # Создаем таблицу
-    table = create_projects_table(projects, users)
+    table = create_projects_table(projects)
     
     # Применяем поиск, если указан
     search_query = request.args.get('search', '')
@@ -79,12 +82,11 @@ def get_tasks_report():
     if current_user.role != 'admin':
         return jsonify({'error': 'У вас нет прав доступа к этой странице'}), 403
     
-    tasks = load_data(app_config.TASKS_DB)
-    users = load_data(app_config.USERS_DB)
-    projects = load_data(app_config.PROJECTS_DB)
+    tasks = scan_tasks(*TASK_REPORT_FIELDS, archived=True)
+    projects = scan_projects('id', 'name', archived=True)
     
     # Создаем таблицу
-    table = create_tasks_table(tasks, users, projects)
+    table = create_tasks_table(tasks, None, projects)
     
     # Применяем поиск, если указан
     search_query = request.args.get('search', '')
@@ -113,8 +115,7 @@ def download_projects_report():
     if current_user.role != 'admin':
         return jsonify({'error': 'У вас нет прав доступа к этой странице'}), 403
     
-    projects = load_data(app_config.PROJECTS_DB)
-    users = load_data(app_config.USERS_DB)
+    projects = scan_projects(*PROJECT_REPORT_FIELDS, archived=True)
     
     # Получаем параметры фильтрации из запроса
     search_query = request.args.get('search', '')
@@ -123,7 +124,7 @@ def download_projects_report():
     end_date = request.args.get('end_date')
     
     # Создаем таблицу и применяем фильтры
-    table = create_projects_table(projects, users)
+    table = create_projects_table(projects)
     
     if search_query:
         table.search(search_query)
@@ -228,9 +229,8 @@ def download_tasks_report():
     if current_user.role != 'admin':
         return jsonify({'error': 'У вас нет прав доступа к этой странице'}), 403
     
-    tasks = load_data(app_config.TASKS_DB)
-    users = load_data(app_config.USERS_DB)
-    projects = load_data(app_config.PROJECTS_DB)
+    tasks = scan_tasks(*TASK_REPORT_FIELDS, archived=True)
+    projects = scan_projects('id', 'name', archived=True)
     
     # Получаем параметры фильтрации из запроса
     search_query = request.args.get('search', '')
@@ -239,7 +239,7 @@ def download_tasks_report():
     end_date = request.args.get('end_date')
     
     # Создаем таблицу и применяем фильтры
-    table = create_tasks_table(tasks, users, projects)
+    table = create_tasks_table(tasks, None, projects)
     
     if search_query:
         table.search(search_query)
@@ -1,7 +1,8 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import login_required, current_user
 from functools import wraps
-from app.utils import load_data, save_data, can_access_project, can_access_task, add_task_history, allowed_file
+from app.utils import load_view, load_project_tasks, find_project, find_task, find_user, save_task, update_record, modify_task, load_task_items, find_task_item, add_task_items, modify_task_item, remove_task_item, can_access_project, can_access_task, add_task_history, allowed_file
+from app.directory import user_directory
 from config import Config
 import uuid
 from datetime import datetime
@@ -13,6 +14,14 @@ app_config = Config()
 tasks_bp = Blueprint('tasks', __name__)
 
 
+def update_project_activity(project_id):
+    """Обновить дату последней активности проекта"""
+    def touch(project):
+        project['last_activity'] = datetime.now().strftime("%d.%m.%Y")
+
+    update_record(app_config.PROJECTS_DB, project_id, touch)
+
+
 def api_login_required(f):
     """Декоратор для API endpoints, возвращающий JSON ошибку вместо редиректа"""
     @wraps(f)
@@ -34,10 +43,9 @@ def create_task(project_id):
         flash('У вас нет прав на создание задач')
         return redirect(url_for('projects.project_detail', project_id=project_id))
 
-    projects = load_data(app_config.PROJECTS_DB)
-    users = load_data(app_config.USERS_DB)
+    users = load_view(app_config.USERS_DB)
 
-    project = next((p for p in projects if p.get('id') == project_id), None)
+    project = find_project(project_id)
     if not project:
         flash('Проект не найден')
         return redirect(url_for('dashboard.dashboard'))
@@ -46,7 +54,7 @@ def create_task(project_id):
     if current_user.role == 'admin':
         eligible_users = users
     else:
-        team_member_ids = project.get('team', []) + [project.get('manager_id')]
+        team_member_ids = set(project.get('team', [])) | {project.get('manager_id')}
         eligible_users = [u for u in users if u['id'] in team_member_ids]
 
     if request.method == 'POST':
@@ -97,16 +105,8 @@ def create_task(project_id):
             "completion_date": ""
         }
 
-        tasks = load_data(app_config.TASKS_DB)
-        tasks.append(task)
-        save_data(app_config.TASKS_DB, tasks)
-
-        project['last_activity'] = datetime.now().strftime("%d.%m.%Y")
-        for i, p in enumerate(projects):
-            if p.get('id') == project_id:
-                projects[i] = project
-                break
-        save_data(app_config.PROJECTS_DB, projects)
+        save_task(task)
+        update_project_activity(project_id)
 
         flash('Задача успешно создана')
         return redirect(url_for('projects.project_detail', project_id=project_id))
@@ -120,14 +120,10 @@ def api_get_tasks_by_project(project_id):
     if not can_access_project(project_id):
         return jsonify({'error': 'У вас нет доступа к этому проекту'}), 403
 
-    tasks = load_data(app_config.TASKS_DB)
-    project_tasks = [t for t in tasks if t.get('project_id') == project_id]
-
-    users = load_data(app_config.USERS_DB)
-    user_map = {u['id']: u for u in users}
+    project_tasks = [dict(task) for task in load_project_tasks(project_id)]
 
     for task in project_tasks:
-        assignee = user_map.get(task.get('assignee_id'))
+        assignee = user_directory.get(task.get('assignee_id'))
         if assignee:
             from app.utils import get_user_token
             token = get_user_token(task.get('assignee_id'), project_id)
@@ -147,41 +143,26 @@ def update_task_status(task_id):
         flash('У вас нет доступа к этой задаче')
         return redirect(url_for('dashboard.dashboard'))
 
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
-
-    if not task:
-        flash('Задача не найдена')
-        return redirect(url_for('dashboard.dashboard'))
-
     new_status = request.form.get('status')
     if new_status not in ['активна', 'завершена', 'отложена']:
         flash('Недопустимый статус задачи')
         return redirect(request.referrer or url_for('dashboard.dashboard'))
 
-    task['status'] = new_status
+    def set_status(task):
+        task['status'] = new_status
 
-    if new_status == 'завершена' and task.get('status') != 'завершена':
-        task['completion_date'] = datetime.now().strftime("%d.%m.%Y")
-    elif new_status != 'завершена':
-        task['completion_date'] = ""
+        if new_status == 'завершена' and task.get('status') != 'завершена':
+            task['completion_date'] = datetime.now().strftime("%d.%m.%Y")
+        elif new_status != 'завершена':
+            task['completion_date'] = ""
 
-    for i, t in enumerate(tasks):
-        if t.get('id') == task_id:
-            tasks[i] = task
-            break
+    task = modify_task(task_id, set_status)
 
-    save_data(app_config.TASKS_DB, tasks)
+    if not task:
+        flash('Задача не найдена')
+        return redirect(url_for('dashboard.dashboard'))
 
-    projects = load_data(app_config.PROJECTS_DB)
-    project = next((p for p in projects if p.get('id') == task.get('project_id')), None)
-    if project:
-        project['last_activity'] = datetime.now().strftime("%d.%m.%Y")
-        for i, p in enumerate(projects):
-            if p.get('id') == project.get('id'):
-                projects[i] = project
-                break
-        save_data(app_config.PROJECTS_DB, projects)
+    update_project_activity(task.get('project_id'))
 
     flash('Статус задачи успешно обновлен')
     return redirect(request.referrer or url_for('dashboard.dashboard'))
@@ -193,8 +174,7 @@ def update_task(task_id):
     if not can_access_task(task_id):
         return jsonify({'error': 'У вас нет доступа к этой задаче'}), 403
 
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id)
 
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
@@ -236,63 +216,55 @@ def update_task(task_id):
         except:
             return jsonify({'error': 'Некорректный формат даты'}), 400
 
-    original_task = task.copy()
-    users = load_data(app_config.USERS_DB)
-
     if new_assignee_id and new_assignee_id != task.get('assignee_id'):
-        user = next((u for u in users if u['id'] == new_assignee_id), None)
+        user = find_user(new_assignee_id)
         if not user:
             return jsonify({'error': 'Назначаемый пользователь не найден'}), 404
 
-        projects = load_data(app_config.PROJECTS_DB)
-        project = next((p for p in projects if p['id'] == project_id), None)
+        project = find_project(project_id)
         if project and new_assignee_id not in project.get('team', []) and new_assignee_id != project.get('manager_id') and new_assignee_id != project.get('supervisor_id'):
             return jsonify({'error': 'Назначаемый пользователь не является участником проекта'}), 400
 
-        task['assignee_id'] = new_assignee_id
-        add_task_history(task, f'Изменен ответственный', current_user.id, users)
+    actions = []
 
-    if new_title and new_title != task.get('title'):
-        task['title'] = new_title.strip()
-        add_task_history(task, f'Изменено название', current_user.id, users)
+    def apply_form(task):
+        actions.clear()
 
-    if new_description is not None and new_description != task.get('description'):
-        task['description'] = new_description.strip()
-        add_task_history(task, f'Изменено описание', current_user.id, users)
+        if new_assignee_id and new_assignee_id != task.get('assignee_id'):
+            task['assignee_id'] = new_assignee_id
+            actions.append(f'Изменен ответственный')
 
-    if new_start_date and new_start_date != task.get('start_date'):
-        task['start_date'] = new_start_date
-        add_task_history(task, f'Изменена дата начала', current_user.id, users)
+        if new_title and new_title != task.get('title'):
+            task['title'] = new_title.strip()
+            actions.append(f'Изменено название')
 
-    if new_deadline and new_deadline != task.get('deadline'):
-        task['deadline'] = new_deadline
-        add_task_history(task, f'Изменен дедлайн', current_user.id, users)
+        if new_description is not None and new_description != task.get('description'):
+            task['description'] = new_description.strip()
+            actions.append(f'Изменено описание')
 
-    if 'status' in request.form and request.form['status'] != task.get('status'):
-        new_status = request.form['status']
-        task['status'] = new_status
-        add_task_history(task, f'Изменен статус на "{new_status}"', current_user.id, users)
-        if new_status == 'завершена':
-            task['completion_date'] = datetime.now().strftime("%d.%m.%Y")
-        else:
-            task['completion_date'] = ""
+        if new_start_date and new_start_date != task.get('start_date'):
+            task['start_date'] = new_start_date
+            actions.append(f'Изменена дата начала')
 
-    for i, t in enumerate(tasks):
-        if t.get('id') == task_id:
-            tasks[i] = task
-            break
+        if new_deadline and new_deadline != task.get('deadline'):
+            task['deadline'] = new_deadline
+            actions.append(f'Изменен дедлайн')
 
-    save_data(app_config.TASKS_DB, tasks)
+        if 'status' in request.form and request.form['status'] != task.get('status'):
+            new_status = request.form['status']
+            task['status'] = new_status
+            actions.append(f'Изменен статус на "{new_status}"')
+            if new_status == 'завершена':
+                task['completion_date'] = datetime.now().strftime("%d.%m.%Y")
+            else:
+                task['completion_date'] = ""
 
-    projects = load_data(app_config.PROJECTS_DB)
-    project = next((p for p in projects if p.get('id') == project_id), None)
-    if project:
-        project['last_activity'] = datetime.now().strftime("%d.%m.%Y")
-        for i, p in enumerate(projects):
-            if p.get('id') == project_id:
-                projects[i] = project
-                break
-        save_data(app_config.PROJECTS_DB, projects)
+    if not modify_task(task_id, apply_form):
+        return jsonify({'error': 'Задача не найдена'}), 404
+
+    add_task_history(task_id, actions, current_user.id)
+
+    update_project_activity(project_id)
 
     return jsonify({'success': True, 'message': 'Задача успешно обновлена'})
 
@@ -303,8 +275,7 @@ def upload_task_file(task_id):
     if not can_access_task(task_id):
         return jsonify({'error': 'У вас нет доступа к этой задаче'}), 403
 
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id)
 
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
@@ -328,8 +299,7 @@ def upload_task_file(task_id):
         filename = secure_filename(file.filename)
         
         # Get user info to create executor-specific directory
-        users = load_data(app_config.USERS_DB)
-        assignee = next((u for u in users if u['id'] == task.get('assignee_id')), None)
+        assignee = find_user(task.get('assignee_id'))
         if not assignee:
             return jsonify({'error': 'Исполнитель задачи не найден'}), 404
         
@@ -353,24 +323,10 @@ def upload_task_file(task_id):
             'executor_dir': executor_safe_name
         }
 
-        tasks = load_data(app_config.TASKS_DB)
-        task = next((t for t in tasks if t.get('id') == task_id), None)
-
-        if not task:
+        if not add_task_items(task_id, 'files', [file_info]):
             os.remove(filepath)
             return jsonify({'error': 'Задача не найдена'}), 404
 
-        if 'files' not in task:
-            task['files'] = []
-        task['files'].append(file_info)
-
-        for i, t in enumerate(tasks):
-            if t.get('id') == task_id:
-                tasks[i] = task
-                break
-
-        save_data(app_config.TASKS_DB, tasks)
-
         return jsonify({'success': True, 'message': 'Файл успешно загружен', 'file': file_info})
     else:
         return jsonify({'error': 'Недопустимый тип файла'}), 400
@@ -383,8 +339,7 @@ def report_task(task_id):
     if not can_access_task(task_id):
         return jsonify({'error': 'У вас нет доступа к этой задаче'}), 403
 
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id)
 
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
@@ -403,8 +358,7 @@ def report_task(task_id):
             filename = secure_filename(file.filename)
             
             # Get user info to create executor-specific directory
-            users = load_data(app_config.USERS_DB)
-            assignee = next((u for u in users if u['id'] == task.get('assignee_id')), None)
+            assignee = find_user(task.get('assignee_id'))
             if not assignee:
                 return jsonify({'error': 'Исполнитель задачи не найден'}), 404
             
@@ -428,21 +382,6 @@ def report_task(task_id):
                 'executor_dir': executor_safe_name
             }
     
-    # Load task again in case file was uploaded
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
-    if not task:
-        # If file was uploaded, remove it
-        if file_info:
-            filepath = os.path.join(app_config.BASE_DIR, 'uploads', file_info['executor_dir'], file_info['unique_filename'])
-            if os.path.exists(filepath):
-                os.remove(filepath)
-        return jsonify({'error': 'Задача не найдена'}), 404
-
-    # Initialize reports array if not exists
-    if 'reports' not in task:
-        task['reports'] = []
-
     # Create report entry
     report_entry = {
         'id': str(uuid.uuid4()),
@@ -452,19 +391,17 @@ def report_task(task_id):
         'reported_at': datetime.now().strftime("%d.%m.%Y %H:%M:%S")
     }
 
-    task['reports'].append(report_entry)
-
-    # Update the task in the database
-    for i, t in enumerate(tasks):
-        if t.get('id') == task_id:
-            tasks[i] = task
-            break
-
-    save_data(app_config.TASKS_DB, tasks)
+    # Append the report to the task's reports store
+    if not add_task_items(task_id, 'reports', [report_entry]):
+        # If file was uploaded, remove it
+        if file_info:
+            filepath = os.path.join(app_config.BASE_DIR, 'uploads', file_info['executor_dir'], file_info['unique_filename'])
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        return jsonify({'error': 'Задача не найдена'}), 404
 
     # Add to task history
-    users = load_data(app_config.USERS_DB)
-    add_task_history(task, f'Отчет: {comment[:50]}...' if len(comment) > 50 else f'Отчет: {comment}', current_user.id, users)
+    add_task_history(task_id, f'Отчет: {comment[:50]}...' if len(comment) > 50 else f'Отчет: {comment}', current_user.id)
 
     return jsonify({
         'success': True, 
@@ -480,18 +417,14 @@ def task_detail(task_id):
         flash('У вас нет доступа к этой задаче')
         return redirect(url_for('dashboard.dashboard'))
 
-    tasks = load_data(app_config.TASKS_DB)
-    users = load_data(app_config.USERS_DB)
-    projects = load_data(app_config.PROJECTS_DB)
-
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id, archived=True)
     if not task:
         flash('Задача не найдена')
         return redirect(url_for('dashboard.dashboard'))
 
     # Redirect to project page instead of showing task detail page
     project_id = task.get('project_id')
-    project = next((p for p in projects if p.get('id') == project_id), None)
+    project = find_project(project_id, archived=True)
     if not project:
         flash('Проект задачи не найден')
         return redirect(url_for('dashboard.dashboard'))
@@ -505,14 +438,12 @@ def api_task_detail(task_id):
     if not can_access_task(task_id):
         return jsonify({'error': 'У вас нет доступа к этой задаче'}), 403
 
-    tasks = load_data(app_config.TASKS_DB)
-    users = load_data(app_config.USERS_DB)
-
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id, archived=True)
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
+    task = dict(task)
 
-    assignee = next((u for u in users if u['id'] == task.get('assignee_id')), None) if task.get('assignee_id') else None
+    assignee = user_directory.get(task.get('assignee_id')) if task.get('assignee_id') else None
     if assignee:
         from app.utils import get_user_token
         token = get_user_token(task.get('assignee_id'), task.get('project_id'))
@@ -522,12 +453,18 @@ def api_task_detail(task_id):
         task['assignee_token'] = None
         task['assignee_name'] = 'Не назначен'
 
-    creator = next((u for u in users if u['id'] == task.get('created_by')), None) if task.get('created_by') else None
+    creator = user_directory.get(task.get('created_by')) if task.get('created_by') else None
     if creator:
         task['creator_name'] = creator.get('name', creator.get('username', ''))
     else:
         task['creator_name'] = 'Неизвестно'
 
+    # Дочерние списки хранятся отдельно от записи задачи и загружаются только здесь
+    for field in ('history', 'reports', 'files', 'subtasks'):
+        items = load_task_items(task_id, field)
+        if items:
+            task[field] = list(items)
+
     if 'history' not in task:
         task['history'] = [
             {
@@ -541,16 +478,15 @@ def api_task_detail(task_id):
     if 'files' not in task:
         task['files'] = []
 
-    projects = load_data(app_config.PROJECTS_DB)
-    project = next((p for p in projects if p['id'] == task.get('project_id')), None)
+    project = find_project(task.get('project_id'), archived=True)
     team_users = []
     if project:
-        team_ids = project.get('team', [])
+        team_ids = list(project.get('team', []))
         if project.get('manager_id'):
             team_ids.append(project.get('manager_id'))
         if project.get('supervisor_id'):
             team_ids.append(project.get('supervisor_id'))
-        team_users = [{'id': u['id'], 'name': u['name']} for u in users if u['id'] in team_ids]
+        team_users = [{'id': u['id'], 'name': u['name']} for u in user_directory.ordered(team_ids)]
     
     task['team_users'] = team_users
 
@@ -560,8 +496,8 @@ def api_task_detail(task_id):
     
     formatted_reports = []
     for report in task['reports']:
-        executor = next((u for u in users if u['id'] == report.get('reported_by')), None)
-        executor_name = executor.get('name', executor.get('username', 'Неизвестный')) if executor else 'Неизвестный'
+        executor = user_directory.get(report.get('reported_by'))
+        executor_name = executor.display_name if executor else 'Неизвестный'
         
         # Format the date if it exists
         report_date = report.get('reported_at', '')
@@ -607,13 +543,13 @@ def get_subtasks(task_id):
     if not can_access_task(task_id):
         return jsonify({'error': 'У вас нет доступа к этой задаче'}), 403
     
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id, archived=True)
     
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
     
-    subtasks = task.get('subtasks', [])
+    # Подзадачи архивной задачи хранятся в ее записи
+    subtasks = load_task_items(task_id, 'subtasks') or task.get('subtasks', [])
     return jsonify(subtasks)
 
 
@@ -625,8 +561,7 @@ def create_subtask(task_id):
         if not can_access_task(task_id):
             return jsonify({'error': 'У вас нет доступа к этой задаче'}), 403
         
-        tasks = load_data(app_config.TASKS_DB)
-        task = next((t for t in tasks if t.get('id') == task_id), None)
+        task = find_task(task_id)
         
         if not task:
             return jsonify({'error': 'Задача не найдена'}), 404
@@ -662,18 +597,9 @@ def create_subtask(task_id):
             'created_by': current_user.id
         }
         
-        if 'subtasks' not in task:
-            task['subtasks'] = []
-        
-        task['subtasks'].append(subtask)
-        
-        # Обновляем задачу в базе
-        for i, t in enumerate(tasks):
-            if t.get('id') == task_id:
-                tasks[i] = task
-                break
-        
-        save_data(app_config.TASKS_DB, tasks)
+        # Добавляем подзадачу в список подзадач задачи
+        if not add_task_items(task_id, 'subtasks', [subtask]):
+            return jsonify({'error': 'Задача не найдена'}), 404
         
         return jsonify({'success': True, 'subtask': subtask})
     
@@ -691,54 +617,50 @@ def update_subtask(task_id, subtask_id):
     if not can_access_task(task_id):
         return jsonify({'error': 'У вас нет доступа к этой задаче'}), 403
     
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id)
     
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
     
-    subtasks = task.get('subtasks', [])
-    subtask = next((s for s in subtasks if s.get('id') == subtask_id), None)
-    
-    if not subtask:
+    if not find_task_item(task_id, 'subtasks', subtask_id):
         return jsonify({'error': 'Подзадача не найдена'}), 404
     
     # Проверяем права на редактирование подзадачи
     if current_user.role not in ['admin', 'manager', 'supervisor'] and current_user.id != task.get('assignee_id'):
         return jsonify({'error': 'У вас нет прав на редактирование подзадачи'}), 403
     
-    # Обновляем статус выполнения
-    if 'completed' in request.form:
-        completed = request.form['completed'].lower() == 'true'
-        subtask['completed'] = completed
+    # Проверяем дату запланировано до изменения задачи
+    planned_date = request.form.get('planned_date')
+    if planned_date:
+        try:
+            planned_date = parse_date(planned_date).strftime("%d.%m.%Y")
+        except:
+            return jsonify({'error': 'Некорректный формат даты'}), 400
+    
+    def apply_form(subtask):
+        # Обновляем статус выполнения
+        if 'completed' in request.form:
+            completed = request.form['completed'].lower() == 'true'
+            subtask['completed'] = completed
+            
+            # Если подзадача выполнена, устанавливаем дату завершения
+            if completed and not subtask['completed_date']:
+                subtask['completed_date'] = datetime.now().strftime("%d.%m.%Y")
+            elif not completed:
+                subtask['completed_date'] = ''
+        
+        # Обновляем отчет
+        if 'report' in request.form:
+            subtask['report'] = request.form['report'].strip()
         
-        # Если подзадача выполнена, устанавливаем дату завершения
-        if completed and not subtask['completed_date']:
-            subtask['completed_date'] = datetime.now().strftime("%d.%m.%Y")
-        elif not completed:
-            subtask['completed_date'] = ''
-    
-    # Обновляем отчет
-    if 'report' in request.form:
-        subtask['report'] = request.form['report'].strip()
-    
-    # Обновляем дату запланировано
-    if 'planned_date' in request.form:
-        planned_date = request.form['planned_date']
+        # Обновляем дату запланировано
         if planned_date:
-            try:
-                planned_dt = parse_date(planned_date)
-                subtask['planned_date'] = planned_dt.strftime("%d.%m.%Y")
-            except:
-                return jsonify({'error': 'Некорректный формат даты'}), 400
+            subtask['planned_date'] = planned_date
     
     # Обновляем подзадачу в базе
-    for i, t in enumerate(tasks):
-        if t.get('id') == task_id:
-            tasks[i] = task
-            break
-    
-    save_data(app_config.TASKS_DB, tasks)
+    subtask = modify_task_item(task_id, 'subtasks', subtask_id, apply_form)
+    if not subtask:
+        return jsonify({'error': 'Подзадача не найдена'}), 404
     
     return jsonify({'success': True, 'subtask': subtask})
 
@@ -750,26 +672,20 @@ def upload_subtask_file(task_id, subtask_id):
     if not can_access_task(task_id):
         return jsonify({'error': 'У вас нет доступа к этой задаче'}), 403
     
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id)
     
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
     
-    subtasks = task.get('subtasks', [])
-    subtask = next((s for s in subtasks if s.get('id') == subtask_id), None)
-    
-    if not subtask:
+    if not find_task_item(task_id, 'subtasks', subtask_id):
         return jsonify({'error': 'Подзадача не найдена'}), 404
     
     # Проверяем права на загрузку файла
     if current_user.role not in ['admin', 'manager', 'supervisor'] and current_user.id != task.get('assignee_id'):
         return jsonify({'error': 'У вас нет прав на загрузку файла'}), 403
     
-    # Обновляем отчет, если он есть
     report = request.form.get('report', '').strip()
-    if report:
-        subtask['report'] = report
+    file_info = None
     
     # Обрабатываем загрузку файла, если он есть
     if 'file' in request.files:
@@ -778,8 +694,7 @@ def upload_subtask_file(task_id, subtask_id):
             filename = secure_filename(file.filename)
             
             # Получаем информацию об исполнителе задачи
-            users = load_data(app_config.USERS_DB)
-            assignee = next((u for u in users if u['id'] == task.get('assignee_id')), None)
+            assignee = find_user(task.get('assignee_id'))
             if not assignee:
                 return jsonify({'error': 'Исполнитель задачи не найден'}), 404
             
@@ -802,17 +717,20 @@ def upload_subtask_file(task_id, subtask_id):
                 'size': os.path.getsize(filepath),
                 'executor_dir': executor_safe_name
             }
-            
-            # Сохраняем файл в подзадачу
-            subtask['file'] = file_info
     
-    # Обновляем задачу в базе
-    for i, t in enumerate(tasks):
-        if t.get('id') == task_id:
-            tasks[i] = task
-            break
+    def apply_upload(subtask):
+        # Обновляем отчет, если он есть
+        if report:
+            subtask['report'] = report
+        
+        # Сохраняем файл в подзадачу
+        if file_info:
+            subtask['file'] = file_info
     
-    save_data(app_config.TASKS_DB, tasks)
+    # Обновляем подзадачу в базе
+    subtask = modify_task_item(task_id, 'subtasks', subtask_id, apply_upload)
+    if not subtask:
+        return jsonify({'error': 'Подзадача не найдена'}), 404
     
     return jsonify({'success': True, 'message': 'Отчет успешно обновлен', 'subtask': subtask})
 
@@ -824,8 +742,7 @@ def delete_subtask(task_id, subtask_id):
     if not can_access_task(task_id):
         return jsonify({'error': 'У вас нет доступа к этой задаче'}), 403
     
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id)
     
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
@@ -834,8 +751,7 @@ def delete_subtask(task_id, subtask_id):
     if current_user.role not in ['admin', 'manager', 'supervisor']:
         return jsonify({'error': 'У вас нет прав на удаление подзадачи'}), 403
     
-    subtasks = task.get('subtasks', [])
-    subtask = next((s for s in subtasks if s.get('id') == subtask_id), None)
+    subtask = find_task_item(task_id, 'subtasks', subtask_id)
     
     if not subtask:
         return jsonify({'error': 'Подзадача не найдена'}), 404
@@ -848,14 +764,6 @@ def delete_subtask(task_id, subtask_id):
             os.remove(filepath)
     
     # Удаляем подзадачу
-    task['subtasks'] = [s for s in subtasks if s.get('id') != subtask_id]
-    
-    # Обновляем задачу в базе
-    for i, t in enumerate(tasks):
-        if t.get('id') == task_id:
-            tasks[i] = task
-            break
-    
-    save_data(app_config.TASKS_DB, tasks)
+    remove_task_item(task_id, 'subtasks', subtask_id)
     
     return jsonify({'success': True, 'message': 'Подзадача успешно удалена'})
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+serializer.py - Сериализация JSON для хранилища и ответов API
+
+Используется orjson, если он установлен, иначе стандартный модуль json.
+Оба варианта пишут UTF-8 без экранирования кириллицы и читают данные друг друга.
+"""
+
+import codecs
+import dataclasses
+import decimal
+import json
+import re
+import uuid
+from collections.abc import Mapping
+from datetime import date
+from typing import Any, BinaryIO, Iterable, Iterator, Union
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Ошибка разбора (orjson.JSONDecodeError наследуется от нее)
+JSONDecodeError = json.JSONDecodeError
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def _default(value: Any) -> Any:
+    """Преобразование типов, которые не сериализуются напрямую (как во Flask)"""
+    if isinstance(value, Mapping):
+        # Записи коллекций из кэша (app.records)
+        return dict(value.items())
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _BASE_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def dumps(value: Any, pretty: bool = False, sort_keys: bool = False) -> bytes:
+    """
+    Сериализация в JSON (UTF-8)
+
+    Args:
+        value: Данные для сериализации
+        pretty: Форматировать с отступом в 2 пробела
+        sort_keys: Сортировать ключи словарей
+
+    Returns:
+        JSON в виде байтов
+    """
+    if orjson is not None:
+        option = _BASE_OPTIONS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(value, default=_default, option=option)
+    if pretty:
+        text = json.dumps(value, ensure_ascii=False, indent=2, sort_keys=sort_keys, default=_default)
+    else:
+        text = json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys, default=_default)
+    return text.encode('utf-8')
+
+
+def dumps_str(value: Any, pretty: bool = False) -> str:
+    """Сериализация в JSON-строку (для журналов и текстовых колонок SQLite)"""
+    return dumps(value, pretty=pretty).decode('utf-8')
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Разбор JSON из байтов или строки"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Потоковый разбор: элементы разбираются стандартным декодером (raw_decode
+# возвращает позицию конца значения), orjson так не умеет
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_TAIL = re.compile(r'[0-9eE.+\-]*')
+
+
+def iter_array(stream: BinaryIO, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """
+    Потоковый разбор JSON-массива верхнего уровня
+
+    Файл читается частями по chunk_size байт, поэтому в памяти одновременно
+    находятся только текущая часть файла и разбираемый элемент, а не весь
+    текст и все разобранные записи. Пустой файл считается пустым массивом
+    (как в хранилище коллекций).
+
+    Args:
+        stream: Файл, открытый в двоичном режиме
+        chunk_size: Размер читаемой части, байт
+
+    Yields:
+        Элементы массива по одному
+
+    Raises:
+        JSONDecodeError: Содержимое не является JSON-массивом
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer, position, eof = '', 0, False
+
+    def fill(size: int) -> None:
+        nonlocal buffer, position, eof
+        chunk = stream.read(size)
+        eof = not chunk
+        buffer = buffer[position:] + decoder.decode(chunk, final=eof)
+        position = 0
+
+    def skip_whitespace() -> str:
+        """Следующий значимый символ ('' - конец файла)"""
+        nonlocal position
+        while True:
+            position = _WHITESPACE.match(buffer, position).end()
+            if position < len(buffer) or eof:
+                return buffer[position:position + 1]
+            fill(chunk_size)
+
+    fill(chunk_size)
+    first = skip_whitespace()
+    if not first:
+        return
+    if first != '[':
+        raise JSONDecodeError('Expecting JSON array', buffer, position)
+    position += 1
+    if skip_whitespace() == ']':
+        position += 1
+    else:
+        while True:
+            size = chunk_size
+            while True:
+                try:
+                    value, end = _DECODER.raw_decode(buffer, position)
+                except JSONDecodeError:
+                    if eof:
+                        raise
+                    # Элемент не поместился в прочитанную часть - дочитываем
+                    # (для больших элементов - все большими частями)
+                    fill(size)
+                    size *= 2
+                    continue
+                if not eof and buffer[end - 1] not in '}]"' and _NUMBER_TAIL.fullmatch(buffer, end):
+                    # Число на границе части могло быть прочитано не полностью
+                    fill(size)
+                    continue
+                break
+            position = end
+            yield value
+            separator = skip_whitespace()
+            position += 1
+            if separator == ']':
+                break
+            if separator != ',':
+                raise JSONDecodeError("Expecting ',' delimiter", buffer, position - 1)
+            skip_whitespace()
+    if skip_whitespace():
+        raise JSONDecodeError('Extra data', buffer, position)
+
+
+def dump_array(values: Iterable[Any], stream: BinaryIO, pretty: bool = False) -> int:
+    """
+    Потоковая запись JSON-массива: результат совпадает с dumps(list(values), pretty)
+
+    Returns:
+        Число записанных элементов
+    """
+    count = 0
+    for value in values:
+        blob = dumps(value, pretty=pretty)
+        if pretty:
+            # Переводы строк внутри строк JSON экранированы, поэтому сдвиг безопасен
+            blob = b'\n  ' + blob.replace(b'\n', b'\n  ')
+        stream.write((b',' if count else b'[') + blob)
+        count += 1
+    if not count:
+        stream.write(b'[]')
+    else:
+        stream.write(b'\n]' if pretty else b']')
+    return count
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON-провайдер Flask на основе dumps()/loads()
+
+    Сохраняет поведение стандартного провайдера (сортировка ключей, отступы
+    в режиме отладки), но не экранирует кириллицу и при наличии orjson
+    формирует тело ответа сразу в байтах.
+    """
+
+    ensure_ascii = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            # Нестандартные параметры json.dumps поддерживает только стандартный провайдер
+            kwargs.setdefault('default', _default)
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, sort_keys=self.sort_keys).decode('utf-8')
+
+    def loads(self, s: Union[bytes, str], **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        body = dumps(obj, pretty=pretty, sort_keys=self.sort_keys)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+__all__ = [
+    'BACKEND',
+    'JSONDecodeError',
+    'dumps',
+    'dumps_str',
+    'loads',
+    'iter_array',
+    'dump_array',
+    'FastJSONProvider'
+]
@@ -0,0 +1,408 @@
+"""
+sqlite_storage.py - Бэкенд хранения коллекций в SQLite (режим WAL)
+
+Каждая коллекция хранится в отдельной таблице: id записи, позиция в списке,
+запись целиком в JSON-колонке (подзадачи, файлы, отчеты и история остаются
+внутри нее) и вынесенные колонки для фильтрации средствами SQL.
+Запись коллекции изменяет только строки, которые действительно поменялись.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app import serializer
+
+
+# Поля, выносимые в отдельные индексируемые колонки
+INDEXED_FIELDS = {
+    'tasks': ['project_id', 'assignee_id', 'status'],
+    'projects': ['manager_id', 'supervisor_id', 'status'],
+    'users': ['username', 'role'],
+    'tokens': ['user_id', 'project_id', 'used'],
+    'directions': [],
+    'task_manifest': ['project_id'],
+    'task_history': ['task_id'],
+    'task_reports': ['task_id'],
+    'task_files': ['task_id'],
+    'task_subtasks': ['task_id']
+}
+
+# Поля-списки, по которым возможна фильтрация "содержит значение"
+LIST_FIELDS = {
+    'projects': ['team']
+}
+
+_NAME_RE = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+
+def collection_name(filepath: str) -> str:
+    """Имя коллекции по пути к ее JSON-файлу: /.../tasks.json -> tasks"""
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    if not _NAME_RE.match(name):
+        raise ValueError(f"Недопустимое имя коллекции: {name}")
+    return name
+
+
+def collection_kind(name: str) -> str:
+    """Вид коллекции по имени: шарды задач tasks__<проект> имеют вид tasks"""
+    return name.split('__', 1)[0]
+
+
+def _column_value(value: Any) -> Any:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (list, dict)):
+        return serializer.dumps_str(value)
+    return value
+
+
+class SqliteBackend:
+    """Хранение коллекций в базе SQLite с журналом WAL"""
+
+    name = 'sqlite'
+    # В режиме WAL с synchronous=NORMAL фиксация транзакции не делает fsync,
+    # поэтому пакетная запись (app.group_commit) только добавила бы задержку
+    group_commit = False
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._tables = set()
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS collections (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def _table(self, conn: sqlite3.Connection, filepath: str) -> str:
+        name = collection_name(filepath)
+        if name in self._tables:
+            return name
+        with self._lock:
+            fields = INDEXED_FIELDS.get(collection_kind(name), [])
+            columns = ''.join(f', "{field}"' for field in fields)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" '
+                         f'(id TEXT PRIMARY KEY, position INTEGER NOT NULL, data TEXT NOT NULL{columns})')
+            for field in fields:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{name}_{field}" ON "{name}" ("{field}")')
+            self._tables.add(name)
+        return name
+
+    def signature(self, filepath: str) -> Optional[Tuple[int]]:
+        """Номер версии коллекции (увеличивается при каждой записи любым процессом)"""
+        row = self._connect().execute('SELECT version FROM collections WHERE name = ?',
+                                      (collection_name(filepath),)).fetchone()
+        return (row[0],) if row else None
+
+    def exists(self, filepath: str) -> bool:
+        return self.signature(filepath) is not None
+
+    def read(self, filepath: str) -> List[Any]:
+        conn = self._connect()
+        name = self._table(conn, filepath)
+        return [serializer.loads(row[0]) for row in conn.execute(f'SELECT data FROM "{name}" ORDER BY position')]
+
+    def iter_read(self, filepath: str, page_size: int = 1000) -> Iterator[Any]:
+        """
+        Потоковое чтение коллекции страницами по page_size записей
+
+        Страницы выбираются по позиции, поэтому курсор не остается открытым
+        между ними, а записи других процессов между страницами допустимы.
+        """
+        conn = self._connect()
+        name = self._table(conn, filepath)
+        last = (-1, '')
+        while True:
+            rows = conn.execute(f'SELECT position, id, data FROM "{name}" WHERE (position, id) > (?, ?) '
+                                f'ORDER BY position, id LIMIT ?', (*last, page_size)).fetchall()
+            for row in rows:
+                yield serializer.loads(row[2])
+            if len(rows) < page_size:
+                return
+            last = rows[-1][:2]
+
+    def rewrite(self, filepath: str, transform: Callable[[Dict[str, Any]], bool], page_size: int = 1000) -> int:
+        """
+        Изменение всех записей коллекции одной транзакцией, страницами по page_size
+
+        Args:
+            filepath: Путь к файлу коллекции
+            transform: Функция, изменяющая запись (dict) на месте; возвращает
+                True, если запись изменена
+
+        Returns:
+            Число измененных записей
+        """
+        conn = self._connect()
+        name = self._table(conn, filepath)
+        fields = INDEXED_FIELDS.get(collection_kind(name), [])
+        assignments = ', '.join(['data = ?'] + [f'"{f}" = ?' for f in fields])
+        changed = 0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            last = (-1, '')
+            while True:
+                rows = conn.execute(f'SELECT position, id, data FROM "{name}" WHERE (position, id) > (?, ?) '
+                                    f'ORDER BY position, id LIMIT ?', (*last, page_size)).fetchall()
+                updates = []
+                for _, record_id, data in rows:
+                    record = serializer.loads(data)
+                    if transform(record):
+                        values = [_column_value(record.get(f)) if isinstance(record, Mapping) else None
+                                  for f in fields]
+                        updates.append((serializer.dumps_str(record), *values, record_id))
+                if updates:
+                    conn.executemany(f'UPDATE "{name}" SET {assignments} WHERE id = ?', updates)
+                    changed += len(updates)
+                if len(rows) < page_size:
+                    break
+                last = rows[-1][:2]
+            if changed:
+                conn.execute('INSERT INTO collections (name, version) VALUES (?, 1) '
+                             'ON CONFLICT(name) DO UPDATE SET version = version + 1', (name,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return changed
+
+    def query(self, filepath: str, **filters: Any) -> List[Any]:
+        """
+        Выборка записей с фильтрацией на стороне SQL
+
+        Args:
+            filepath: Путь к файлу коллекции
+            **filters: Условия равенства поле=значение; для полей-списков
+                (например, team у проектов) - условие "содержит значение"
+
+        Returns:
+            Список записей в исходном порядке
+        """
+        conn = self._connect()
+        name = self._table(conn, filepath)
+        clauses, params = [], []
+        for field, value in filters.items():
+            if not _NAME_RE.match(field):
+                raise ValueError(f"Недопустимое имя поля: {field}")
+            if field in INDEXED_FIELDS.get(collection_kind(name), []):
+                clauses.append(f'"{field}" = ?')
+            elif field in LIST_FIELDS.get(collection_kind(name), []):
+                clauses.append(f"EXISTS (SELECT 1 FROM json_each(data, '$.{field}') WHERE value = ?)")
+            else:
+                clauses.append(f"json_extract(data, '$.{field}') = ?")
+            params.append(_column_value(value))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = conn.execute(f'SELECT data FROM "{name}"{where} ORDER BY position', params)
+        return [serializer.loads(row[0]) for row in rows]
+
+    def scan(self, filepath: str, fields: List[str]) -> Iterator[Dict[str, Any]]:
+        """
+        Перебор записей с извлечением только указанных полей (json_extract)
+
+        Yields:
+            Словари с запрошенными полями (отсутствующие в записи поля пропускаются)
+        """
+        conn = self._connect()
+        name = self._table(conn, filepath)
+        fields = list(fields)
+        for field in fields:
+            if not _NAME_RE.match(field):
+                raise ValueError(f"Недопустимое имя поля: {field}")
+        if not fields:
+            for _ in conn.execute(f'SELECT 1 FROM "{name}" ORDER BY position'):
+                yield {}
+            return
+        columns = ', '.join(f"json_type(data, '$.{f}'), json_extract(data, '$.{f}')" for f in fields)
+        for row in conn.execute(f'SELECT {columns} FROM "{name}" ORDER BY position').fetchall():
+            record = {}
+            for i, field in enumerate(fields):
+                kind, value = row[2 * i], row[2 * i + 1]
+                if kind is None:
+                    continue
+                if kind in ('object', 'array'):
+                    value = serializer.loads(value)
+                elif kind in ('true', 'false'):
+                    value = kind == 'true'
+                record[field] = value
+            yield record
+
+    def write(self, filepath: str, data: List[Any]) -> Tuple[int]:
+        """
+        Сохранение коллекции: записываются только измененные, новые и удаленные строки
+
+        Returns:
+            Новая сигнатура (версия) коллекции
+        """
+        conn = self._connect()
+        name = self._table(conn, filepath)
+        fields = INDEXED_FIELDS.get(collection_kind(name), [])
+
+        rows: Dict[str, Tuple[Any, ...]] = {}
+        for position, record in enumerate(data):
+            record_id = record.get('id') if isinstance(record, Mapping) else None
+            record_id = str(record_id) if record_id is not None else f'#{position}'
+            if record_id in rows:
+                record_id = f'{record_id}#{position}'
+            text = serializer.dumps_str(record)
+            values = [_column_value(record.get(f)) if isinstance(record, Mapping) else None for f in fields]
+            rows[record_id] = (record_id, position, text, *values)
+
+        columns = ', '.join(['id', 'position', 'data'] + [f'"{f}"' for f in fields])
+        placeholders = ', '.join('?' * (3 + len(fields)))
+        updates = ', '.join(f'{c} = excluded.{c}' for c in ['position', 'data'] + [f'"{f}"' for f in fields])
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            existing = {row[0]: (row[1], row[2]) for row in conn.execute(f'SELECT id, position, data FROM "{name}"')}
+            changed = [row for record_id, row in rows.items() if existing.get(record_id) != (row[1], row[2])]
+            removed = [(record_id,) for record_id in existing if record_id not in rows]
+            if changed:
+                conn.executemany(f'INSERT INTO "{name}" ({columns}) VALUES ({placeholders}) '
+                                 f'ON CONFLICT(id) DO UPDATE SET {updates}', changed)
+            if removed:
+                conn.executemany(f'DELETE FROM "{name}" WHERE id = ?', removed)
+            conn.execute('INSERT INTO collections (name, version) VALUES (?, 1) '
+                         'ON CONFLICT(name) DO UPDATE SET version = version + 1', (name,))
+            version = conn.execute('SELECT version FROM collections WHERE name = ?', (name,)).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return (version,)
+
+    def write_records(self, filepath: str, upserts: List[Any], deletes: List[Any]) -> Tuple[int]:
+        """
+        Добавление/замена и удаление отдельных записей по id
+
+        Returns:
+            Новая сигнатура (версия) коллекции
+        """
+        conn = self._connect()
+        self._table(conn, filepath)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = self._write_rows(conn, filepath, upserts, deletes)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return (version,)
+
+    def write_transaction(self, changes: Dict[str, Tuple[List[Any], List[Any], Dict[Any, Any]]]) -> Dict[str, Tuple[int]]:
+        """
+        Записать изменения нескольких коллекций одной транзакцией SQLite
+
+        Args:
+            changes: Коллекция -> (upserts, deletes, исходные версии записей - не используются)
+
+        Returns:
+            Новые сигнатуры (версии) коллекций
+        """
+        conn = self._connect()
+        for filepath in changes:
+            self._table(conn, filepath)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            versions = {filepath: (self._write_rows(conn, filepath, upserts, deletes),)
+                        for filepath, (upserts, deletes, _) in changes.items()}
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return versions
+
+    def _write_rows(self, conn: sqlite3.Connection, filepath: str, upserts: List[Any], deletes: List[Any]) -> int:
+        """Изменение строк коллекции внутри открытой транзакции; возвращает новую версию"""
+        name = self._table(conn, filepath)
+        fields = INDEXED_FIELDS.get(collection_kind(name), [])
+        columns = ', '.join(['id', 'position', 'data'] + [f'"{f}"' for f in fields])
+        placeholders = ', '.join(['?', f'(SELECT COALESCE(MAX(position), -1) + 1 FROM "{name}")']
+                                 + ['?'] * (1 + len(fields)))
+        updates = ', '.join(f'{c} = excluded.{c}' for c in ['data'] + [f'"{f}"' for f in fields])
+        rows = [(str(record['id']), serializer.dumps_str(record),
+                 *[_column_value(record.get(f)) for f in fields]) for record in upserts]
+
+        # executemany не подходит: позиция новой записи зависит от предыдущих вставок
+        for row in rows:
+            conn.execute(f'INSERT INTO "{name}" ({columns}) VALUES ({placeholders}) '
+                         f'ON CONFLICT(id) DO UPDATE SET {updates}', row)
+        if deletes:
+            conn.executemany(f'DELETE FROM "{name}" WHERE id = ?', [(str(d),) for d in deletes])
+        conn.execute('INSERT INTO collections (name, version) VALUES (?, 1) '
+                     'ON CONFLICT(name) DO UPDATE SET version = version + 1', (name,))
+        return conn.execute('SELECT version FROM collections WHERE name = ?', (name,)).fetchone()[0]
+
+    def compact(self, filepath: str) -> Tuple[int]:
+        """Уплотнение не требуется: SQLite изменяет строки на месте"""
+        return self.signature(filepath)
+
+    def drop(self, filepath: str) -> None:
+        conn = self._connect()
+        name = collection_name(filepath)
+        conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+        conn.execute('DELETE FROM collections WHERE name = ?', (name,))
+        with self._lock:
+            self._tables.discard(name)
+
+
+def import_json(backend: SqliteBackend, filepaths: List[str]) -> Dict[str, int]:
+    """
+    Однократный импорт JSON-файлов в SQLite
+
+    Returns:
+        Количество импортированных записей по каждой коллекции
+    """
+    from app.storage import JsonBackend
+
+    source = JsonBackend()
+    source.recover()
+    result = {}
+    for filepath in filepaths:
+        if not source.exists(filepath):
+            continue
+        data = source.read(filepath)
+        backend.write(filepath, data)
+        result[collection_name(filepath)] = len(data)
+    return result
+
+
+def export_json(backend: SqliteBackend, filepaths: List[str]) -> Dict[str, int]:
+    """
+    Экспорт коллекций из SQLite обратно в JSON-файлы
+
+    Returns:
+        Количество экспортированных записей по каждой коллекции
+    """
+    from app.storage import JsonBackend
+
+    target = JsonBackend()
+    result = {}
+    for filepath in filepaths:
+        if not backend.exists(filepath):
+            continue
+        data = backend.read(filepath)
+        target.write(filepath, data)
+        result[collection_name(filepath)] = len(data)
+    return result
+
+
+__all__ = [
+    'SqliteBackend',
+    'collection_name',
+    'collection_kind',
+    'import_json',
+    'export_json'
+]
@@ -0,0 +1,1280 @@
+"""
+storage.py - Кэширующий слой доступа к коллекциям базы данных
+
+Разобранные коллекции хранятся в памяти процесса и перепроверяются
+дешевой сигнатурой бэкенда (для JSON - stat() с mtime/size/inode)
+вместо повторного чтения и разбора на каждый запрос.
+
+Бэкенд хранения выбирается параметром Config.STORAGE_BACKEND:
+'json' (файлы в Config.DATABASE_PATH) или 'sqlite' (см. sqlite_storage.py).
+
+Изменения отдельных записей (save_records) не перезаписывают коллекцию целиком:
+в JSON-бэкенде они дописываются в журнал <файл>.journal одной строкой на пакет,
+а полный снимок переписывается только при уплотнении журнала.
+
+Запись коллекции выполняется под межпроцессной блокировкой (fcntl.flock по файлу
+<файл>.lock), чтение снимка и журнала - под разделяемой. Чтение-изменение-запись
+одной записи проверяет, что запись не изменилась с момента чтения (ConflictError).
+Изменения параллельных запросов объединяются в пакеты (app.group_commit).
+
+Изменения нескольких коллекций записываются транзакцией (save_transaction)
+с одной точкой фиксации: в JSON-бэкенде это атомарно переименованный файл
+транзакции в Config.TRANSACTIONS_PATH (fsync файла и директории), после которого изменения
+дописываются в журналы коллекций; прерванная транзакция доигрывается при
+следующем запуске (JsonBackend.recover).
+
+После каждой записи публикуются события изменений записей (app.changes).
+"""
+
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections.abc import Mapping
+from datetime import datetime
+from contextlib import contextmanager, ExitStack
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from config import Config
+from app import serializer
+from app.records import Record, record_class
+from app.group_commit import GroupCommitWriter, PendingChange
+from app.changes import change_bus, record_changes, collection_changes
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки только внутри процесса
+    fcntl = None
+
+
+class ConflictError(Exception):
+    """Запись была изменена другим запросом между чтением и сохранением"""
+
+    def __init__(self, filepath: str, record_id: Any):
+        super().__init__(f"Запись {record_id} в {os.path.basename(filepath)} изменена параллельным запросом")
+        self.filepath = filepath
+        self.record_id = record_id
+
+
+def _readonly(*args, **kwargs):
+    raise TypeError('Данные из кэша доступны только для чтения, используйте load_data() для изменения')
+
+
+class ReadOnlyDict(dict):
+    """Словарь, запрещающий изменение (запись из кэша коллекции)"""
+
+    __setitem__ = __delitem__ = _readonly
+    update = pop = popitem = setdefault = clear = _readonly
+    __ior__ = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class ReadOnlyList(list):
+    """Список, запрещающий изменение (вложенные списки записей из кэша)"""
+
+    __setitem__ = __delitem__ = _readonly
+    append = extend = insert = remove = pop = clear = sort = reverse = _readonly
+    __iadd__ = __imul__ = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+def freeze(value: Any) -> Any:
+    """Преобразует JSON-структуру в неизменяемое представление"""
+    if isinstance(value, Record):
+        return value
+    if isinstance(value, dict):
+        return ReadOnlyDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return ReadOnlyList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Возвращает изменяемую копию JSON-структуры (обратное к freeze)"""
+    if isinstance(value, (dict, Record)):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+
+_SCALARS = (str, int, float, type(None))
+
+
+def freeze_record(record_cls: Optional[type], value: Any) -> Any:
+    """Неизменяемое представление записи: объект класса record_cls (см. app.records) или ReadOnlyDict"""
+    if record_cls is None or not isinstance(value, dict):
+        return freeze(value)
+    nested = record_cls.NESTED
+    return record_cls((k, v if isinstance(v, _SCALARS) else freeze_record(nested.get(k), v))
+                      for k, v in value.items())
+
+
+def freeze_collection(filepath: str, data: Any) -> Any:
+    """Неизменяемое представление коллекции с записями ее класса (app.records.record_class)"""
+    if not isinstance(data, list):
+        return freeze(data)
+    record_cls = record_class(filepath)
+    return ReadOnlyList(freeze_record(record_cls, r) for r in data)
+
+
+def file_signature(filepath: str) -> Optional[Tuple[int, int, int]]:
+    """Сигнатура файла для проверки актуальности кэша: (mtime_ns, size, inode)"""
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def sync_directory(path: str) -> None:
+    """fsync директории: созданные и переименованные в ней файлы переживут сбой ОС"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def apply_changes(records: List[Any], batches: Iterable[Tuple[Iterable[Any], Iterable[Any]]]) -> List[Any]:
+    """
+    Применить пакеты изменений к списку записей
+
+    Args:
+        records: Исходный список записей (не изменяется)
+        batches: Последовательность пакетов (upserts, deletes): записи для
+            добавления/замены по id и id записей для удаления
+
+    Returns:
+        Новый список: замененные записи остаются на своих местах, новые - в конце
+    """
+    result = list(records)
+    positions = {r.get('id'): i for i, r in enumerate(result) if isinstance(r, Mapping)}
+    removed = False
+    for upserts, deletes in batches:
+        for record in upserts:
+            position = positions.get(record.get('id'))
+            if position is None:
+                positions[record.get('id')] = len(result)
+                result.append(record)
+            else:
+                result[position] = record
+        for record_id in deletes:
+            position = positions.pop(record_id, None)
+            if position is not None:
+                result[position] = _DELETED
+                removed = True
+    if removed:
+        result = [r for r in result if r is not _DELETED]
+    return result
+
+
+_DELETED = object()
+
+
+def iter_changes(records: Iterable[Any], batches: Iterable[Tuple[Iterable[Any], Iterable[Any]]]) -> Iterator[Any]:
+    """
+    Потоковый вариант apply_changes: записи перебираются один раз и не копируются в список
+
+    В памяти находятся только изменения из batches (журнал коллекции); порядок
+    результата тот же, что у apply_changes.
+    """
+    # id -> [(номер изменения, запись или None - удаление)]
+    changes: Dict[Any, List[Tuple[int, Any]]] = {}
+    number = 0
+    for upserts, deletes in batches:
+        for record in upserts:
+            changes.setdefault(record.get('id'), []).append((number, record))
+            number += 1
+        for record_id in deletes:
+            changes.setdefault(record_id, []).append((number, None))
+            number += 1
+
+    def outcome(record_id: Any, record: Any) -> Tuple[Any, Any]:
+        """Итог изменений записи: (None - на своем месте, номер - в конце, _DELETED), запись"""
+        place = None if record is not None else _DELETED
+        for number, change in changes[record_id]:
+            if change is None:
+                place = _DELETED
+            else:
+                if place is _DELETED:
+                    place = number
+                record = change
+        return place, record
+
+    appended = []
+    seen = set()
+    for record in records:
+        record_id = record.get('id') if isinstance(record, Mapping) else None
+        if record_id is None or record_id not in changes:
+            yield record
+            continue
+        seen.add(record_id)
+        place, record = outcome(record_id, record)
+        if place is None:
+            yield record
+        elif place is not _DELETED:
+            appended.append((place, record))
+    for record_id in changes:
+        if record_id not in seen:
+            place, record = outcome(record_id, None)
+            if place is not _DELETED:
+                appended.append((place, record))
+    appended.sort(key=lambda item: item[0])
+    for _, record in appended:
+        yield record
+
+
+_held_locks = threading.local()
+_process_locks: Dict[str, threading.RLock] = {}
+_process_locks_guard = threading.Lock()
+
+
+def lock_path(filepath: str) -> str:
+    return f"{filepath}.lock"
+
+
+def holds_lock(filepath: str) -> bool:
+    """Удерживает ли текущий поток блокировку коллекции"""
+    held = getattr(_held_locks, 'locks', None)
+    return bool(held) and filepath in held
+
+
+@contextmanager
+def collection_lock(filepath: str, exclusive: bool = True):
+    """
+    Блокировка коллекции между процессами и потоками
+
+    Разделяемая блокировка (exclusive=False) допускает параллельных читателей,
+    исключительная - одного писателя. Повторный захват в том же потоке не блокирует;
+    повышение разделяемой блокировки до исключительной не допускается.
+    Без fcntl (Windows) используется блокировка внутри процесса.
+
+    Args:
+        filepath: Путь к файлу коллекции
+        exclusive: Исключительная блокировка (для записи)
+    """
+    held = getattr(_held_locks, 'locks', None)
+    if held is None:
+        held = _held_locks.locks = {}
+
+    current = held.get(filepath)
+    if current is not None:
+        if exclusive and not current[1]:
+            raise RuntimeError(f"Нельзя повысить блокировку чтения до записи: {filepath}")
+        current[2] += 1
+        try:
+            yield
+        finally:
+            current[2] -= 1
+        return
+
+    if fcntl is None:
+        with _process_locks_guard:
+            handle = _process_locks.setdefault(filepath, threading.RLock())
+        handle.acquire()
+    else:
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # flock действует на открытый файл, поэтому потоки одного процесса
+        # с собственными дескрипторами тоже исключают друг друга
+        handle = open(lock_path(filepath), 'a')
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        except BaseException:
+            handle.close()
+            raise
+
+    held[filepath] = [handle, exclusive, 1]
+    try:
+        yield
+    finally:
+        del held[filepath]
+        if fcntl is None:
+            handle.release()
+        else:
+            handle.close()
+
+
+@contextmanager
+def collection_locks(filepaths: Iterable[str], exclusive: bool = True):
+    """
+    Блокировка нескольких коллекций
+
+    Блокировки захватываются в порядке путей, чтобы транзакции с пересекающимися
+    наборами коллекций не ждали друг друга по кругу.
+    """
+    with ExitStack() as stack:
+        for filepath in sorted(set(filepaths)):
+            stack.enter_context(collection_lock(filepath, exclusive))
+        yield
+
+
+def _boot_id() -> str:
+    """Идентификатор текущей загрузки ОС ('' - неизвестен)"""
+    try:
+        with open('/proc/sys/kernel/random/boot_id', 'r') as f:
+            return f.read().strip()[:8]
+    except OSError:
+        return ''
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class JsonBackend:
+    """Хранение коллекций в JSON-файлах (бэкенд по умолчанию)"""
+
+    name = 'json'
+    # Каждая запись журнала завершается fsync - выгодно объединять записи в пакеты
+    group_commit = True
+
+    # Файлы транзакций: <время>-<загрузка ОС>-<pid>-<случайная часть>.txn;
+    # после записи в журналы коллекций файл переименовывается в .done и
+    # удаляется при контрольной точке (checkpoint)
+    _COMMITTED = '.txn'
+    _APPLIED = '.done'
+
+    def __init__(self, transactions_path: Optional[str] = None):
+        self.transactions_path = transactions_path or Config.TRANSACTIONS_PATH
+        self._boot = _boot_id()
+
+    @staticmethod
+    def journal_path(filepath: str) -> str:
+        return f"{filepath}.journal"
+
+    def signature(self, filepath: str) -> Any:
+        return (file_signature(filepath), file_signature(self.journal_path(filepath)))
+
+    def exists(self, filepath: str) -> bool:
+        return os.path.exists(filepath) or os.path.exists(self.journal_path(filepath))
+
+    def streamed(self, filepath: str) -> bool:
+        """Читать ли коллекцию потоком (снимок не меньше Config.STREAMING_READ_BYTES)"""
+        signature = file_signature(filepath)
+        return signature is not None and signature[1] >= Config.STREAMING_READ_BYTES
+
+    def read(self, filepath: str) -> Any:
+        """Чтение снимка коллекции и применение журнала изменений"""
+        base = file_signature(filepath)
+        try:
+            data = self._read_snapshot(filepath)
+        except serializer.JSONDecodeError as e:
+            print(f"JSON decode error in {filepath}: {e}")
+            # Поврежденный снимок переносится в карантин вместе с копией журнала;
+            # проверка целостности (app.integrity) восстановит коллекцию
+            print(f"Corrupted file moved to quarantine: {self.quarantine(filepath)}")
+            return []
+        return self._apply_journal(data, self.journal_path(filepath), base)
+
+    def iter_read(self, filepath: str, strict: bool = False) -> Iterator[Any]:
+        """
+        Потоковое чтение коллекции: записи снимка разбираются по одной
+        (serializer.iter_array), журнал накладывается на лету (iter_changes)
+
+        Снимок открывается и журнал читается сразу, под разделяемой блокировкой:
+        перебор видит согласованное состояние, даже если коллекция будет
+        переписана до его окончания.
+
+        Args:
+            filepath: Путь к файлу коллекции
+            strict: Передать ошибку разбора вызывающему, а не завершить перебор
+                и перенести снимок в карантин (как read)
+        """
+        with collection_lock(filepath, exclusive=False):
+            try:
+                snapshot = open(filepath, 'rb')
+            except FileNotFoundError:
+                snapshot = None
+            base = file_signature(filepath) if snapshot is not None else None
+            batches = self.read_journal(self.journal_path(filepath), base)
+        return self._iter_snapshot(filepath, snapshot, base, batches, strict)
+
+    def _iter_snapshot(self, filepath: str, snapshot: Any, base: Any,
+                       batches: List[Tuple[List[Any], List[Any]]], strict: bool) -> Iterator[Any]:
+        if snapshot is None:
+            yield from iter_changes((), batches)
+            return
+        with snapshot:
+            try:
+                yield from iter_changes(serializer.iter_array(snapshot), batches)
+            except serializer.JSONDecodeError as e:
+                if strict:
+                    raise
+                print(f"JSON decode error in {filepath}: {e}")
+                with collection_lock(filepath, exclusive=False):
+                    # Снимок мог быть переписан во время перебора - в карантин только прочитанный
+                    if file_signature(filepath) == base:
+                        print(f"Corrupted file moved to quarantine: {self.quarantine(filepath)}")
+
+    def read_files(self, snapshot_path: str, journal_path: str, base: Any) -> Any:
+        """
+        Чтение коллекции из файлов вне базы данных (резервная копия, карантин)
+
+        Args:
+            snapshot_path: Файл снимка
+            journal_path: Файл журнала
+            base: Сигнатура исходного снимка, к которому относится журнал
+
+        Raises:
+            serializer.JSONDecodeError: Снимок поврежден
+        """
+        return self._apply_journal(self._read_snapshot(snapshot_path), journal_path, base)
+
+    def _apply_journal(self, data: Any, journal_path: str, base: Any) -> Any:
+        batches = self.read_journal(journal_path, base)
+        if batches:
+            data = apply_changes(data, batches)
+        return data
+
+    def read_journal(self, journal_path: str, base: Any, check_base: bool = True) -> List[Tuple[List[Any], List[Any]]]:
+        """
+        Чтение журнала изменений коллекции
+
+        Первая строка журнала содержит сигнатуру снимка, к которому он относится.
+        Если снимок с тех пор был переписан целиком (save_data или уплотнение),
+        журнал устарел и игнорируется.
+
+        Args:
+            journal_path: Файл журнала
+            base: Сигнатура снимка (None - снимка нет)
+            check_base: False - принять журнал независимо от снимка (восстановление)
+        """
+        try:
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                lines = f.read().split('\n')
+        except FileNotFoundError:
+            return []
+
+        try:
+            header = serializer.loads(lines[0])
+        except (ValueError, IndexError):
+            return []
+        header_base = header.get('base')
+        if check_base and (tuple(header_base) if header_base else None) != (tuple(base) if base else None):
+            return []
+
+        batches = []
+        for line in lines[1:]:
+            if not line.strip():
+                continue
+            try:
+                entry = serializer.loads(line)
+            except ValueError:
+                # Оборванная последняя запись после сбоя
+                print(f"Incomplete journal entry in {journal_path} skipped")
+                break
+            batches.append((entry.get('put', []), entry.get('del', [])))
+        return batches
+
+    def _read_snapshot(self, filepath: str) -> Any:
+        """Чтение и разбор JSON-файла (ошибка разбора передается вызывающему)"""
+        try:
+            if not os.path.exists(filepath):
+                return []
+
+            with open(filepath, 'rb') as f:
+                content = f.read()
+
+                # Проверка на пустой файл
+                if not content.strip():
+                    return []
+
+                return serializer.loads(content)
+
+        except serializer.JSONDecodeError:
+            raise
+
+        except Exception as e:
+            print(f"Error loading {filepath}: {e}")
+            return []
+
+    def quarantine(self, filepath: str) -> Optional[str]:
+        """
+        Перенести поврежденный снимок коллекции в карантин (Config.QUARANTINE_PATH)
+
+        Журнал копируется рядом с ним: после переноса новые записи начнут
+        журнал заново, а изменения из прежнего понадобятся при восстановлении.
+
+        Returns:
+            Путь к снимку в карантине (None, если файла уже нет)
+        """
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        relpath = os.path.relpath(filepath, Config.DATABASE_PATH)
+        target = os.path.join(Config.QUARANTINE_PATH, f"{relpath}.{stamp}.corrupt")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        journal_path = self.journal_path(filepath)
+        if os.path.exists(journal_path):
+            shutil.copy2(journal_path, target[:-len('.corrupt')] + '.journal')
+        try:
+            os.rename(filepath, target)
+        except FileNotFoundError:
+            return None
+        return target
+
+    def write(self, filepath: str, data: Any) -> Any:
+        """
+        Сохранение данных в JSON с атомарной записью
+
+        Returns:
+            Сигнатура записанного файла
+        """
+        return self._write_file(filepath, lambda f: f.write(
+            serializer.dumps(data, pretty=not Config.JSON_COMPACT_STORAGE)))
+
+    def write_stream(self, filepath: str, records: Iterable[Any]) -> Any:
+        """Сохранение коллекции из итератора записей без сборки списка и всего текста в памяти"""
+        return self._write_file(filepath, lambda f: serializer.dump_array(
+            records, f, pretty=not Config.JSON_COMPACT_STORAGE))
+
+    def rewrite(self, filepath: str, transform: Callable[[Dict[str, Any]], bool]) -> int:
+        """
+        Потоковое изменение всех записей коллекции (под исключительной блокировкой)
+
+        Args:
+            filepath: Путь к файлу коллекции
+            transform: Функция, изменяющая запись (dict) на месте; возвращает
+                True, если запись изменена
+
+        Returns:
+            Число измененных записей (если 0, коллекция не переписывается)
+        """
+        changed = 0
+
+        def records():
+            nonlocal changed
+            for record in self.iter_read(filepath, strict=True):
+                if transform(record):
+                    changed += 1
+                yield record
+
+        def fill(f):
+            serializer.dump_array(records(), f, pretty=not Config.JSON_COMPACT_STORAGE)
+            return changed > 0
+
+        self._write_file(filepath, fill)
+        return changed
+
+    def _write_file(self, filepath: str, fill: Callable[[Any], Any]) -> Any:
+        """
+        Атомарная замена файла коллекции: fill(f) заполняет временный файл;
+        если fill возвращает False, файл не заменяется (результат None)
+        """
+        temp_path = None
+        try:
+            # Убедимся, что директория существует
+            directory = os.path.dirname(filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            # Запись во временный файл
+            temp_path = f"{filepath}.tmp.{os.getpid()}"
+
+            with open(temp_path, 'wb') as f:
+                if fill(f) is False:
+                    f.close()
+                    os.remove(temp_path)
+                    return None
+                f.flush()
+                os.fsync(f.fileno())
+                # rename сохраняет inode и mtime, поэтому сигнатуру можно снять заранее
+                signature = file_signature(temp_path)
+
+            # Проверка существования временного файла перед заменой
+            if not os.path.exists(temp_path):
+                raise FileNotFoundError(f"Временный файл не создан: {temp_path}")
+
+            # Атомарная замена (журнал, относящийся к прежнему снимку, становится устаревшим)
+            os.replace(temp_path, filepath)
+            self._remove_journal(filepath)
+            return (signature, None)
+
+        except Exception as e:
+            print(f"Error saving {filepath}: {e}")
+            # Удаление временного файла если остался
+            if temp_path and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except:
+                    pass
+            raise
+
+    def write_records(self, filepath: str, upserts: List[Any], deletes: List[Any]) -> Any:
+        """
+        Дописать пакет изменений в журнал коллекции (один fsync на пакет)
+
+        Returns:
+            Сигнатура коллекции после записи
+        """
+        return self._append_journal(filepath, upserts, deletes, sync=True)
+
+    def _append_journal(self, filepath: str, upserts: List[Any], deletes: List[Any], sync: bool) -> Any:
+        """Дописать пакет в журнал (fsync - только при sync) и уплотнить большой журнал"""
+        journal_path = self.journal_path(filepath)
+        entry = {}
+        if upserts:
+            entry['put'] = upserts
+        if deletes:
+            entry['del'] = deletes
+        line = serializer.dumps_str(entry) + '\n'
+
+        base = file_signature(filepath)
+        header = serializer.dumps_str({'base': list(base) if base else None}) + '\n'
+        with open(journal_path, 'a+', encoding='utf-8') as f:
+            f.seek(0)
+            if f.readline() != header:
+                # Журнала нет или он относится к прежнему снимку - начинаем новый
+                f.truncate(0)
+                f.write(header)
+            f.write(line)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+        if file_signature(journal_path)[1] > Config.JOURNAL_MAX_BYTES:
+            return self.compact(filepath)
+        return self.signature(filepath)
+
+    def write_transaction(self, changes: Dict[str, Tuple[List[Any], List[Any], Dict[Any, Any]]]) -> Dict[str, Any]:
+        """
+        Записать изменения нескольких коллекций атомарно
+
+        Точка фиксации - переименование полностью записанного файла транзакции
+        (fsync файла и директории транзакций); затем пакеты дописываются в журналы
+        коллекций без fsync. Вызывающий удерживает блокировки всех коллекций транзакции.
+
+        Args:
+            changes: Коллекция -> (upserts, deletes, исходные версии затронутых
+                записей {id: запись или None}); исходные версии нужны recover(),
+                чтобы отличить недописанную транзакцию от уже измененных позднее записей
+
+        Returns:
+            Сигнатуры коллекций после записи
+        """
+        base = os.path.dirname(self.transactions_path)
+        entry = {'collections': [
+            {'path': os.path.relpath(filepath, base), 'put': upserts, 'del': deletes,
+             'before': [[record_id, record] for record_id, record in before.items()]}
+            for filepath, (upserts, deletes, before) in changes.items()]}
+
+        os.makedirs(self.transactions_path, exist_ok=True)
+        name = f'{time.time_ns():020d}-{self._boot or "0"}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        path = os.path.join(self.transactions_path, name + self._COMMITTED)
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(serializer.dumps(entry))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        # Переименование фиксирует транзакцию, только когда оно на диске: иначе после
+        # сбоя в журналах могли бы остаться пакеты без файла транзакции
+        sync_directory(self.transactions_path)
+
+        signatures = {filepath: self._append_journal(filepath, upserts, deletes, sync=False)
+                      for filepath, (upserts, deletes, _) in changes.items()}
+        os.replace(path, path[:-len(self._COMMITTED)] + self._APPLIED)
+        return signatures
+
+    def _transactions(self, suffix: str) -> List[str]:
+        try:
+            names = sorted(n for n in os.listdir(self.transactions_path) if n.endswith(suffix))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.transactions_path, n) for n in names]
+
+    def _read_transaction(self, path: str) -> Optional[List[Tuple[str, List[Any], List[Any], Dict[Any, Any]]]]:
+        try:
+            with open(path, 'rb') as f:
+                entry = serializer.loads(f.read())
+        except FileNotFoundError:
+            return None
+        base = os.path.dirname(self.transactions_path)
+        return [(os.path.join(base, c['path']), c.get('put', []), c.get('del', []),
+                 {record_id: record for record_id, record in c.get('before', [])})
+                for c in entry['collections']]
+
+    def _needs_recovery(self, path: str) -> bool:
+        """Транзакция могла остаться недописанной: процесс завершился или ОС перезагружена"""
+        _, boot, pid, _ = os.path.basename(path).split('.', 1)[0].split('-')
+        if self._boot and boot != self._boot:
+            return True
+        return path.endswith(self._COMMITTED) and not _process_alive(int(pid))
+
+    def recover(self) -> int:
+        """
+        Доиграть транзакции, прерванные сбоем между фиксацией и записью в журналы
+
+        Пакет коллекции дописывается, только если затронутые записи все еще
+        в исходном состоянии; если они уже в итоговом или изменены позднее,
+        коллекция пропускается.
+
+        Returns:
+            Число доигранных транзакций
+        """
+        recovered = 0
+        for path in self._transactions(self._COMMITTED) + self._transactions(self._APPLIED):
+            if not self._needs_recovery(path):
+                continue
+            collections = self._read_transaction(path)
+            if collections is None:
+                continue
+            with collection_locks(filepath for filepath, *_ in collections):
+                if not os.path.exists(path):
+                    continue
+                applied = False
+                for filepath, upserts, deletes, before in collections:
+                    current = {r.get('id'): r for r in self.read(filepath) if isinstance(r, dict)}
+                    if all(current.get(record_id) == record for record_id, record in before.items()):
+                        self._append_journal(filepath, upserts, deletes, sync=True)
+                        applied = True
+                os.remove(path)
+            if applied:
+                print(f"Recovered transaction {os.path.basename(path)}")
+                recovered += 1
+        return recovered
+
+    def checkpoint(self, threshold: int = 0) -> None:
+        """
+        Контрольная точка: сбросить на диск журналы коллекций записанных
+        транзакций и удалить файлы транзакций
+
+        Args:
+            threshold: Выполнять, только если записанных транзакций не меньше
+        """
+        paths = self._transactions(self._APPLIED)
+        if not paths or len(paths) < threshold:
+            return
+        filepaths = set()
+        for path in paths:
+            collections = self._read_transaction(path)
+            filepaths.update(filepath for filepath, *_ in collections or ())
+        for filepath in filepaths:
+            # Уплотненный снимок уже записан с fsync; журнал мог появиться после него
+            for name in (filepath, self.journal_path(filepath)):
+                try:
+                    with open(name, 'rb') as f:
+                        os.fsync(f.fileno())
+                except FileNotFoundError:
+                    pass
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        # Транзакции процессов, завершившихся до записи в журналы
+        if any(self._needs_recovery(path) for path in self._transactions(self._COMMITTED)):
+            self.recover()
+
+    def compact(self, filepath: str) -> Any:
+        """Уплотнение: переписать снимок с учетом журнала и удалить журнал"""
+        if not os.path.exists(self.journal_path(filepath)):
+            return self.signature(filepath)
+        if self.streamed(filepath):
+            return self.write_stream(filepath, self.iter_read(filepath, strict=True))
+        return self.write(filepath, self.read(filepath))
+
+    def _remove_journal(self, filepath: str) -> None:
+        try:
+            os.remove(self.journal_path(filepath))
+        except FileNotFoundError:
+            pass
+
+    def drop(self, filepath: str) -> None:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        self._remove_journal(filepath)
+
+
+def create_backend(name: Optional[str] = None):
+    """Создать бэкенд хранения по имени (по умолчанию из Config.STORAGE_BACKEND)"""
+    name = name or Config.STORAGE_BACKEND
+    if name == 'json':
+        backend = JsonBackend()
+        backend.recover()
+        return backend
+    if name == 'sqlite':
+        from app.sqlite_storage import SqliteBackend
+        return SqliteBackend(Config.SQLITE_DB)
+    raise ValueError(f"Неизвестный бэкенд хранения: {name}")
+
+
+class CollectionIndex:
+    """
+    Индексы коллекции: первичный ключ (id) и группировки по полям
+
+    Группировки строятся лениво при первом обращении к полю. Для полей-списков
+    (например, team у проекта) запись попадает в группу каждого элемента списка.
+    Группировка по нескольким полям задается кортежем имен, ключ группы - кортеж
+    значений этих полей.
+    """
+
+    def __init__(self, records: Any):
+        self._records = records if isinstance(records, list) else []
+        self._by_id = {r.get('id'): r for r in self._records if isinstance(r, Mapping)}
+        self._groups: Dict[Any, Dict[Any, Tuple[Any, ...]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, record_id: Any) -> Optional[Any]:
+        """Получить запись по id за O(1)"""
+        return self._by_id.get(record_id)
+
+    def filter(self, field: Union[str, Tuple[str, ...]], value: Any) -> Tuple[Any, ...]:
+        """Получить записи, у которых поле равно value (или содержит value, если поле - список)"""
+        groups = self._groups.get(field)
+        if groups is None:
+            with self._lock:
+                groups = self._groups.get(field)
+                if groups is None:
+                    groups = self._build_group(field)
+                    self._groups[field] = groups
+        return groups.get(value, ())
+
+    def ids(self):
+        """Множество всех id коллекции"""
+        return self._by_id.keys()
+
+    def _build_group(self, field: Union[str, Tuple[str, ...]]) -> Dict[Any, Tuple[Any, ...]]:
+        buckets: Dict[Any, list] = {}
+        for record in self._records:
+            if not isinstance(record, Mapping):
+                continue
+            if isinstance(field, tuple):
+                keys = (tuple(record.get(name) for name in field),)
+            else:
+                value = record.get(field)
+                keys = value if isinstance(value, list) else (value,)
+            for key in keys:
+                try:
+                    buckets.setdefault(key, []).append(record)
+                except TypeError:
+                    # Нехешируемые значения не индексируются
+                    continue
+        return {key: tuple(items) for key, items in buckets.items()}
+
+    def __len__(self):
+        return len(self._records)
+
+
+class CollectionSnapshot:
+    """Разобранный снимок коллекции; индексы строятся один раз на снимок"""
+
+    __slots__ = ('signature', 'data', '_index')
+
+    def __init__(self, signature, data):
+        self.signature = signature
+        self.data = data
+        self._index = None
+
+    def index(self) -> CollectionIndex:
+        index = self._index
+        if index is None:
+            index = CollectionIndex(self.data)
+            self._index = index
+        return index
+
+
+# Область видимости текущего запроса (см. app.unit_of_work): если она задана,
+# чтения через кэш идут через нее, а запись в коллекцию ее уведомляет
+_scope: ContextVar[Any] = ContextVar('collection_scope', default=None)
+
+
+def bind_scope(scope: Any) -> Token:
+    """Сделать scope областью видимости чтений текущего контекста (потока)"""
+    return _scope.set(scope)
+
+
+def unbind_scope(token: Token) -> None:
+    _scope.reset(token)
+
+
+def current_scope() -> Any:
+    """Активная область видимости (None вне запроса)"""
+    return _scope.get()
+
+
+class CollectionCache:
+    """Кэш разобранных коллекций и их индексов в памяти рабочего процесса"""
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._entries: Dict[str, CollectionSnapshot] = {}
+        self._lock = threading.RLock()
+        self._writer: Optional[GroupCommitWriter] = None
+        # Обновление записей старых версий схемы при чтении (см. app.migrations):
+        # путь коллекции -> функция, обновляющая запись на месте, или None
+        self.upgrader: Optional[Callable[[str], Optional[Callable[[Dict[str, Any]], Any]]]] = None
+
+    @property
+    def backend(self):
+        """Активный бэкенд хранения (создается при первом обращении)"""
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = create_backend()
+        return self._backend
+
+    def set_backend(self, backend) -> None:
+        """Сменить бэкенд хранения (кэш при этом сбрасывается)"""
+        with self._lock:
+            self._backend = backend
+            self._entries.clear()
+
+    def snapshot(self, filepath: str) -> CollectionSnapshot:
+        """Актуальный снимок коллекции (минуя область видимости запроса)"""
+        backend = self.backend
+        signature = backend.signature(filepath)
+        entry = self._entries.get(filepath)
+        if entry is not None and entry.signature == signature:
+            return entry
+
+        # Версия схемы читается до захвата блокировок (это чтение другой коллекции)
+        upgrade = self.upgrader(filepath) if self.upgrader is not None else None
+
+        # Порядок захвата: блокировка коллекции, затем блокировка кэша (как в save_records)
+        with collection_lock(filepath, exclusive=False), self._lock:
+            entry = self._entries.get(filepath)
+            if entry is not None and entry.signature == signature:
+                return entry
+            # Сигнатура снимается до чтения: если данные изменятся во время
+            # разбора, следующий вызов увидит расхождение и перечитает их
+            data = backend.read(filepath)
+            if upgrade is not None and isinstance(data, list):
+                for record in data:
+                    upgrade(record)
+            entry = CollectionSnapshot(signature, freeze_collection(filepath, data))
+            self._entries[filepath] = entry
+            return entry
+
+    def get(self, filepath: str) -> Any:
+        """
+        Получить коллекцию только для чтения
+
+        Args:
+            filepath: Путь к файлу коллекции (ключ коллекции в бэкенде)
+
+        Returns:
+            Неизменяемое представление данных коллекции
+        """
+        scope = _scope.get()
+        if scope is not None:
+            return scope.get(filepath)
+        return self.snapshot(filepath).data
+
+    def peek(self, filepath: str) -> Any:
+        """
+        Получить коллекцию, только если ее актуальный снимок уже есть в кэше
+
+        Returns:
+            Неизменяемое представление данных или None (коллекция не читается)
+        """
+        entry = self._entries.get(filepath)
+        if entry is not None and entry.signature == self.backend.signature(filepath):
+            return entry.data
+        return None
+
+    def index(self, filepath: str) -> CollectionIndex:
+        """Получить индексы актуального снимка коллекции (строятся один раз на снимок)"""
+        scope = _scope.get()
+        if scope is not None:
+            return scope.index(filepath)
+        return self.snapshot(filepath).index()
+
+    def save(self, filepath: str, data: Any) -> None:
+        """Записать коллекцию через бэкенд и обновить кэш без повторного разбора"""
+        scope = _scope.get()
+        if scope is not None:
+            scope.before_write(filepath)
+        events = None
+        with collection_lock(filepath):
+            if change_bus.active:
+                base = self.backend.signature(filepath)
+                before = self.snapshot(filepath).data if self.backend.exists(filepath) else ()
+            signature = self.backend.write(filepath, data)
+            self.put(filepath, data, signature)
+            if change_bus.active:
+                events = collection_changes(filepath, before, data, base, signature)
+        if scope is not None:
+            scope.forget(filepath)
+        if events:
+            change_bus.publish(events)
+
+    def rewrite(self, filepath: str, transform: Callable[[Dict[str, Any]], bool]) -> int:
+        """
+        Потоково изменить все записи коллекции (см. JsonBackend.rewrite); коллекция
+        не загружается в кэш, а сбрасывается из него
+
+        Returns:
+            Число измененных записей
+        """
+        scope = _scope.get()
+        if scope is not None:
+            scope.before_write(filepath)
+        with collection_lock(filepath):
+            changed = self.backend.rewrite(filepath, transform)
+            if changed:
+                self.invalidate(filepath)
+        if changed:
+            change_bus.reset(filepath)
+        return changed
+
+    def save_records(self, filepath: str, upserts: List[Any] = (), deletes: List[Any] = (),
+                     expected: Optional[Dict[Any, Any]] = None) -> None:
+        """
+        Записать изменения отдельных записей без перезаписи всей коллекции
+
+        При Config.GROUP_COMMIT (и бэкенде, где каждая запись стоит fsync,
+        см. group_commit у бэкенда) изменение записывается фоновым потоком коллекции
+        вместе с другими изменениями, пришедшими за окно сбора пакета; метод
+        возвращается после записи пакета.
+
+        Args:
+            filepath: Путь к файлу коллекции
+            upserts: Записи для добавления или замены (по id)
+            deletes: id записей для удаления
+            expected: Версии записей, прочитанные перед изменением ({id: запись из кэша});
+                если какая-то из них с тех пор изменилась, запись не выполняется
+
+        Raises:
+            ConflictError: Запись из expected была изменена параллельным запросом
+        """
+        upserts = [thaw(r) for r in upserts]
+        deletes = list(deletes)
+
+        scope = _scope.get()
+        if scope is not None:
+            # Отложенные изменения этой коллекции в запросе записываются раньше
+            scope.before_write(filepath)
+        try:
+            self._save_records(filepath, upserts, deletes, expected)
+        finally:
+            if scope is not None:
+                scope.forget(filepath)
+
+    def _save_records(self, filepath: str, upserts: List[Any], deletes: List[Any],
+                      expected: Optional[Dict[Any, Any]]) -> None:
+        # Поток, удерживающий блокировку коллекции, пишет сам: фоновый
+        # поток не смог бы ее получить, пока вызывающий ждет результата
+        if Config.GROUP_COMMIT and self.backend.group_commit and not holds_lock(filepath):
+            self.writer.submit(filepath, upserts, deletes, expected).result()
+            return
+
+        change = PendingChange(upserts, deletes, expected)
+        self._commit_changes(filepath, [change])
+        change.future.result()
+
+    @property
+    def writer(self) -> GroupCommitWriter:
+        """Фоновая пакетная запись изменений (создается при первом обращении)"""
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = GroupCommitWriter(self._commit_changes,
+                                                     window=Config.GROUP_COMMIT_WINDOW_MS / 1000)
+        return self._writer
+
+    def _commit_changes(self, filepath: str, changes: List[PendingChange]) -> None:
+        """
+        Записать пакет изменений одной записью в бэкенд
+
+        Изменения проверяются по порядку: если запись из expected изменена
+        (в том числе предыдущим изменением того же пакета), Future изменения
+        завершается ConflictError, а остальные записываются.
+        """
+        backend = self.backend
+
+        with collection_lock(filepath):
+            # Прежние версии записей нужны для проверки expected и для событий изменений
+            track = change_bus.active
+            index = self.snapshot(filepath).index() if track or any(c.expected for c in changes) else None
+            # Состояние записей после принятых изменений пакета: id -> запись (None - удалена)
+            staged: Dict[Any, Any] = {}
+            accepted = []
+            for change in changes:
+                conflict = None
+                for record_id, original in (change.expected or {}).items():
+                    current = staged[record_id] if record_id in staged else index.get(record_id)
+                    # Неизмененная запись остается тем же объектом кэша; после
+                    # перечитывания чужой записи сравниваем по содержимому
+                    if current is not original and current != original:
+                        conflict = ConflictError(filepath, record_id)
+                        break
+                if conflict is not None:
+                    change.future.set_exception(conflict)
+                    continue
+                accepted.append(change)
+                for record in change.upserts:
+                    staged[record.get('id')] = record
+                for record_id in change.deletes:
+                    staged[record_id] = None
+            if not accepted:
+                return
+
+            upserts = [r for r in staged.values() if r is not None]
+            deletes = [record_id for record_id, r in staged.items() if r is None]
+            before = backend.signature(filepath)
+            signature = backend.write_records(filepath, upserts, deletes)
+            self._apply_written(filepath, before, signature, upserts, deletes)
+
+        if track:
+            # До завершения Future: вызывающий видит производные данные уже обновленными
+            change_bus.publish(record_changes(filepath, index.get, upserts, deletes, before, signature))
+        for change in accepted:
+            change.future.set_result(None)
+
+    def _apply_written(self, filepath: str, before: Any, signature: Any,
+                       upserts: List[Any], deletes: List[Any]) -> None:
+        """Обновить снимок в кэше после записи изменений (без повторного разбора)"""
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is None or entry.signature != before:
+                # Кэш устарел еще до записи - перечитаем при следующем обращении
+                self._entries.pop(filepath, None)
+            else:
+                record_cls = record_class(filepath)
+                data = apply_changes(entry.data, [([freeze_record(record_cls, r) for r in upserts], deletes)])
+                self._entries[filepath] = CollectionSnapshot(signature, ReadOnlyList(data))
+
+    def save_transaction(self, changes: Dict[str, Tuple[List[Any], List[Any]]],
+                         expected: Optional[Dict[str, Dict[Any, Any]]] = None) -> None:
+        """
+        Записать изменения нескольких коллекций атомарно (одна точка фиксации)
+
+        После сбоя видны либо все изменения транзакции, либо ни одного. Изменение
+        одной коллекции записывается как save_records (с объединением в пакеты).
+
+        Args:
+            changes: Коллекция -> (upserts, deletes)
+            expected: Коллекция -> версии записей, прочитанные перед изменением
+                (см. save_records); при расхождении не записывается ничего
+
+        Raises:
+            ConflictError: Запись из expected была изменена параллельным запросом
+        """
+        expected = expected or {}
+        changes = {filepath: ([thaw(r) for r in upserts], list(deletes))
+                   for filepath, (upserts, deletes) in changes.items() if upserts or deletes}
+        if len(changes) <= 1:
+            for filepath, (upserts, deletes) in changes.items():
+                self.save_records(filepath, upserts, deletes, expected=expected.get(filepath))
+            return
+
+        scope = _scope.get()
+        if scope is not None:
+            for filepath in changes:
+                scope.before_write(filepath)
+        try:
+            self._commit_transaction(changes, expected)
+        finally:
+            if scope is not None:
+                for filepath in changes:
+                    scope.forget(filepath)
+
+    def _commit_transaction(self, changes: Dict[str, Tuple[List[Any], List[Any]]],
+                            expected: Dict[str, Dict[Any, Any]]) -> None:
+        backend = self.backend
+        with collection_locks(changes):
+            prepared = {}
+            for filepath, (upserts, deletes) in changes.items():
+                index = self.snapshot(filepath).index()
+                for record_id, original in (expected.get(filepath) or {}).items():
+                    current = index.get(record_id)
+                    if current is not original and current != original:
+                        raise ConflictError(filepath, record_id)
+                touched = [r.get('id') for r in upserts] + deletes
+                prepared[filepath] = (upserts, deletes, {record_id: thaw(index.get(record_id))
+                                                         for record_id in touched})
+
+            before = {filepath: backend.signature(filepath) for filepath in changes}
+            signatures = backend.write_transaction(prepared)
+            for filepath, (upserts, deletes) in changes.items():
+                self._apply_written(filepath, before[filepath], signatures[filepath], upserts, deletes)
+
+        if change_bus.active:
+            # Все события транзакции - одним пакетом
+            change_bus.publish([event for filepath, (upserts, deletes, originals) in prepared.items()
+                                for event in record_changes(filepath, originals.get, upserts, deletes,
+                                                            before[filepath], signatures[filepath])])
+
+        checkpoint = getattr(backend, 'checkpoint', None)
+        if checkpoint is not None:
+            checkpoint(Config.TRANSACTION_CHECKPOINT)
+
+    def put(self, filepath: str, data: Any, signature: Any = None) -> None:
+        """
+        Обновить кэш после собственной записи (без повторного разбора)
+
+        Args:
+            filepath: Путь к файлу коллекции
+            data: Записанные данные
+            signature: Сигнатура записанных данных; если не указана, снимается заново
+        """
+        if signature is None:
+            signature = self.backend.signature(filepath)
+        entry = CollectionSnapshot(signature, freeze_collection(filepath, data))
+        with self._lock:
+            self._entries[filepath] = entry
+
+    def invalidate(self, filepath: Optional[str] = None) -> None:
+        """Сбросить кэш одной коллекции или всех коллекций"""
+        with self._lock:
+            if filepath is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(filepath, None)
+        scope = _scope.get()
+        if scope is not None:
+            scope.forget(filepath)
+
+
+collection_cache = CollectionCache()
+
+
+__all__ = [
+    'ReadOnlyDict',
+    'ReadOnlyList',
+    'freeze',
+    'freeze_record',
+    'freeze_collection',
+    'thaw',
+    'file_signature',
+    'sync_directory',
+    'apply_changes',
+    'iter_changes',
+    'ConflictError',
+    'holds_lock',
+    'collection_lock',
+    'collection_locks',
+    'JsonBackend',
+    'create_backend',
+    'CollectionIndex',
+    'CollectionSnapshot',
+    'bind_scope',
+    'unbind_scope',
+    'current_scope',
+    'CollectionCache',
+    'collection_cache'
+]
@@ -7,6 +7,8 @@ from datetime import datetime
 from typing import List, Dict, Any, Optional
 import re
 
+from app.directory import user_directory
+
 
 class DataTable:
     """Класс для создания и фильтрации таблиц с данными"""
@@ -211,27 +213,29 @@ class DataTable:
 
 
 def create_projects_table(projects: List[Dict[str, Any]], 
-                          users: List[Dict[str, Any]]) -> DataTable:
+                          users: Optional[List[Dict[str, Any]]] = None) -> DataTable:
     """
     Создает таблицу проектов с обогащенными данными
     
     Args:
         projects: Список проектов
         users: Список пользователей для получения имен кураторов и руководителей
+               (None - справочник пользователей app.directory)
         
     Returns:
         DataTable с проектами
     """
     # Подготовка данных
     table_data = []
+    users_by_id = user_directory.entries() if users is None else {u.get('id'): u for u in users}
     
     for project in projects:
         # Найти куратора
-        supervisor = next((u for u in users if u.get('id') == project.get('supervisor_id')), None)
+        supervisor = users_by_id.get(project.get('supervisor_id'))
         supervisor_name = supervisor.get('name', '') if supervisor else ''
         
         # Найти руководителя
-        manager = next((u for u in users if u.get('id') == project.get('manager_id')), None)
+        manager = users_by_id.get(project.get('manager_id'))
         manager_name = manager.get('name', '') if manager else ''
         
         table_data.append({
@@ -257,14 +261,14 @@ def create_projects_table(projects: List[Dict[str, Any]],
 
 
 def create_tasks_table(tasks: List[Dict[str, Any]], 
-                       users: List[Dict[str, Any]],
+                       users: Optional[List[Dict[str, Any]]],
                        projects: List[Dict[str, Any]]) -> DataTable:
     """
     Создает таблицу задач с обогащенными данными
     
     Args:
         tasks: Список задач
-        users: Список пользователей
+        users: Список пользователей (None - справочник пользователей app.directory)
         projects: Список проектов
         
     Returns:
@@ -272,14 +276,16 @@ def create_tasks_table(tasks: List[Dict[str, Any]],
     """
     # Подготовка данных
     table_data = []
+    users_by_id = user_directory.entries() if users is None else {u.get('id'): u for u in users}
+    projects_by_id = {p.get('id'): p for p in projects}
     
     for task in tasks:
         # Найти исполнителя
-        assignee = next((u for u in users if u.get('id') == task.get('assignee_id')), None)
+        assignee = users_by_id.get(task.get('assignee_id'))
         executor_name = assignee.get('name', '') if assignee else ''
         
         # Найти проект
-        project = next((p for p in projects if p.get('id') == task.get('project_id')), None)
+        project = projects_by_id.get(task.get('project_id'))
         project_name = project.get('name', '') if project else ''
         
         # Определяем дату окончания
@@ -0,0 +1,391 @@
+"""
+task_store.py - Хранение задач по проектам (шарды вместо единого tasks.json)
+
+Задачи каждого проекта лежат в отдельной коллекции
+database/tasks/tasks__<project_id>.json (в SQLite - в отдельной таблице),
+а небольшой манифест database/task_manifest.json хранит соответствие
+task_id -> project_id. Просмотр проекта и операции над одной задачей
+читают только манифест и шард нужного проекта.
+
+Растущие списки задачи (история, отчеты, файлы, подзадачи) хранятся не в
+записи задачи, а в дочерних коллекциях проекта task_<список>__<project_id>.json:
+одна запись на элемент {'id', 'task_id', 'data'}. Списки задач и панель
+читают только компактные записи задач, а дочерние элементы загружаются
+по требованию (карточка задачи и подзадачи).
+
+Изменения задач и дочерних списков внутри запроса Flask откладываются
+единицей работы (app.unit_of_work) и записываются одной транзакцией вместе
+с остальными изменениями запроса.
+
+Существующий tasks.json переносится в шарды при первом обращении;
+исходные данные сохраняются в tasks.json.pre-shard.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+from app import serializer
+from app.changes import change_bus
+from app.storage import collection_cache, collection_lock, CollectionIndex, ReadOnlyList, thaw
+from app.unit_of_work import deferred as deferred_unit_of_work
+
+
+SHARD_PREFIX = 'tasks__'
+
+# Дочерние списки задачи и виды их коллекций
+CHILD_KINDS = {
+    'history': 'task_history',
+    'reports': 'task_reports',
+    'files': 'task_files',
+    'subtasks': 'task_subtasks'
+}
+
+# Списки, элементы которых имеют собственный id (остальным он назначается)
+_KEYED_CHILDREN = ('reports', 'subtasks')
+
+_SHARD_KEY_RE = re.compile(r'^[a-z0-9_]+$')
+
+_sharded_backend = None
+_combined = None
+_combined_lock = threading.Lock()
+
+
+def shard_key(project_id: Any) -> str:
+    """Имя шарда проекта (id проекта или его хэш, если id не годится для имени коллекции)"""
+    key = '' if project_id is None else str(project_id)
+    if _SHARD_KEY_RE.match(key):
+        return key
+    return 'h' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def shard_path(project_id: Any) -> str:
+    """Путь к коллекции задач проекта"""
+    return os.path.join(Config.TASK_SHARDS_PATH, f"{SHARD_PREFIX}{shard_key(project_id)}.json")
+
+
+def shard_paths(manifest: Iterable[Any]) -> List[str]:
+    """Пути всех шардов, на которые ссылается манифест"""
+    return sorted({shard_path(entry.get('project_id')) for entry in manifest})
+
+
+def child_path(field: str, project_id: Any) -> str:
+    """Путь к дочерней коллекции проекта для списка field (history, reports, files, subtasks)"""
+    return os.path.join(Config.TASK_SHARDS_PATH, f"{CHILD_KINDS[field]}__{shard_key(project_id)}.json")
+
+
+def collection_paths(manifest: Iterable[Any]) -> List[str]:
+    """Пути всех коллекций задач: шарды и дочерние коллекции проектов из манифеста"""
+    project_ids = {entry.get('project_id') for entry in manifest}
+    paths = {shard_path(p) for p in project_ids}
+    paths.update(child_path(field, p) for p in project_ids for field in CHILD_KINDS)
+    return sorted(paths)
+
+
+def child_record_id(task_id: Any, item_id: Any) -> str:
+    """id записи дочерней коллекции: элементы разных задач не пересекаются"""
+    return f"{task_id}:{item_id}"
+
+
+def _manifest_entry(task: Any) -> dict:
+    return {'id': task['id'], 'project_id': task.get('project_id')}
+
+
+def _split_task(task: Any) -> Tuple[dict, Dict[str, List[dict]]]:
+    """Отделить дочерние списки от записи задачи (id элементов детерминированы)"""
+    core = {key: value for key, value in task.items() if key not in CHILD_KINDS}
+    children = {}
+    for field in CHILD_KINDS:
+        records = {}
+        for position, item in enumerate(task.get(field) or []):
+            item_id = item.get('id') if field in _KEYED_CHILDREN else None
+            record_id = child_record_id(task['id'], item_id or f"{field}{position}")
+            if record_id in records:
+                record_id = child_record_id(task['id'], f"{field}{position}")
+            records[record_id] = {'id': record_id, 'task_id': task['id'], 'data': item}
+        if records:
+            children[field] = list(records.values())
+    return core, children
+
+
+def _write_all(tasks: List[Any]) -> None:
+    """Разложить задачи по шардам и дочерним коллекциям и записать манифест (последним)"""
+    backend = collection_cache.backend
+    stale = set(collection_paths(backend.read(Config.TASK_MANIFEST_DB))) if backend.exists(Config.TASK_MANIFEST_DB) else set()
+
+    collections = {}
+    for task in tasks:
+        project_id = task.get('project_id')
+        core, children = _split_task(task)
+        collections.setdefault(shard_path(project_id), []).append(core)
+        for field, records in children.items():
+            collections.setdefault(child_path(field, project_id), []).extend(records)
+    for filepath, records in collections.items():
+        collection_cache.save(filepath, records)
+        stale.discard(filepath)
+
+    collection_cache.save(Config.TASK_MANIFEST_DB, [_manifest_entry(t) for t in tasks])
+    for filepath in stale:
+        with collection_lock(filepath):
+            backend.drop(filepath)
+        collection_cache.invalidate(filepath)
+        change_bus.reset(filepath)
+
+
+def _embedded_children(manifest_view: Any) -> List[str]:
+    """Шарды, в записях задач которых еще хранятся дочерние списки"""
+    return [filepath for filepath in shard_paths(manifest_view)
+            if any(field in task for task in collection_cache.get(filepath) for field in CHILD_KINDS)]
+
+
+def _move_children(filepath: str) -> None:
+    """Перенести дочерние списки задач одного шарда в дочерние коллекции"""
+    cores = []
+    for task in collection_cache.get(filepath):
+        if not any(field in task for field in CHILD_KINDS):
+            continue
+        core, children = _split_task(thaw(task))
+        # Сначала элементы (id детерминированы - повтор после сбоя безопасен), затем задача
+        for field, records in children.items():
+            collection_cache.save_records(child_path(field, task.get('project_id')), upserts=records)
+        cores.append(core)
+    if cores:
+        collection_cache.save_records(filepath, upserts=cores)
+
+
+def ensure_sharded() -> None:
+    """
+    Перенести задачи из единого tasks.json в шарды, а дочерние списки
+    задач - в дочерние коллекции, если это еще не сделано
+    """
+    global _sharded_backend
+    backend = collection_cache.backend
+    if _sharded_backend is backend:
+        return
+
+    with collection_lock(Config.TASK_MANIFEST_DB):
+        if not backend.exists(Config.TASK_MANIFEST_DB):
+            tasks = backend.read(Config.TASKS_DB) if backend.exists(Config.TASKS_DB) else []
+            _write_all(tasks)
+            if backend.exists(Config.TASKS_DB):
+                with open(f"{Config.TASKS_DB}.pre-shard", 'wb') as f:
+                    f.write(serializer.dumps(tasks, pretty=True))
+                with collection_lock(Config.TASKS_DB):
+                    backend.drop(Config.TASKS_DB)
+                collection_cache.invalidate(Config.TASKS_DB)
+                print(f"Задачи перенесены в шарды по проектам: {len(tasks)}")
+
+    # Проверка без блокировки; блокировка берется, только если есть что переносить
+    if _embedded_children(collection_cache.get(Config.TASK_MANIFEST_DB)):
+        with collection_lock(Config.TASK_MANIFEST_DB):
+            for filepath in _embedded_children(collection_cache.get(Config.TASK_MANIFEST_DB)):
+                _move_children(filepath)
+            print("Дочерние списки задач перенесены в отдельные коллекции")
+    _sharded_backend = backend
+
+
+def manifest() -> Any:
+    """Манифест task_id -> project_id (только для чтения)"""
+    ensure_sharded()
+    return collection_cache.get(Config.TASK_MANIFEST_DB)
+
+
+def _task_project(task_id: Any) -> Optional[Any]:
+    ensure_sharded()
+    return collection_cache.index(Config.TASK_MANIFEST_DB).get(task_id)
+
+
+def task_shard(task_id: Any) -> Optional[str]:
+    """Путь к шарду, в котором хранится задача (None, если задачи нет)"""
+    entry = _task_project(task_id)
+    return shard_path(entry.get('project_id')) if entry is not None else None
+
+
+def child_collection(task_id: Any, field: str) -> Optional[str]:
+    """Путь к дочерней коллекции задачи для списка field (None, если задачи нет)"""
+    entry = _task_project(task_id)
+    return child_path(field, entry.get('project_id')) if entry is not None else None
+
+
+def task_children(task_id: Any, field: str) -> Tuple[Any, ...]:
+    """Элементы дочернего списка задачи в порядке добавления (только для чтения)"""
+    filepath = child_collection(task_id, field)
+    if filepath is None:
+        return ()
+    return tuple(record['data'] for record in collection_cache.index(filepath).filter('task_id', task_id))
+
+
+def find_child(task_id: Any, field: str, item_id: Any) -> Optional[Any]:
+    """Найти элемент дочернего списка задачи по его id (только для чтения)"""
+    filepath = child_collection(task_id, field)
+    if filepath is None:
+        return None
+    record = collection_cache.index(filepath).get(child_record_id(task_id, item_id))
+    return record['data'] if record is not None else None
+
+
+def add_children(task_id: Any, field: str, items: List[Any]) -> bool:
+    """
+    Дописать элементы в дочерний список задачи одним пакетом
+
+    Returns:
+        False, если задача не найдена
+    """
+    filepath = child_collection(task_id, field)
+    if filepath is None:
+        return False
+    records = []
+    for item in items:
+        item_id = item.get('id') if field in _KEYED_CHILDREN else None
+        records.append({'id': child_record_id(task_id, item_id or uuid.uuid4().hex[:12]),
+                        'task_id': task_id, 'data': thaw(item)})
+    unit_of_work = deferred_unit_of_work(filepath)
+    if unit_of_work is not None:
+        unit_of_work.put(filepath, *records)
+    else:
+        collection_cache.save_records(filepath, upserts=records)
+    return True
+
+
+def delete_child(task_id: Any, field: str, item_id: Any) -> None:
+    """Удалить элемент дочернего списка задачи"""
+    filepath = child_collection(task_id, field)
+    if filepath is None:
+        return
+    unit_of_work = deferred_unit_of_work(filepath)
+    if unit_of_work is not None:
+        unit_of_work.delete(filepath, child_record_id(task_id, item_id))
+    else:
+        collection_cache.save_records(filepath, deletes=[child_record_id(task_id, item_id)])
+
+
+def find_task(task_id: Any) -> Optional[Any]:
+    """Найти задачу по id: манифест и шард ее проекта"""
+    filepath = task_shard(task_id)
+    return collection_cache.index(filepath).get(task_id) if filepath else None
+
+
+def project_tasks(project_id: Any) -> Any:
+    """Задачи одного проекта (только для чтения)"""
+    ensure_sharded()
+    return collection_cache.get(shard_path(project_id))
+
+
+def _combined_view():
+    """Все задачи в порядке манифеста; пересобирается при изменении манифеста или шарда"""
+    global _combined
+    entries = manifest()
+    paths = shard_paths(entries)
+    views = tuple(collection_cache.get(p) for p in paths)
+
+    combined = _combined
+    if combined is not None and combined[0] is entries and len(combined[1]) == len(views) \
+            and all(a is b for a, b in zip(combined[1], views)):
+        return combined
+
+    with _combined_lock:
+        indexes = {p: collection_cache.index(p) for p in paths}
+        tasks = []
+        for entry in entries:
+            task = indexes[shard_path(entry.get('project_id'))].get(entry['id'])
+            if task is not None:
+                tasks.append(task)
+        # [манифест, снимки шардов, задачи, индекс (строится по требованию)]
+        combined = [entries, views, ReadOnlyList(tasks), None]
+        _combined = combined
+        return combined
+
+
+def all_tasks() -> Any:
+    """Все задачи реестра (только для чтения) - для сводных отчетов и панели"""
+    return _combined_view()[2]
+
+
+def all_tasks_index() -> CollectionIndex:
+    """Индексы по всем задачам (например, по исполнителю)"""
+    combined = _combined_view()
+    if combined[3] is None:
+        combined[3] = CollectionIndex(combined[2])
+    return combined[3]
+
+
+def save_task(task: Any) -> None:
+    """Сохранить задачу (добавить или заменить по id) в шард ее проекта (без дочерних списков)"""
+    ensure_sharded()
+    task, children = _split_task(thaw(task))
+    if children:
+        raise ValueError("Дочерние списки задачи сохраняются через add_children()")
+    target = shard_path(task.get('project_id'))
+
+    unit_of_work = deferred_unit_of_work(Config.TASK_MANIFEST_DB)
+    if unit_of_work is not None and collection_cache.index(Config.TASK_MANIFEST_DB).get(task['id']) is None:
+        # Новая задача (id уникален) добавляется вместе с остальными изменениями запроса;
+        # перенос между проектами требует проверки манифеста под блокировкой
+        unit_of_work.put(Config.TASK_MANIFEST_DB, _manifest_entry(task))
+        unit_of_work.put(target, task)
+        return
+
+    with collection_lock(Config.TASK_MANIFEST_DB):
+        entry = collection_cache.index(Config.TASK_MANIFEST_DB).get(task['id'])
+        # Манифест, новый и прежний шард изменяются одной транзакцией
+        changes = {target: ([task], [])}
+        if entry is None or entry.get('project_id') != task.get('project_id'):
+            changes[Config.TASK_MANIFEST_DB] = ([_manifest_entry(task)], [])
+        if entry is not None and shard_path(entry.get('project_id')) != target:
+            changes[shard_path(entry.get('project_id'))] = ([], [task['id']])
+        collection_cache.save_transaction(changes)
+
+
+def delete_task(task_id: Any) -> None:
+    """Удалить задачу из шарда и манифеста"""
+    ensure_sharded()
+    with collection_lock(Config.TASK_MANIFEST_DB):
+        filepath = task_shard(task_id)
+        if filepath is None:
+            return
+        project_id = collection_cache.index(Config.TASK_MANIFEST_DB).get(task_id).get('project_id')
+        changes = {}
+        for field in CHILD_KINDS:
+            path = child_path(field, project_id)
+            records = collection_cache.index(path).filter('task_id', task_id)
+            if records:
+                changes[path] = ([], [record['id'] for record in records])
+        changes[filepath] = ([], [task_id])
+        changes[Config.TASK_MANIFEST_DB] = ([], [task_id])
+        collection_cache.save_transaction(changes)
+
+
+def replace_all(tasks: List[Any]) -> None:
+    """Перезаписать все задачи (пересоздание базы, восстановление)"""
+    ensure_sharded()
+    with collection_lock(Config.TASK_MANIFEST_DB):
+        _write_all([thaw(t) for t in tasks])
+
+
+__all__ = [
+    'shard_key',
+    'shard_path',
+    'shard_paths',
+    'child_path',
+    'collection_paths',
+    'child_record_id',
+    'ensure_sharded',
+    'manifest',
+    'task_shard',
+    'child_collection',
+    'task_children',
+    'find_child',
+    'add_children',
+    'delete_child',
+    'find_task',
+    'project_tasks',
+    'all_tasks',
+    'all_tasks_index',
+    'save_task',
+    'delete_task',
+    'replace_all'
+]
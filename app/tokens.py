@@ -0,0 +1,180 @@
+"""
+tokens.py - Хранилище токенов приглашений
+
+Токен ищется по id через индекс коллекции; ни одна операция не перебирает
+коллекцию. При выдаче токену записывается срок действия expires_at -
+Config.TOKEN_TTL_DAYS дней (0 - бессрочно); токены без срока (выданные до
+его появления) не истекают. Токен удаляется при использовании, поэтому
+коллекция не растет с числом выданных приглашений.
+
+Фоновая очистка (TokenSweeper) раз в Config.TOKEN_SWEEP_INTERVAL секунд
+удаляет просроченные токены и оставшиеся от прежних версий использованные
+(с отметкой used) и персональные (с user_id и без роли). Ее можно запустить и командой `python manage.py sweep-tokens`.
+
+Персональные токены участников проекта, которые показываются в карточках
+задач и составе команды, не хранятся: display_token вычисляет их как HMAC
+от (user_id, project_id) на ключе Config.SECRET_KEY, поэтому их показ не
+читает и не пишет tokens.json.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
+
+from config import Config
+from app.records import DATETIME
+from app.storage import collection_cache, collection_lock, thaw
+from app.unit_of_work import deferred as deferred_unit_of_work
+
+
+class TokenStore:
+    """Токены коллекции filepath: выдача, проверка, использование и очистка"""
+
+    def __init__(self, filepath: str, ttl_days: float):
+        self.filepath = filepath
+        self.ttl = timedelta(days=ttl_days) if ttl_days > 0 else None
+
+    def expired(self, token: Any, now: Optional[datetime] = None) -> bool:
+        """Истек ли срок действия токена (токен без срока expires_at не истекает)"""
+        expires_at = token.date('expires_at') if hasattr(token, 'date') else None
+        if expires_at is None:
+            try:
+                expires_at = datetime.strptime(token.get('expires_at') or '', DATETIME)
+            except ValueError:
+                return False
+        return expires_at < (now or datetime.now())
+
+    def invitation(self, token: Any) -> bool:
+        """
+        Является ли токен приглашением
+
+        Персональные токены участников, сохраненные прежними версиями (с user_id
+        и без роли), приглашениями не являются: по ним нельзя зарегистрироваться,
+        и очистка удаляет их.
+        """
+        return bool(token.get('role')) and not token.get('user_id')
+
+    def active(self, token: Any, now: Optional[datetime] = None) -> bool:
+        """Можно ли использовать токен"""
+        return self.invitation(token) and not token.get('used') and not self.expired(token, now)
+
+    def new(self, **fields: Any) -> dict:
+        """Запись нового токена с полями fields (не сохраняется)"""
+        now = datetime.now()
+        token = {
+            'id': str(uuid.uuid4()),
+            **fields,
+            'created_at': now.strftime(DATETIME),
+            'used': False
+        }
+        if self.ttl is not None:
+            token['expires_at'] = (now + self.ttl).strftime(DATETIME)
+        return token
+
+    def issue(self, **fields: Any) -> str:
+        """Выдать новый токен с полями fields; возвращает его id"""
+        token = self.new(**fields)
+        self._put(token)
+        return token['id']
+
+    def validate(self, token_id: Any) -> Optional[dict]:
+        """Изменяемая копия действующего токена (None, если токена нет, он использован или истек)"""
+        token = collection_cache.index(self.filepath).get(token_id)
+        if token is not None and self.active(token):
+            return thaw(token)
+        return None
+
+    def consume(self, token_id: Any) -> None:
+        """Использовать токен: токен удаляется"""
+        unit_of_work = deferred_unit_of_work(self.filepath)
+        if unit_of_work is not None:
+            unit_of_work.delete(self.filepath, token_id)
+        else:
+            collection_cache.save_records(self.filepath, deletes=[token_id])
+
+    def stale(self, now: Optional[datetime] = None) -> List[Any]:
+        """id использованных, просроченных и не являющихся приглашениями токенов"""
+        now = now or datetime.now()
+        return [token.get('id') for token in collection_cache.get(self.filepath)
+                if hasattr(token, 'get') and not self.active(token, now)]
+
+    def sweep(self, now: Optional[datetime] = None) -> int:
+        """Удалить использованные, просроченные и прежние персональные токены; возвращает их число"""
+        with collection_lock(self.filepath):
+            if not collection_cache.backend.exists(self.filepath):
+                return 0
+            stale = self.stale(now)
+            if stale:
+                collection_cache.save_records(self.filepath, deletes=stale)
+        return len(stale)
+
+    def _put(self, token: dict) -> None:
+        unit_of_work = deferred_unit_of_work(self.filepath)
+        if unit_of_work is not None:
+            unit_of_work.put(self.filepath, token)
+        else:
+            collection_cache.save_records(self.filepath, upserts=[token])
+
+
+def display_token(user_id: Any, project_id: Any = None) -> str:
+    """Персональный токен пользователя в проекте (один и тот же при каждом вызове)"""
+    digest = hmac.new(Config.SECRET_KEY.encode('utf-8'), f'{user_id}:{project_id or ""}'.encode('utf-8'),
+                      hashlib.sha256).digest()
+    return str(uuid.UUID(bytes=digest[:16]))
+
+
+class TokenSweeper:
+    """Фоновая очистка хранилища токенов в рабочем процессе"""
+
+    def __init__(self, store: TokenStore, interval: float):
+        self.store = store
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+
+    def start(self) -> None:
+        """Запустить поток очистки в текущем процессе (повторный вызов ничего не делает)"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='token-sweeper', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                removed = self.store.sweep()
+                if removed:
+                    print(f"Tokens: removed {removed} used or expired")
+            except Exception as e:
+                print(f"Token sweep failed: {e}")
+
+
+token_store = TokenStore(Config.TOKENS_DB, Config.TOKEN_TTL_DAYS)
+token_sweeper = TokenSweeper(token_store, Config.TOKEN_SWEEP_INTERVAL)
+
+
+def init_app(app) -> None:
+    """Запускать фоновую очистку токенов в каждом рабочем процессе при первом запросе"""
+    if Config.TOKEN_SWEEP_INTERVAL <= 0:
+        return
+
+    @app.before_request
+    def _start_token_sweeper():
+        token_sweeper.start()
+
+
+__all__ = [
+    'TokenStore',
+    'TokenSweeper',
+    'display_token',
+    'token_store',
+    'token_sweeper',
+    'init_app'
+]
@@ -0,0 +1,286 @@
+"""
+unit_of_work.py - Единица работы запроса (flask.g.unit_of_work)
+
+В течение запроса каждая коллекция читается из кэша процесса один раз:
+следующие обращения получают тот же снимок без проверки сигнатуры.
+Изменения записей (update_record, save_record, delete_record из app.utils)
+не пишутся сразу, а накапливаются и видны последующим чтениям этого же
+запроса; после обработки запроса измененные коллекции записываются одной
+транзакцией (collection_cache.save_transaction) - по одному пакету на коллекцию
+и одна точка фиксации на запрос.
+
+Запись под блокировкой коллекции (collection_lock) выполняется сразу,
+а чтения под ней видят актуальный снимок.
+
+Если запись из отложенного изменения успела измениться в другом запросе,
+изменения коллекции применяются заново к ее актуальному снимку (функции
+mutate вызываются повторно, контекст запроса при этом еще доступен).
+Ответ с кодом 5xx отменяет отложенные изменения.
+"""
+
+import random
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from flask import Flask, g
+
+from config import Config
+from app.storage import (collection_cache, collection_locks, holds_lock, bind_scope, unbind_scope, current_scope,
+                         apply_changes, freeze_record, thaw, CollectionIndex, ConflictError,
+                         ReadOnlyList)
+from app.records import record_class
+
+
+class _Change:
+    """Отложенное изменение записи: update (mutate), put или delete"""
+
+    __slots__ = ('kind', 'record_id', 'record', 'original', 'mutate')
+
+    def __init__(self, kind: str, record_id: Any, record: Any = None, original: Any = None,
+                 mutate: Optional[Callable[[Any], Any]] = None):
+        self.kind = kind
+        self.record_id = record_id
+        self.record = record
+        self.original = original
+        self.mutate = mutate
+
+
+class _View:
+    """Снимок коллекции в запросе с наложенными отложенными изменениями"""
+
+    __slots__ = ('snapshot', 'staged', 'data', 'index')
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        # id -> неизменяемая запись (None - удалена) после отложенных изменений
+        self.staged: Dict[Any, Any] = {}
+        self.data = snapshot.data
+        self.index: Optional[CollectionIndex] = None
+
+
+class UnitOfWork:
+    """Снимки коллекций и отложенные изменения записей одного запроса"""
+
+    def __init__(self, cache=None):
+        self._cache = cache or collection_cache
+        self._views: Dict[str, _View] = {}
+        # Коллекция -> изменения в порядке выполнения (порядок коллекций - порядок записи)
+        self._changes: Dict[str, List[_Change]] = {}
+        # Число чтений снимков из кэша по коллекциям (для диагностики)
+        self.loads: Dict[str, int] = {}
+        # Производные кэши (например, справочник пользователей), уже сверенные
+        # с коллекциями в этом запросе: повторно в запросе они не проверяются
+        self.validated: Set[Any] = set()
+
+    # Чтение
+
+    def _view(self, filepath: str) -> _View:
+        view = self._views.get(filepath)
+        if view is not None and holds_lock(filepath) and filepath not in self._changes:
+            # Под блокировкой коллекции (проверка и запись) нужен актуальный снимок
+            if view.snapshot is not self._cache.snapshot(filepath):
+                view = None
+        if view is None:
+            view = _View(self._cache.snapshot(filepath))
+            self._views[filepath] = view
+            self.loads[filepath] = self.loads.get(filepath, 0) + 1
+        return view
+
+    def get(self, filepath: str) -> Any:
+        """Данные коллекции в запросе (с отложенными изменениями)"""
+        return self._view(filepath).data
+
+    def index(self, filepath: str) -> CollectionIndex:
+        """Индексы коллекции в запросе (с отложенными изменениями)"""
+        view = self._view(filepath)
+        if not view.staged:
+            return view.snapshot.index()
+        if view.index is None:
+            view.index = CollectionIndex(view.data)
+        return view.index
+
+    def has_view(self, filepath: str) -> bool:
+        """Прочитана ли коллекция в этом запросе"""
+        return filepath in self._views
+
+    # Изменения
+
+    def _stage(self, filepath: str, changes: List[_Change], records: List[Any]) -> None:
+        view = self._view(filepath)
+        record_cls = record_class(filepath)
+        for change, record in zip(changes, records):
+            view.staged[change.record_id] = freeze_record(record_cls, record) if record is not None else None
+        upserts = [r for r in view.staged.values() if r is not None]
+        deletes = [record_id for record_id, r in view.staged.items() if r is None]
+        view.data = ReadOnlyList(apply_changes(view.snapshot.data, [(upserts, deletes)]))
+        view.index = None
+        self._changes.setdefault(filepath, []).extend(changes)
+
+    def update(self, filepath: str, record_id: Any, mutate: Callable[[Any], Any]) -> Optional[Any]:
+        """
+        Отложенное изменение записи функцией mutate (см. app.utils.update_record)
+
+        Returns:
+            Измененная копия записи или None, если запись не найдена или изменение отменено
+        """
+        original = self.index(filepath).get(record_id)
+        if original is None:
+            return None
+        record = thaw(original)
+        if mutate(record) is False:
+            return None
+        self._stage(filepath, [_Change('update', record_id, thaw(record), original, mutate)], [record])
+        return record
+
+    def put(self, filepath: str, *records: Any) -> None:
+        """Отложенное добавление или замена записей по id"""
+        records = [thaw(record) for record in records]
+        self._stage(filepath, [_Change('put', record['id'], record) for record in records], records)
+
+    def delete(self, filepath: str, *record_ids: Any) -> None:
+        """Отложенное удаление записей"""
+        self._stage(filepath, [_Change('delete', record_id) for record_id in record_ids],
+                    [None] * len(record_ids))
+
+    # Запись
+
+    def before_write(self, filepath: str) -> None:
+        """Вызывается кэшем перед немедленной записью в коллекцию: сначала пишутся отложенные"""
+        if filepath in self._changes:
+            self.flush(filepath)
+
+    def forget(self, filepath: Optional[str] = None) -> None:
+        """Вызывается кэшем после записи в коллекцию: снимок запроса перечитывается"""
+        if filepath is None:
+            for path in [p for p in self._views if p not in self._changes]:
+                del self._views[path]
+        elif filepath not in self._changes:
+            self._views.pop(filepath, None)
+
+    def flush(self, filepath: Optional[str] = None) -> None:
+        """Записать отложенные изменения (всех коллекций одной транзакцией или одной коллекции)"""
+        paths = [filepath] if filepath is not None else list(self._changes)
+        batch = {}
+        for path in paths:
+            changes = self._changes.pop(path, None)
+            if changes:
+                self._views.pop(path, None)
+                batch[path] = changes
+        if batch:
+            self._commit(batch)
+
+    def discard(self) -> None:
+        """Отменить отложенные изменения"""
+        for path in self._changes:
+            self._views.pop(path, None)
+        self._changes.clear()
+
+    def _commit(self, batch: Dict[str, List[_Change]]) -> None:
+        # Первая попытка записывает результаты, полученные при обработке запроса
+        replayed = {path: self._replay(changes, None) for path, changes in batch.items()}
+        for attempt in range(Config.CONFLICT_RETRIES):
+            last = attempt + 1 == Config.CONFLICT_RETRIES
+            with collection_locks(batch) if last else nullcontext():
+                if attempt:
+                    replayed = {path: self._replay(changes, self._cache.snapshot(path).index())
+                                for path, changes in batch.items()}
+                writes, expected = {}, {}
+                for path, (staged, originals) in replayed.items():
+                    writes[path] = ([r for r in staged.values() if r is not None],
+                                    [record_id for record_id, r in staged.items() if r is None])
+                    expected[path] = originals
+                try:
+                    self._cache.save_transaction(writes, expected=expected)
+                    return
+                except ConflictError:
+                    if last:
+                        raise
+            time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+
+    @staticmethod
+    def _replay(changes: List[_Change], index: Optional[CollectionIndex]):
+        """
+        Итоговое состояние измененных записей и ожидаемые исходные версии
+
+        Без индекса используются результаты, полученные при обработке запроса;
+        с индексом актуального снимка функции mutate применяются к нему заново.
+        """
+        staged: Dict[Any, Any] = {}
+        expected: Dict[Any, Any] = {}
+        for change in changes:
+            record_id = change.record_id
+            if change.kind == 'update':
+                if index is None:
+                    if record_id not in staged:
+                        expected.setdefault(record_id, change.original)
+                    staged[record_id] = change.record
+                    continue
+                current = staged[record_id] if record_id in staged else index.get(record_id)
+                if current is None:
+                    continue
+                if record_id not in staged:
+                    expected.setdefault(record_id, current)
+                record = thaw(current)
+                if change.mutate(record) is not False:
+                    staged[record_id] = record
+            elif change.kind == 'put':
+                staged[record_id] = change.record
+            else:
+                staged[record_id] = None
+        return staged, expected
+
+
+def current() -> Optional[UnitOfWork]:
+    """Единица работы текущего запроса (None вне запроса)"""
+    scope = current_scope()
+    return scope if isinstance(scope, UnitOfWork) else None
+
+
+def deferred(filepath: str) -> Optional[UnitOfWork]:
+    """
+    Единица работы, если изменение коллекции можно отложить до конца запроса
+
+    Вне запроса и под блокировкой коллекции изменения записываются сразу.
+    """
+    unit_of_work = current()
+    if unit_of_work is None or holds_lock(filepath):
+        return None
+    return unit_of_work
+
+
+def init_app(app: Flask) -> None:
+    """Подключить единицу работы к обработке запросов приложения"""
+
+    @app.before_request
+    def _begin_unit_of_work():
+        g.unit_of_work = UnitOfWork()
+        g.unit_of_work_token = bind_scope(g.unit_of_work)
+
+    @app.after_request
+    def _flush_unit_of_work(response):
+        unit_of_work = g.get('unit_of_work')
+        if unit_of_work is not None:
+            if response.status_code >= 500:
+                unit_of_work.discard()
+            else:
+                unit_of_work.flush()
+        return response
+
+    @app.teardown_request
+    def _end_unit_of_work(exc):
+        unit_of_work = g.pop('unit_of_work', None)
+        token = g.pop('unit_of_work_token', None)
+        if unit_of_work is not None:
+            # Изменения, не записанные из-за исключения, отменяются
+            unit_of_work.discard()
+        if token is not None:
+            unbind_scope(token)
+
+
+__all__ = [
+    'UnitOfWork',
+    'current',
+    'deferred',
+    'init_app'
+]
@@ -1,68 +1,66 @@
-import json
-import os
-import uuid
+import random
+import shutil
+import time
+from contextlib import nullcontext
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 from config import Config
-from dateutil.parser import parse as parse_date
 from flask_login import current_user
+from app.storage import collection_cache, collection_lock, thaw, ConflictError
+from app.changes import change_bus
+from app.directory import user_directory
+from app.unit_of_work import current as current_unit_of_work, deferred as deferred_unit_of_work
+from app import archive, migrations, task_store
+from app.packed import scan_packed
+from app.passwords import hash_password
+from app.tokens import display_token, token_store
 
 app_config = Config()
 
 def init_database(force_recreate=False):
+    backend = collection_cache.backend
     if force_recreate:
         print("Принудительное пересоздание базы данных...")
-        if os.path.exists(app_config.USERS_DB):
-            os.remove(app_config.USERS_DB)
-        if os.path.exists(app_config.PROJECTS_DB):
-            os.remove(app_config.PROJECTS_DB)
-        if os.path.exists(app_config.TASKS_DB):
-            os.remove(app_config.TASKS_DB)
-        if os.path.exists(app_config.TOKENS_DB):
-            os.remove(app_config.TOKENS_DB)
-        if os.path.exists(app_config.DIRECTIONS_DB):
-            os.remove(app_config.DIRECTIONS_DB)
-
-    if not os.path.exists(app_config.USERS_DB):
+        for filepath in database_collections():
+            backend.drop(filepath)
+        shutil.rmtree(app_config.ARCHIVE_PATH, ignore_errors=True)
+        collection_cache.invalidate()
+        change_bus.reset()
+
+    if not backend.exists(app_config.USERS_DB):
+        # Новая база данных сразу создается в текущей версии схемы
+        migrations.stamp()
         print("Создание файла пользователей...")
         users = [
             {
                 "id": "1",
                 "username": "admin",
-                "password": generate_password_hash("admin", method='pbkdf2:sha256', salt_length=8),
+                "password": hash_password("admin"),
                 "name": "Администратор системы",
                 "role": "admin",
                 "token": "ADMIN001",
                 "projects": []
             }
         ]
-        with open(app_config.USERS_DB, 'w', encoding='utf-8') as f:
-            json.dump(users, f, ensure_ascii=False, indent=2)
+        save_data(app_config.USERS_DB, users)
         print("Файл пользователей создан успешно")
     
-    if not os.path.exists(app_config.PROJECTS_DB):
+    if not backend.exists(app_config.PROJECTS_DB):
         print("Создание файла проектов...")
-        projects = []
-        with open(app_config.PROJECTS_DB, 'w', encoding='utf-8') as f:
-            json.dump(projects, f, ensure_ascii=False, indent=2)
+        save_data(app_config.PROJECTS_DB, [])
         print("Файл проектов создан успешно")
     
-    if not os.path.exists(app_config.TASKS_DB):
-        print("Создание файла задач...")
-        tasks = []
-        with open(app_config.TASKS_DB, 'w', encoding='utf-8') as f:
-            json.dump(tasks, f, ensure_ascii=False, indent=2)
-        print("Файл задач создан успешно")
+    task_store.ensure_sharded()
+    if not backend.exists(app_config.TASK_MANIFEST_DB):
+        print("Создание манифеста задач...")
+        task_store.replace_all([])
+        print("Манифест задач создан успешно")
     
-    if not os.path.exists(app_config.TOKENS_DB):
+    if not backend.exists(app_config.TOKENS_DB):
         print("Создание файла токенов...")
-        tokens = []
-        with open(app_config.TOKENS_DB, 'w', encoding='utf-8') as f:
-            json.dump(tokens, f, ensure_ascii=False, indent=2)
+        save_data(app_config.TOKENS_DB, [])
         print("Файл токенов создан успешно")
     
-    if not os.path.exists(app_config.DIRECTIONS_DB):
+    if not backend.exists(app_config.DIRECTIONS_DB):
         print("Создание файла направлений...")
         directions = [
             {"id": "1", "name": "Информационные технологии"},
@@ -71,77 +69,345 @@ def init_database(force_recreate=False):
             {"id": "4", "name": "Строительство"},
             {"id": "5", "name": "Образование"}
         ]
-        with open(app_config.DIRECTIONS_DB, 'w', encoding='utf-8') as f:
-            json.dump(directions, f, ensure_ascii=False, indent=2)
+        save_data(app_config.DIRECTIONS_DB, directions)
         print("Файл направлений создан успешно")
 
 
+def load_view(filepath):
+    """Загрузка данных только для чтения из кэша процесса (без копирования)"""
+    return collection_cache.get(filepath)
+
+
 def load_data(filepath):
-    """Загрузка данных из JSON с обработкой ошибок"""
-    try:
-        if not os.path.exists(filepath):
-            return []
-        
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-            # Проверка на пустой файл
-            if not content.strip():
-                return []
-            
-            return json.loads(content)
-    
-    except json.JSONDecodeError as e:
-        # Логирование ошибки
-        print(f"JSON decode error in {filepath}: {e}")
-        
-        # Создание резервной копии повреждённого файла
-        backup_path = f"{filepath}.backup.{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        os.rename(filepath, backup_path)
-        print(f"Corrupted file backed up to: {backup_path}")
-        
-        # Возврат пустого списка вместо падения
-        return []
-    
-    except Exception as e:
-        print(f"Error loading {filepath}: {e}")
-        return []
+    """Загрузка изменяемой копии данных (из кэша процесса)"""
+    return thaw(load_view(filepath))
+
+
+def load_index(filepath):
+    """Индексы коллекции (по id и внешним ключам) поверх кэша процесса"""
+    return collection_cache.index(filepath)
+
+
+def query_data(filepath, **filters):
+    """
+    Выборка изменяемых копий записей по условиям равенства
+
+    В SQLite фильтрация выполняется запросом, в JSON и внутри запроса Flask
+    (единица работы видит свои отложенные изменения) - через индексы кэша.
+    Для полей-списков (например, team) условие означает "содержит значение".
+    """
+    backend = collection_cache.backend
+    if hasattr(backend, 'query') and current_unit_of_work() is None:
+        return backend.query(filepath, **filters)
+
+    if not filters:
+        return load_data(filepath)
+    conditions = list(filters.items())
+    field, value = conditions[0]
+    result = []
+    for record in load_index(filepath).filter(field, value):
+        if all(_matches(record.get(f), v) for f, v in conditions[1:]):
+            result.append(thaw(record))
+    return result
+
+
+def scan_records(filepath, *fields):
+    """
+    Перебор записей коллекции с разбором только указанных полей
+
+    Для чтения нескольких полей из больших коллекций (отчеты, просроченные
+    сроки): актуальный снимок из кэша процесса используется как есть, иначе
+    поля читаются из SQLite через json_extract или из упакованного файла
+    (app.packed) без разбора и кэширования всей коллекции.
+
+    Returns:
+        Итератор словарей с запрошенными полями (отсутствующие поля пропускаются)
+    """
+    data = collection_cache.peek(filepath)
+    if data is None:
+        backend = collection_cache.backend
+        if hasattr(backend, 'scan'):
+            return migrations.upgrade_records(filepath, backend.scan(filepath, fields))
+        if app_config.PACKED_READS:
+            return migrations.upgrade_records(filepath, scan_packed(filepath, backend, fields))
+        data = iter_records(filepath) if backend.streamed(filepath) else load_view(filepath)
+    return ({f: record[f] for f in fields if f in record} for record in data)
+
+
+def iter_records(filepath):
+    """
+    Потоковый перебор записей коллекции (только для чтения)
+
+    Если актуальный снимок уже в кэше процесса, перебираются его записи;
+    иначе записи разбираются из файла по одной (JsonBackend.iter_read) или
+    читаются из SQLite страницами, а коллекция в кэш не загружается. Память
+    не зависит от размера коллекции - для отчетов и проверок. Записи старых
+    версий схемы обновляются при чтении (app.migrations).
+    """
+    data = collection_cache.peek(filepath)
+    if data is not None:
+        return iter(data)
+    return migrations.upgrade_records(filepath, collection_cache.backend.iter_read(filepath))
+
+
+def rewrite_records(filepath, transform):
+    """
+    Потоковое изменение всех записей коллекции
+
+    Args:
+        filepath: Путь к файлу коллекции
+        transform: Функция, изменяющая запись (dict) на месте и возвращающая
+            True, если запись изменена
+
+    Returns:
+        Число измененных записей (если 0, коллекция не переписывается)
+    """
+    return collection_cache.rewrite(filepath, transform)
+
+
+def scan_projects(*fields, archived=False):
+    """Список проектов с указанными полями; archived - вместе с архивными (app.archive)"""
+    projects = list(scan_records(app_config.PROJECTS_DB, *fields))
+    if archived:
+        projects.extend(archive.scan(archive.PROJECTS, *fields))
+    return projects
+
+
+def scan_tasks(*fields, archived=False):
+    """
+    Перебор всех задач реестра в порядке манифеста с разбором только указанных полей
+
+    archived - добавить в конец архивные задачи (app.archive)
+    """
+    entries = task_store.manifest()
+    positions = {entry['id']: i for i, entry in enumerate(entries)}
+    names = fields if 'id' in fields else fields + ('id',)
+    tasks = [task for path in task_store.shard_paths(entries) for task in scan_records(path, *names)
+             if task.get('id') in positions]
+    tasks.sort(key=lambda task: positions[task['id']])
+    if names is not fields:
+        for task in tasks:
+            del task['id']
+    if archived:
+        tasks.extend(archive.scan(archive.TASKS, *fields))
+    return tasks
+
+
+def _matches(field_value, value):
+    if isinstance(field_value, list):
+        return value in field_value
+    return field_value == value
+
+
+def load_record(filepath, record_id):
+    """Загрузка изменяемой копии одной записи по id (None, если не найдена)"""
+    record = load_index(filepath).get(record_id)
+    return thaw(record) if record is not None else None
+
+
+def find_project(project_id, archived=False):
+    """Найти проект по id (только для чтения); archived - искать и в архиве"""
+    project = load_index(app_config.PROJECTS_DB).get(project_id)
+    if project is None and archived:
+        project = archive.find_project(project_id)
+    return project
+
+
+def find_task(task_id, archived=False):
+    """
+    Найти задачу по id (только для чтения): читается только шард ее проекта
+
+    archived - искать и в архиве (архивная задача содержит дочерние списки)
+    """
+    task = task_store.find_task(task_id)
+    if task is None and archived:
+        task = archive.find_task(task_id)
+    return task
+
+
+def load_archived_projects(member=None):
+    """
+    Архивные проекты только для чтения (app.archive)
+
+    member - (поле, id пользователя): только проекты, где пользователь указан
+    в поле supervisor_id или manager_id либо входит в команду (team); они
+    выбираются по каталогу архива без чтения остальных файлов
+    """
+    if member is not None:
+        return archive.member_projects(*member)
+    return list(archive.records(archive.PROJECTS))
+
+
+def load_tasks():
+    """Все задачи реестра только для чтения (для сводных отчетов и панели)"""
+    return task_store.all_tasks()
+
+
+def load_tasks_index():
+    """Индексы по всем задачам реестра"""
+    return task_store.all_tasks_index()
+
+
+def load_project_tasks(project_id, archived=False):
+    """
+    Задачи одного проекта только для чтения (читается только шард проекта)
+
+    archived - вместе с архивными задачами проекта
+    """
+    tasks = task_store.project_tasks(project_id)
+    if archived:
+        archived_tasks = archive.project_tasks(project_id)
+        if archived_tasks:
+            return list(tasks) + archived_tasks
+    return tasks
+
+
+def save_task(task):
+    """Сохранение задачи (добавление или замена по id) в шард ее проекта"""
+    task_store.save_task(task)
+
+
+def load_task_items(task_id, field):
+    """Элементы дочернего списка задачи (history, reports, files, subtasks) только для чтения"""
+    return task_store.task_children(task_id, field)
+
+
+def find_task_item(task_id, field, item_id):
+    """Найти элемент дочернего списка задачи по id (только для чтения)"""
+    return task_store.find_child(task_id, field, item_id)
+
+
+def add_task_items(task_id, field, items):
+    """Дописать элементы в дочерний список задачи (False, если задача не найдена)"""
+    return task_store.add_children(task_id, field, items)
+
+
+def modify_task_item(task_id, field, item_id, mutate):
+    """
+    Изменение элемента дочернего списка задачи по схеме чтение-изменение-запись
+
+    Returns:
+        Сохраненный элемент или None, если он не найден или изменение отменено
+    """
+    filepath = task_store.child_collection(task_id, field)
+    if filepath is None:
+        return None
+    record = update_record(filepath, task_store.child_record_id(task_id, item_id), lambda r: mutate(r['data']))
+    return record['data'] if record else None
+
+
+def remove_task_item(task_id, field, item_id):
+    """Удаление элемента дочернего списка задачи"""
+    task_store.delete_child(task_id, field, item_id)
+
+
+def modify_task(task_id, mutate):
+    """
+    Изменение задачи по схеме чтение-изменение-запись (см. update_record)
+
+    Returns:
+        Сохраненная задача или None, если задача не найдена или изменение отменено
+    """
+    filepath = task_store.task_shard(task_id)
+    if filepath is None:
+        return None
+    return update_record(filepath, task_id, mutate)
+
+
+def find_user(user_id):
+    """Найти пользователя по id (только для чтения)"""
+    return load_index(app_config.USERS_DB).get(user_id)
+
+
+def find_user_by_username(username):
+    """Найти пользователя по логину (только для чтения)"""
+    users = load_index(app_config.USERS_DB).filter('username', username)
+    return users[0] if users else None
 
 
 def save_data(filepath, data):
-    """Сохранение данных в JSON с атомарной записью"""
-    temp_path = None
-    try:
-        # Убедимся, что директория существует
-        directory = os.path.dirname(filepath)
-        if directory:
-            os.makedirs(directory, exist_ok=True)
-        
-        # Запись во временный файл
-        temp_path = f"{filepath}.tmp.{os.getpid()}"
-        
-        with open(temp_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-        
-        # Проверка существования временного файла перед заменой
-        if not os.path.exists(temp_path):
-            raise FileNotFoundError(f"Временный файл не создан: {temp_path}")
-        
-        # Атомарная замена
-        os.replace(temp_path, filepath)
-        return True
-        
-    except Exception as e:
-        print(f"Error saving {filepath}: {e}")
-        # Удаление временного файла если остался
-        if temp_path and os.path.exists(temp_path):
+    """Сохранение данных через активный бэкенд (JSON с атомарной записью или SQLite)"""
+    collection_cache.save(filepath, data)
+    return True
+
+
+def save_record(filepath, record):
+    """Сохранение одной записи (добавление или замена по id) без перезаписи всей коллекции"""
+    unit_of_work = deferred_unit_of_work(filepath)
+    if unit_of_work is not None:
+        unit_of_work.put(filepath, record)
+        return
+    collection_cache.save_records(filepath, upserts=[record])
+
+
+def update_record(filepath, record_id, mutate):
+    """
+    Изменение одной записи по схеме чтение-изменение-запись
+
+    Функция mutate получает изменяемую копию записи и правит ее на месте
+    (может вернуть False, чтобы отказаться от сохранения). Запись сохраняется,
+    только если она не изменилась с момента чтения; иначе чтение и mutate
+    повторяются. Последняя из Config.CONFLICT_RETRIES попыток выполняется
+    целиком под блокировкой коллекции, поэтому изменение не теряется.
+
+    В запросе изменение откладывается до его завершения (app.unit_of_work).
+
+    Returns:
+        Сохраненная запись или None, если запись не найдена или изменение отменено
+    """
+    unit_of_work = deferred_unit_of_work(filepath)
+    if unit_of_work is not None:
+        return unit_of_work.update(filepath, record_id, mutate)
+
+    for attempt in range(app_config.CONFLICT_RETRIES):
+        last = attempt + 1 == app_config.CONFLICT_RETRIES
+        with collection_lock(filepath) if last else nullcontext():
+            original = load_index(filepath).get(record_id)
+            if original is None:
+                return None
+            record = thaw(original)
+            if mutate(record) is False:
+                return None
             try:
-                os.remove(temp_path)
-            except:
-                pass
-        raise
+                collection_cache.save_records(filepath, upserts=[record], expected={record_id: original})
+                return record
+            except ConflictError:
+                if last:
+                    raise
+        # Случайная пауза, чтобы конкурирующие запросы не повторяли попытки синхронно
+        time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+
+
+def delete_record(filepath, record_id):
+    """Удаление одной записи по id без перезаписи всей коллекции"""
+    unit_of_work = deferred_unit_of_work(filepath)
+    if unit_of_work is not None:
+        unit_of_work.delete(filepath, record_id)
+        return
+    collection_cache.save_records(filepath, deletes=[record_id])
+
+
+def database_collections(backend=None):
+    """
+    Все коллекции базы данных: постоянные, шарды задач по манифесту
+    и прежний единый файл задач, если он еще не перенесен в шарды
+    """
+    backend = backend or collection_cache.backend
+    collections = list(app_config.COLLECTIONS)
+    if backend.exists(app_config.TASK_MANIFEST_DB):
+        collections += task_store.collection_paths(backend.read(app_config.TASK_MANIFEST_DB))
+    if backend.exists(app_config.TASKS_DB):
+        collections.append(app_config.TASKS_DB)
+    return collections
+
+
+def compact_database():
+    """Уплотнение журналов изменений всех коллекций"""
+    backend = collection_cache.backend
+    for filepath in database_collections():
+        with collection_lock(filepath):
+            backend.compact(filepath)
+    collection_cache.invalidate()
 
 
 def load_directions():
@@ -159,8 +425,7 @@ def can_access_task(task_id):
     if current_user.role == 'admin':
         return True
     
-    tasks = load_data(app_config.TASKS_DB)
-    task = next((t for t in tasks if t.get('id') == task_id), None)
+    task = find_task(task_id, archived=True)
     
     if not task:
         return False
@@ -178,8 +443,7 @@ def can_access_project(project_id):
     if current_user.role == 'admin':
         return True
     
-    projects = load_data(app_config.PROJECTS_DB)
-    project = next((p for p in projects if p.get('id') == project_id), None)
+    project = find_project(project_id, archived=True)
     
     if not project:
         return False
@@ -206,82 +470,52 @@ def get_available_roles():
 
 
 def load_tokens():
-    if not os.path.exists(app_config.TOKENS_DB):
-        return []
-    with open(app_config.TOKENS_DB, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return load_data(app_config.TOKENS_DB)
 
 
 def save_tokens(tokens):
-    with open(app_config.TOKENS_DB, 'w', encoding='utf-8') as f:
-        json.dump(tokens, f, ensure_ascii=False, indent=2)
+    save_data(app_config.TOKENS_DB, tokens)
 
 
 def generate_token(role, project_id=None):
-    token = {
-        'id': str(uuid.uuid4()),
-        'role': role,
-        'project_id': project_id,
-        'created_at': datetime.now().strftime("%d.%m.%Y %H:%M:%S"),
-        'used': False
-    }
-    tokens = load_tokens()
-    tokens.append(token)
-    save_tokens(tokens)
-    return token['id']
+    return token_store.issue(role=role, project_id=project_id)
 
 
 def validate_token(token_id):
-    tokens = load_tokens()
-    token = next((t for t in tokens if t['id'] == token_id), None)
-    if token and not token['used']:
-        return token
-    return None
+    return token_store.validate(token_id)
 
 
 def mark_token_as_used(token_id):
-    tokens = load_tokens()
-    for token in tokens:
-        if token['id'] == token_id:
-            token['used'] = True
-            break
-    save_tokens(tokens)
+    token_store.consume(token_id)
 
 
 def get_user_token(user_id, project_id=None):
-    tokens = load_tokens()
-    existing_token = next((t for t in tokens if t.get('user_id') == user_id and t.get('project_id') == project_id and not t['used']), None)
-    
-    if existing_token:
-        return existing_token['id']
-    
-    token = {
-        'id': str(uuid.uuid4()),
-        'user_id': user_id,
-        'project_id': project_id,
-        'created_at': datetime.now().strftime("%d.%m.%Y %H:%M:%S"),
-        'used': False
-    }
-    tokens.append(token)
-    save_tokens(tokens)
-    return token['id']
-
-
-def add_task_history(task, action, user_id, users):
-    user = next((u for u in users if u['id'] == user_id), None)
-    user_name = user.get('name', user.get('username', 'Неизвестный')) if user else 'Неизвестный'
-    
-    if 'history' not in task:
-        task['history'] = []
-    
-    history_entry = {
-        'action': action,
-        'date': datetime.now().strftime("%d.%m.%Y %H:%M:%S"),
-        'user_id': user_id,
-        'user_name': user_name
-    }
-    
-    task['history'].append(history_entry)
+    """Персональный токен пользователя в проекте (вычисляется, без чтения и записи tokens.json)"""
+    return display_token(user_id, project_id)
+
+
+def add_task_history(task_id, actions, user_id):
+    """Добавить в историю задачи одно действие или список действий (одним пакетом)"""
+    if isinstance(actions, str):
+        actions = [actions]
+    if not actions:
+        return
+
+    user = user_directory.get(user_id)
+    user_name = user.display_name if user else 'Неизвестный'
+    date = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
+
+    history_entries = [
+        {
+            'action': action,
+            'date': date,
+            'user_id': user_id,
+            'user_name': user_name
+        }
+        for action in actions
+    ]
+
+    add_task_items(task_id, 'history', history_entries)
 
 
 def allowed_file(filename):
@@ -12,3 +12,89 @@ class Config:
     TASKS_DB = os.path.join(DATABASE_PATH, 'tasks.json')
     TOKENS_DB = os.path.join(DATABASE_PATH, 'tokens.json')
     DIRECTIONS_DB = os.path.join(DATABASE_PATH, 'directions.json')
+
+    # Версии схемы коллекций (см. app/migrations.py) и размер пакета записей,
+    # сохраняемых за один раз при миграции без остановки приложения
+    SCHEMA_DB = os.path.join(DATABASE_PATH, 'schema.json')
+    MIGRATION_BATCH = int(os.environ.get('MIGRATION_BATCH', 500))
+
+    # Задачи хранятся по проектам (см. app/task_store.py); TASKS_DB - прежний единый файл
+    TASK_SHARDS_PATH = os.path.join(DATABASE_PATH, 'tasks')
+    TASK_MANIFEST_DB = os.path.join(DATABASE_PATH, 'task_manifest.json')
+
+    # Постоянные коллекции базы данных (шарды задач перечисляются по манифесту)
+    COLLECTIONS = [USERS_DB, PROJECTS_DB, TASK_MANIFEST_DB, TOKENS_DB, DIRECTIONS_DB, SCHEMA_DB]
+
+    # Бэкенд хранения: 'json' (файлы выше) или 'sqlite' (WAL, см. app/sqlite_storage.py)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+    SQLITE_DB = os.environ.get('SQLITE_DB') or os.path.join(DATABASE_PATH, 'registry.sqlite3')
+
+    # Размер журнала изменений коллекции, после которого снимок переписывается целиком
+    JOURNAL_MAX_BYTES = int(os.environ.get('JOURNAL_MAX_BYTES', 4 * 1024 * 1024))
+
+    # Объединение записей отдельных записей в пакеты (group commit) и окно сбора пакета
+    GROUP_COMMIT = os.environ.get('GROUP_COMMIT', '1').lower() in ('1', 'true', 'yes')
+    GROUP_COMMIT_WINDOW_MS = float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 20))
+
+    # Файлы транзакций нескольких коллекций и их число, после которого журналы
+    # сбрасываются на диск, а файлы удаляются (контрольная точка)
+    TRANSACTIONS_PATH = os.path.join(DATABASE_PATH, 'transactions')
+    TRANSACTION_CHECKPOINT = int(os.environ.get('TRANSACTION_CHECKPOINT', 32))
+
+    # Поврежденные снимки коллекций и записи, убранные проверкой целостности (app/integrity.py);
+    # интервал фоновой проверки, секунды (0 - отключена), число коллекций за один проход
+    # и исправление записей (перенос в карантин, удаление висячих ссылок) без команды
+    QUARANTINE_PATH = os.path.join(DATABASE_PATH, 'quarantine')
+    INTEGRITY_CHECK_INTERVAL = float(os.environ.get('INTEGRITY_CHECK_INTERVAL', 60))
+    INTEGRITY_CHECK_BATCH = int(os.environ.get('INTEGRITY_CHECK_BATCH', 8))
+    INTEGRITY_REPAIR = os.environ.get('INTEGRITY_REPAIR', '').lower() in ('1', 'true', 'yes')
+
+    # Загруженные файлы и снимки резервных копий (см. app/backup.py); BACKUP_KEEP -
+    # сколько последних снимков хранить (0 - все)
+    UPLOAD_PATH = os.path.join(BASE_DIR, 'uploads')
+    BACKUP_PATH = os.environ.get('BACKUP_PATH') or os.path.join(BASE_DIR, 'backups')
+    BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 14))
+
+    # Файловый журнал событий изменений коллекций (см. app/changes.py): каталог сегментов,
+    # размер сегмента и число хранимых сегментов
+    CHANGE_FEED = os.environ.get('CHANGE_FEED', '').lower() in ('1', 'true', 'yes')
+    CHANGE_FEED_PATH = os.path.join(DATABASE_PATH, 'changes')
+    CHANGE_FEED_SEGMENT_BYTES = int(os.environ.get('CHANGE_FEED_SEGMENT_BYTES', 8 * 1024 * 1024))
+    CHANGE_FEED_SEGMENTS = int(os.environ.get('CHANGE_FEED_SEGMENTS', 4))
+
+    # Архив завершенных проектов и задач (см. app/archive.py): сжатые файлы по годам и
+    # возраст записи в днях (с даты окончания проекта или завершения задачи) для переноса
+    ARCHIVE_PATH = os.path.join(DATABASE_PATH, 'archive')
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+
+    # Срок действия новых токенов приглашений в днях (0 - бессрочно; записывается в токен
+    # при выдаче, ранее выданные токены не истекают) и интервал фоновой очистки
+    # использованных и просроченных токенов, секунды (0 - отключена), см. app/tokens.py
+    TOKEN_TTL_DAYS = float(os.environ.get('TOKEN_TTL_DAYS', 30))
+    TOKEN_SWEEP_INTERVAL = float(os.environ.get('TOKEN_SWEEP_INTERVAL', 3600))
+
+    # Политика хэширования паролей (метод werkzeug.security и длина соли; старые хэши
+    # пересчитываются при входе) и пул проверки паролей при входе: число потоков,
+    # одновременных проверок всего в очереди и с одного адреса клиента (0 - без
+    # ограничения; см. app/passwords.py). Адрес клиента - request.remote_addr: за
+    # обратным прокси это адрес прокси, поэтому лимит на клиента включается вместе с
+    # PROXY_FIX_X_FOR - числом прокси, чей X-Forwarded-For принимается (werkzeug ProxyFix)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+    PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 2))
+    PASSWORD_QUEUE = int(os.environ.get('PASSWORD_QUEUE', 64))
+    PASSWORD_PER_CLIENT = int(os.environ.get('PASSWORD_PER_CLIENT', 0))
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+
+    # Число попыток чтения-изменения-записи при конфликте параллельных запросов
+    CONFLICT_RETRIES = int(os.environ.get('CONFLICT_RETRIES', 5))
+
+    # Компактная запись JSON-файлов коллекций (без отступов): меньше размер и время записи
+    JSON_COMPACT_STORAGE = os.environ.get('JSON_COMPACT_STORAGE', '').lower() in ('1', 'true', 'yes')
+
+    # Чтение отдельных полей больших коллекций через упакованные файлы *.packed (mmap)
+    PACKED_READS = os.environ.get('PACKED_READS', '1').lower() in ('1', 'true', 'yes')
+
+    # Размер снимка коллекции, начиная с которого перебор, уплотнение и построение
+    # упакованного файла разбирают записи потоком, не загружая коллекцию целиком
+    STREAMING_READ_BYTES = int(os.environ.get('STREAMING_READ_BYTES', 16 * 1024 * 1024))
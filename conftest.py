@@ -0,0 +1,54 @@
+"""
+Общие фикстуры тестов
+"""
+
+import pytest
+
+from config import Config
+from app.storage import JsonBackend, collection_cache
+
+
+_COLLECTIONS = {
+    'USERS_DB': 'users.json',
+    'PROJECTS_DB': 'projects.json',
+    'TASKS_DB': 'tasks.json',
+    'TOKENS_DB': 'tokens.json',
+    'DIRECTIONS_DB': 'directions.json',
+    'SCHEMA_DB': 'schema.json',
+    'TASK_MANIFEST_DB': 'task_manifest.json'
+}
+
+_DIRECTORIES = {
+    'TASK_SHARDS_PATH': 'tasks',
+    'TRANSACTIONS_PATH': 'transactions',
+    'QUARANTINE_PATH': 'quarantine',
+    'CHANGE_FEED_PATH': 'changes',
+    'ARCHIVE_PATH': 'archive'
+}
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Пустая база данных JSON во временном каталоге
+
+    Пути коллекций и каталогов Config указывают в tmp_path/database, загруженные
+    файлы и снимки - в tmp_path/uploads и tmp_path/backups; общий кэш коллекций
+    (app.storage.collection_cache) на время теста получает свой бэкенд.
+    """
+    root = tmp_path / 'database'
+    root.mkdir()
+    monkeypatch.setattr(Config, 'STORAGE_BACKEND', 'json')
+    monkeypatch.setattr(Config, 'DATABASE_PATH', str(root))
+    for name, filename in _COLLECTIONS.items():
+        monkeypatch.setattr(Config, name, str(root / filename))
+    for name, dirname in _DIRECTORIES.items():
+        monkeypatch.setattr(Config, name, str(root / dirname))
+    monkeypatch.setattr(Config, 'COLLECTIONS', [Config.USERS_DB, Config.PROJECTS_DB, Config.TASK_MANIFEST_DB,
+                                                Config.TOKENS_DB, Config.DIRECTIONS_DB, Config.SCHEMA_DB])
+    monkeypatch.setattr(Config, 'UPLOAD_PATH', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(Config, 'BACKUP_PATH', str(tmp_path / 'backups'))
+
+    monkeypatch.setattr(collection_cache, '_backend', JsonBackend(Config.TRANSACTIONS_PATH))
+    monkeypatch.setattr(collection_cache, '_entries', {})
+    return root
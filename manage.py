@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Служебные команды обслуживания базы данных
+
+Примеры:
+    python manage.py init-db
+    python manage.py compact
+    python manage.py import-sqlite
+    python manage.py export-sqlite
+    python manage.py check --repair
+    python manage.py backup
+    python manage.py backups
+    python manage.py restore 20250101-030000
+    python manage.py changes --since 0
+    python manage.py archive --days 365
+    python manage.py migrate --status
+    python manage.py sweep-tokens
+    python manage.py provision cohort.csv --dry-run
+"""
+
+import argparse
+import os
+import sys
+
+from config import Config
+
+
+def cmd_init_db(args):
+    from app.utils import init_database
+    init_database(force_recreate=args.force)
+
+
+def cmd_compact(args):
+    from app.utils import compact_database
+    compact_database()
+    print("Журналы изменений уплотнены")
+
+
+def cmd_import_sqlite(args):
+    from app.sqlite_storage import SqliteBackend, import_json
+    from app.storage import JsonBackend
+    from app.utils import database_collections
+    backend = SqliteBackend(args.db or Config.SQLITE_DB)
+    for name, count in import_json(backend, database_collections(JsonBackend())).items():
+        print(f"Импортировано {name}: {count} записей")
+    print(f"База SQLite: {backend.db_path}")
+
+
+def cmd_export_sqlite(args):
+    from app.sqlite_storage import SqliteBackend, export_json
+    from app.utils import database_collections
+    backend = SqliteBackend(args.db or Config.SQLITE_DB)
+    for name, count in export_json(backend, database_collections(backend)).items():
+        print(f"Экспортировано {name}: {count} записей")
+
+
+def cmd_check(args):
+    from app.integrity import check_database, repair
+    issues = check_database()
+    for issue in issues:
+        print(repr(issue))
+    print(f"Нарушений: {len(issues)}")
+    if args.repair and issues:
+        done = repair(issues)
+        print(f"Восстановлено коллекций: {done['restore']}, исправлено записей: {done['repair']}, "
+              f"перенесено в карантин: {done['quarantine']}")
+
+
+def cmd_backup(args):
+    from app.backup import create_backup
+    result = create_backup(keep=args.keep)
+    print(f"Снимок {result.name}: скопировано {result.copied} файлов ({result.copied_bytes} байт), "
+          f"без копирования {result.linked}")
+
+
+def cmd_backups(args):
+    from app.backup import list_backups, read_manifest
+    for name in list_backups():
+        manifest = read_manifest(name)
+        print(f"{name}  {manifest['created']}  {manifest['backend']}  файлов: {len(manifest['files'])}")
+
+
+def cmd_restore(args):
+    from app.backup import restore_backup
+    restored = restore_backup(args.name, database=not args.no_database, uploads=not args.no_uploads)
+    print(f"Восстановлено из {args.name}: файлов базы данных {restored['database']}, "
+          f"загруженных файлов {restored['uploads']}")
+
+
+def cmd_changes(args):
+    from app.changes import ChangeFeed
+    feed = ChangeFeed(Config.CHANGE_FEED_PATH, Config.CHANGE_FEED_SEGMENT_BYTES, Config.CHANGE_FEED_SEGMENTS)
+    events, position, gap = feed.read(args.since, limit=args.limit)
+    if gap:
+        print("События до начала журнала удалены: производные данные нужно перестроить")
+    for event in events:
+        print(f"{event.position}  {event!r}")
+    print(f"Следующая позиция: {position}")
+
+
+def cmd_archive(args):
+    from app.archive import archive_completed
+    result = archive_completed(days=args.days)
+    print(f"Перенесено в архив: проектов {result.projects}, задач {result.tasks}")
+
+
+def cmd_migrate(args):
+    from app.migrations import latest_version, migrate_database, schema_status
+    if args.status:
+        for key, version, migrations in schema_status():
+            print(f"{key}: версия {version}, ожидают {', '.join(str(m.number) for m in migrations)}")
+        print(f"Версия схемы: {latest_version()}")
+        return
+    for key, changed in migrate_database(batch_size=args.batch).items():
+        print(f"{key}: обновлено записей {changed}")
+    print(f"Все коллекции в версии {latest_version()}")
+
+
+def cmd_sweep_tokens(args):
+    from app.tokens import token_store
+    print(f"Удалено использованных, просроченных и прежних персональных токенов: {token_store.sweep()}")
+
+
+def cmd_provision(args):
+    from app.provisioning import parse_batch, provision
+    fmt = args.format or ('csv' if args.file.lower().endswith('.csv') else 'json')
+    with open(args.file, encoding='utf-8-sig') as f:
+        rows = parse_batch(f.read(), fmt)
+    result = provision(rows, workers=args.workers or os.cpu_count(), dry_run=args.dry_run)
+    for error in result.errors:
+        print(error, file=sys.stderr)
+    if result.errors:
+        return 1
+    if args.dry_run:
+        print(f"Пакет корректен: строк {len(rows)}")
+        return 0
+    for user in result.users:
+        password = f" пароль {user['password']}" if 'password' in user else ''
+        print(f"{user['username']}: id {user['id']}, роль {user['role']}{password}")
+    for invitation in result.invitations:
+        project = f", проект {invitation['project_id']}" if invitation['project_id'] else ''
+        print(f"Приглашение {invitation['token']}: роль {invitation['role']}{project}")
+    print(f"Создано пользователей {len(result.users)}, приглашений {len(result.invitations)}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Обслуживание базы данных реестра проектов')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    init_db = commands.add_parser('init-db', help='Создать недостающие коллекции')
+    init_db.add_argument('--force', action='store_true', help='Пересоздать базу данных с нуля')
+    init_db.set_defaults(func=cmd_init_db)
+
+    compact = commands.add_parser('compact', help='Переписать снимки коллекций и очистить журналы изменений')
+    compact.set_defaults(func=cmd_compact)
+
+    import_sqlite = commands.add_parser('import-sqlite', help='Импортировать JSON-файлы в SQLite')
+    import_sqlite.add_argument('--db', help='Путь к файлу SQLite (по умолчанию Config.SQLITE_DB)')
+    import_sqlite.set_defaults(func=cmd_import_sqlite)
+
+    export_sqlite = commands.add_parser('export-sqlite', help='Экспортировать SQLite обратно в JSON-файлы')
+    export_sqlite.add_argument('--db', help='Путь к файлу SQLite (по умолчанию Config.SQLITE_DB)')
+    export_sqlite.set_defaults(func=cmd_export_sqlite)
+
+    check = commands.add_parser('check', help='Проверить целостность базы данных')
+    check.add_argument('--repair', action='store_true',
+                       help='Исправить нарушения (восстановить коллекции, убрать записи в карантин)')
+    check.set_defaults(func=cmd_check)
+
+    backup = commands.add_parser('backup', help='Создать снимок базы данных и загруженных файлов')
+    backup.add_argument('--keep', type=int, help='Сколько последних снимков оставить (по умолчанию Config.BACKUP_KEEP)')
+    backup.set_defaults(func=cmd_backup)
+
+    backups = commands.add_parser('backups', help='Список снимков')
+    backups.set_defaults(func=cmd_backups)
+
+    restore = commands.add_parser('restore', help='Восстановить базу данных и загруженные файлы из снимка '
+                                                  '(рекомендуется при остановленном приложении)')
+    restore.add_argument('name', help='Имя снимка (см. backups)')
+    restore.add_argument('--no-database', action='store_true', help='Не восстанавливать базу данных')
+    restore.add_argument('--no-uploads', action='store_true', help='Не восстанавливать загруженные файлы')
+    restore.set_defaults(func=cmd_restore)
+
+    changes = commands.add_parser('changes', help='Показать события изменений из файлового журнала (CHANGE_FEED)')
+    changes.add_argument('--since', type=int, default=0, help='Позиция, с которой читать')
+    changes.add_argument('--limit', type=int, default=1000, help='Максимальное число событий')
+    changes.set_defaults(func=cmd_changes)
+
+    archive = commands.add_parser('archive', help='Перенести завершенные проекты и задачи в архив')
+    archive.add_argument('--days', type=int,
+                         help='Сколько дней должно пройти с завершения (по умолчанию Config.ARCHIVE_AFTER_DAYS)')
+    archive.set_defaults(func=cmd_archive)
+
+    migrate = commands.add_parser('migrate', help='Применить миграции схемы (приложение может работать)')
+    migrate.add_argument('--status', action='store_true', help='Показать коллекции с недостающими миграциями')
+    migrate.add_argument('--batch', type=int, help='Размер пакета записей (по умолчанию Config.MIGRATION_BATCH)')
+    migrate.set_defaults(func=cmd_migrate)
+
+    sweep_tokens = commands.add_parser('sweep-tokens', help='Удалить использованные и просроченные токены приглашений')
+    sweep_tokens.set_defaults(func=cmd_sweep_tokens)
+
+    provision = commands.add_parser('provision', help='Создать пользователей и приглашения из файла CSV/JSON')
+    provision.add_argument('file', help='Файл пакета (username, name, role, password, projects)')
+    provision.add_argument('--format', choices=['csv', 'json'], help='Формат (по умолчанию - по расширению файла)')
+    provision.add_argument('--workers', type=int, help='Потоков хэширования паролей (по умолчанию - число процессоров)')
+    provision.add_argument('--dry-run', action='store_true', help='Только проверить пакет')
+    provision.set_defaults(func=cmd_provision)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
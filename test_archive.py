@@ -0,0 +1,116 @@
+"""
+Тесты архива завершенных проектов и задач (app/archive.py)
+"""
+
+from datetime import date
+
+import pytest
+
+from config import Config
+from app import archive, serializer, task_store
+from app.storage import CollectionCache, JsonBackend, collection_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ARCHIVE_PATH', str(tmp_path / 'archive'))
+    monkeypatch.setattr(Config, 'PROJECTS_DB', str(tmp_path / 'projects.json'))
+    cache = CollectionCache(JsonBackend(str(tmp_path / 'transactions')))
+    monkeypatch.setattr(archive, 'collection_cache', cache)
+    return cache
+
+
+def test_member_projects_read_only_matching_years(cache, monkeypatch):
+    archive._write_year(archive.PROJECTS, 2023, [
+        {'id': 'p1', 'supervisor_id': 's1', 'manager_id': 'm1', 'team': ['w1']}])
+    archive._write_year(archive.PROJECTS, 2024, [
+        {'id': 'p2', 'supervisor_id': 's2', 'manager_id': 'm1', 'team': ['w1', 'w2']},
+        {'id': 'p3', 'supervisor_id': 's2', 'manager_id': 'm2', 'team': []}])
+    catalog = {archive.PROJECTS: {
+        'p1': {'year': 2023, 'supervisor_id': 's1', 'manager_id': 'm1', 'team': ['w1']},
+        'p2': {'year': 2024, 'supervisor_id': 's2', 'manager_id': 'm1', 'team': ['w1', 'w2']},
+        'p3': {'year': 2024, 'supervisor_id': 's2', 'manager_id': 'm2', 'team': []}}}
+    archive._write_atomic(archive.catalog_path(), lambda f: f.write(serializer.dumps(catalog)))
+
+    read = []
+    year_records = archive._year_records
+    monkeypatch.setattr(archive, '_year_records', lambda kind, year: read.append(year) or year_records(kind, year))
+
+    assert [p['id'] for p in archive.member_projects('team', 'w2')] == ['p2']
+    assert read == [2024]
+    assert [p['id'] for p in archive.member_projects('manager_id', 'm1')] == ['p1', 'p2']
+    assert [p['id'] for p in archive.member_projects('supervisor_id', 's2')] == ['p2', 'p3']
+    assert archive.member_projects('team', 'nobody') == []
+
+    # Проект, вернувшийся в рабочую коллекцию, из архива не показывается
+    cache.save_records(Config.PROJECTS_DB, upserts=[{'id': 'p2', 'status': 'активен'}])
+    assert archive.member_projects('team', 'w2') == []
+
+
+def test_member_projects_with_legacy_catalog(cache):
+    archive._write_year(archive.PROJECTS, 2023, [
+        {'id': 'p1', 'manager_id': 'm1', 'team': ['w1']},
+        {'id': 'p2', 'manager_id': 'm2', 'team': ['w1']}])
+    # Каталог прежней версии хранит только год
+    catalog = {archive.PROJECTS: {'p1': 2023, 'p2': 2023}}
+    archive._write_atomic(archive.catalog_path(), lambda f: f.write(serializer.dumps(catalog)))
+
+    assert [p['id'] for p in archive.member_projects('manager_id', 'm2')] == ['p2']
+    assert [p['id'] for p in archive.member_projects('team', 'w1')] == ['p1', 'p2']
+    assert archive.find_project('p1')['manager_id'] == 'm1'
+
+
+def _seed_projects():
+    collection_cache.save(Config.PROJECTS_DB, [
+        {'id': 'p1', 'name': 'Север', 'status': 'завершен', 'end_date': '15.01.2024',
+         'supervisor_id': 's1', 'manager_id': 'm1', 'team': ['w1', 'w2']},
+        {'id': 'p2', 'name': 'Юг', 'status': 'активен', 'manager_id': 'm2', 'team': ['w1']}])
+    for task in ({'id': 't1', 'project_id': 'p1', 'title': 'Отчет', 'status': 'завершена',
+                  'completion_date': '20.12.2023'},
+                 {'id': 't2', 'project_id': 'p1', 'title': 'Смета', 'status': 'завершена',
+                  'completion_date': '10.01.2024'},
+                 {'id': 't3', 'project_id': 'p2', 'title': 'Старая', 'status': 'завершена',
+                  'completion_date': '01.03.2023'},
+                 {'id': 't4', 'project_id': 'p2', 'title': 'В работе', 'status': 'в работе'}):
+        task_store.save_task(task)
+    task_store.add_children('t1', 'history', [{'action': 'создана'}, {'action': 'завершена'}])
+    task_store.add_children('t1', 'subtasks', [{'id': 's1', 'title': 'Черновик'}])
+    task_store.add_children('t3', 'reports', [{'id': 'r1', 'text': 'Итог'}])
+
+
+def test_archive_round_trip(database):
+    _seed_projects()
+    result = archive.archive_completed(days=30, today=date(2024, 6, 1))
+    assert (result.projects, result.tasks) == (1, 3)
+
+    # В рабочих коллекциях остались только проект в работе и его незавершенная задача
+    assert [p['id'] for p in collection_cache.get(Config.PROJECTS_DB)] == ['p2']
+    assert [t['id'] for t in task_store.manifest()] == ['t4']
+    assert not collection_cache.backend.exists(task_store.shard_path('p1'))
+    assert task_store.task_children('t3', 'reports') == ()
+    assert archive.archive_years(archive.TASKS) == [2023, 2024]
+    assert archive.archive_years(archive.PROJECTS) == [2024]
+
+    # Архивные записи читаются такими же, какими были в рабочих коллекциях
+    project = archive.find_project('p1')
+    assert (project['name'], list(project['team']), project['end_date']) == ('Север', ['w1', 'w2'], '15.01.2024')
+    task = archive.find_task('t1')
+    assert task['title'] == 'Отчет'
+    assert [h['action'] for h in task['history']] == ['создана', 'завершена']
+    assert task['subtasks'] == [{'id': 's1', 'title': 'Черновик'}]
+    assert archive.find_task('t3')['reports'] == [{'id': 'r1', 'text': 'Итог'}]
+    assert archive.find_task('t4') is None
+    assert sorted(t['id'] for t in archive.project_tasks('p1')) == ['t1', 't2']
+    assert [t['id'] for t in archive.project_tasks('p2')] == ['t3']
+
+    # Каталог хранит год файла и руководителей с командой проекта
+    with open(archive.catalog_path(), 'rb') as f:
+        catalog = serializer.loads(f.read())
+    assert catalog[archive.PROJECTS] == {
+        'p1': {'year': 2024, 'supervisor_id': 's1', 'manager_id': 'm1', 'team': ['w1', 'w2']}}
+    assert [p['id'] for p in archive.member_projects('team', 'w2')] == ['p1']
+
+    # Повторный перенос ничего не меняет
+    result = archive.archive_completed(days=30, today=date(2024, 6, 1))
+    assert (result.projects, result.tasks) == (0, 0)
+    assert sorted(t['id'] for t in archive.records(archive.TASKS)) == ['t1', 't2', 't3']
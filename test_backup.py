@@ -0,0 +1,71 @@
+"""
+Тесты снимков базы данных и их восстановления (app/backup.py)
+"""
+
+import os
+
+from config import Config
+from app import backup
+from app.storage import collection_cache, file_signature
+
+
+def _seed():
+    collection_cache.save(Config.USERS_DB, [{'id': 'u1', 'name': 'Анна'}])
+    collection_cache.save(Config.PROJECTS_DB, [{'id': 'p1', 'name': 'Север', 'team': ['u1']}])
+    os.makedirs(os.path.join(Config.UPLOAD_PATH, 'p1'))
+    with open(os.path.join(Config.UPLOAD_PATH, 'p1', 'plan.txt'), 'w', encoding='utf-8') as f:
+        f.write('план')
+
+
+def _path(name, relpath):
+    return os.path.join(Config.BACKUP_PATH, name, relpath)
+
+
+def test_unchanged_files_are_hard_links(database):
+    _seed()
+    first = backup.create_backup()
+    assert (first.copied, first.linked) == (3, 0)
+
+    second = backup.create_backup()
+    assert (second.copied, second.linked) == (0, 3)
+    for relpath in ('database/users.json', 'database/projects.json', 'uploads/p1/plan.txt'):
+        assert os.stat(_path(first.name, relpath)).st_ino == os.stat(_path(second.name, relpath)).st_ino
+
+    # Запись отдельной записи дописывает журнал: копируется только он
+    collection_cache.save_records(Config.USERS_DB, upserts=[{'id': 'u2', 'name': 'Борис'}])
+    third = backup.create_backup()
+    assert (third.copied, third.linked) == (1, 3)
+    assert set(backup.read_manifest(third.name)['files']) == {
+        'database/users.json', 'database/users.json.journal', 'database/projects.json', 'uploads/p1/plan.txt'}
+    assert backup.list_backups() == [first.name, second.name, third.name]
+
+
+def test_restore_returns_database_to_snapshot(database):
+    _seed()
+    collection_cache.save_records(Config.USERS_DB, upserts=[{'id': 'u2', 'name': 'Борис'}])
+    snapshot = backup.create_backup()
+
+    collection_cache.save_records(Config.USERS_DB, upserts=[{'id': 'u1', 'name': 'Изменено'}], deletes=['u2'])
+    collection_cache.save(Config.DIRECTIONS_DB, [{'id': 'd1'}])
+    os.remove(os.path.join(Config.UPLOAD_PATH, 'p1', 'plan.txt'))
+    with open(os.path.join(Config.UPLOAD_PATH, 'p1', 'later.txt'), 'w', encoding='utf-8') as f:
+        f.write('после снимка')
+
+    assert backup.restore_backup(snapshot.name) == {'database': 2, 'uploads': 1}
+
+    assert collection_cache.get(Config.USERS_DB) == [{'id': 'u1', 'name': 'Анна'}, {'id': 'u2', 'name': 'Борис'}]
+    # Коллекции, которых нет в снимке, удаляются; загруженные позже файлы остаются
+    assert not collection_cache.backend.exists(Config.DIRECTIONS_DB)
+    assert sorted(os.listdir(os.path.join(Config.UPLOAD_PATH, 'p1'))) == ['later.txt', 'plan.txt']
+    # Снимок при восстановлении не изменяется
+    for relpath, signature in backup.read_manifest(snapshot.name)['files'].items():
+        assert list(file_signature(_path(snapshot.name, relpath))[:2]) == signature[:2]
+
+
+def test_prune_keeps_latest_backups(database):
+    _seed()
+    names = [backup.create_backup(keep=0).name for _ in range(3)]
+    assert backup.prune_backups(2) == names[:1]
+    assert backup.list_backups() == names[1:]
+    with open(_path(names[2], 'database/users.json'), encoding='utf-8') as f:
+        assert 'Анна' in f.read()
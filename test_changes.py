@@ -0,0 +1,142 @@
+"""
+Тесты потока изменений коллекций (app/changes.py)
+"""
+
+import os
+
+import pytest
+
+from config import Config
+from app import changes, storage
+from app.changes import ChangeBus, ChangeEvent, ChangeFeed, DELETE, INSERT, RESET, UPDATE
+from app.storage import CollectionCache, JsonBackend
+
+
+def _ops(events):
+    return [(e.op, e.record_id) for e in events]
+
+
+def test_record_changes_skip_unchanged_records():
+    previous = {'t1': {'id': 't1', 'title': 'old'}, 't2': {'id': 't2', 'title': 'same'}}
+    events = changes.record_changes('tasks.json', previous.get,
+                                    [{'id': 't1', 'title': 'new'}, {'id': 't2', 'title': 'same'}, {'id': 't3'}],
+                                    ['t2', 'missing'], base=(1, 2), version=(3, 4))
+    assert _ops(events) == [(UPDATE, 't1'), (INSERT, 't3'), (DELETE, 't2')]
+    assert events[0].previous == {'id': 't1', 'title': 'old'}
+    assert events[2].record is None and events[2].previous == {'id': 't2', 'title': 'same'}
+    # Версии в том же виде, что и после чтения из файлового журнала
+    assert (events[0].base, events[0].version) == ([1, 2], [3, 4])
+
+    events = changes.collection_changes('tasks.json', [{'id': 't1'}, {'id': 't2'}], [{'id': 't2', 'x': 1}])
+    assert _ops(events) == [(UPDATE, 't2'), (DELETE, 't1')]
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    bus = ChangeBus()
+    monkeypatch.setattr(storage, 'change_bus', bus)
+    return bus
+
+
+def test_cache_writes_publish_events(bus, tmp_path):
+    cache = CollectionCache(JsonBackend(str(tmp_path / 'transactions')))
+    tasks, projects = str(tmp_path / 'tasks.json'), str(tmp_path / 'projects.json')
+    received, projects_only = [], []
+    bus.subscribe(received.append)
+    bus.subscribe(projects_only.append, collections=[projects])
+
+    cache.save(tasks, [{'id': 't1', 'title': 'old'}])
+    cache.save_records(tasks, upserts=[{'id': 't1', 'title': 'new'}], deletes=['t0'])
+    cache.save_transaction({tasks: ([], ['t1']), projects: ([{'id': 'p1'}], [])})
+    # Потоковая перезапись без изменений записей событий не дает
+    assert cache.rewrite(tasks, lambda record: True) == 0
+
+    # Один пакет на запись; транзакция - одним пакетом для всех коллекций
+    assert [_ops(batch) for batch in received] == [
+        [(INSERT, 't1')], [(UPDATE, 't1')], [(DELETE, 't1'), (INSERT, 'p1')]]
+    assert [_ops(batch) for batch in projects_only] == [[(INSERT, 'p1')]]
+    assert received[1][0].base == changes.normalize_version(received[0][0].version)
+
+    # Коллекция, переписанная потоком, публикуется заменой целиком
+    cache.save(tasks, [{'id': 't2'}])
+    assert cache.rewrite(tasks, lambda record: True) == 1
+    assert _ops(received[-1]) == [(RESET, None)] and received[-1][0].collection == tasks
+
+
+def test_failing_subscriber_does_not_stop_delivery(bus):
+    received = []
+
+    def broken(events):
+        raise RuntimeError('ошибка подписчика')
+
+    bus.subscribe(broken)
+    unsubscribe = bus.subscribe(received.append)
+    bus.reset()
+    assert _ops(received[0]) == [(RESET, None)]
+
+    unsubscribe()
+    bus.reset()
+    assert len(received) == 1
+
+
+@pytest.fixture
+def feed(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'DATABASE_PATH', str(tmp_path))
+    return ChangeFeed(str(tmp_path / 'changes'), segment_bytes=200, segments=2)
+
+
+def _foreign(op, record_id, pid=1):
+    """Событие, записанное другим процессом"""
+    return ChangeEvent(op, os.path.join(Config.DATABASE_PATH, 'tasks.json'), record_id,
+                       {'id': record_id} if op != DELETE else None, pid=pid)
+
+
+def test_feed_delivers_changes_of_other_processes(feed):
+    writer, reader = ChangeBus(feed), ChangeBus(feed)
+    feed.append([_foreign(INSERT, 'before')])
+    received = []
+    reader.subscribe(received.append)
+
+    # События до подписки и события своего процесса не доставляются повторно
+    writer.publish([_foreign(INSERT, 't1'), _foreign(DELETE, 't0')])
+    writer.publish([ChangeEvent(UPDATE, os.path.join(Config.DATABASE_PATH, 'tasks.json'), 't1')])
+    assert reader.poll() == 2
+    assert [_ops(batch) for batch in received] == [[(INSERT, 't1'), (DELETE, 't0')]]
+    assert received[0][0].record == {'id': 't1'}
+    assert received[0][0].collection == os.path.join(Config.DATABASE_PATH, 'tasks.json')
+    assert reader.poll() == 0
+
+
+def test_feed_rotates_segments_and_reports_gap(feed):
+    start = feed.end()
+    for number in range(10):
+        feed.append([_foreign(INSERT, f't{number}')])
+    assert len(feed._segments()) == 2
+
+    # Отставший читатель получает оставшиеся события и признак пропуска
+    events, position, gap = feed.read(start)
+    assert gap and events and position == feed.end()
+    assert events[-1].record_id == 't9'
+    assert feed.read(position) == ([], position, False)
+
+    reader = ChangeBus(feed)
+    received = []
+    reader.subscribe(received.append)
+    reader._position = start
+    reader.poll()
+    assert _ops(received[0]) == [(RESET, None)]
+
+
+def test_feed_skips_damaged_and_partial_lines(feed):
+    feed.append([_foreign(INSERT, 't1')])
+    segment = feed._segment_path(feed._segments()[-1])
+    with open(segment, 'ab') as f:
+        f.write(b'{"op": "insert", "collec\n')
+    feed.append([_foreign(INSERT, 't2')])
+    with open(segment, 'ab') as f:
+        f.write(b'{"op": "insert"')
+
+    # Оборванная сбоем строка пропускается, дописываемая - ждет следующего чтения
+    events, position, gap = feed.read(0)
+    assert [e.record_id for e in events] == ['t1', 't2'] and not gap
+    assert position == feed.end() - len(b'{"op": "insert"')
@@ -0,0 +1,89 @@
+"""
+Тесты справочника пользователей (app/directory.py)
+"""
+
+import pytest
+
+from app import directory, storage
+from app.changes import ChangeBus, ChangeEvent, UPDATE
+from app.storage import CollectionCache, JsonBackend, bind_scope, unbind_scope
+from app.unit_of_work import UnitOfWork
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    cache = CollectionCache(JsonBackend(str(tmp_path / 'transactions')))
+    monkeypatch.setattr(directory, 'collection_cache', cache)
+    bus = ChangeBus()
+    monkeypatch.setattr(directory, 'change_bus', bus)
+    monkeypatch.setattr(storage, 'change_bus', bus)
+    filepath = str(tmp_path / 'users.json')
+    cache.save(filepath, [{'id': 'u1', 'name': 'Анна'}, {'id': 'u2', 'name': 'Борис'},
+                          {'id': 'u3', 'name': 'Вера'}])
+    return directory.UserDirectory(filepath)
+
+
+def test_ordered_follows_collection_order(users):
+    assert [u['id'] for u in users.ordered(['u3', 'u1', 'missing', 'u3'])] == ['u1', 'u3']
+
+    directory.collection_cache.save_records(users.filepath, upserts=[{'id': 'u0', 'name': 'Глеб'}],
+                                            deletes=['u1'])
+    assert [u['id'] for u in users.ordered(['u0', 'u1', 'u2'])] == ['u2', 'u0']
+
+
+def _count_builds(users, monkeypatch):
+    builds = []
+    build = users._build
+    monkeypatch.setattr(users, '_build', lambda: builds.append(1) or build())
+    return builds
+
+
+def test_events_update_entries_without_rebuild(users, monkeypatch):
+    builds = _count_builds(users, monkeypatch)
+    assert users.name('u1') == 'Анна'
+
+    cache = directory.collection_cache
+    cache.save_records(users.filepath, upserts=[{'id': 'u1', 'name': 'Анна П.', 'password': 'x'},
+                                                {'id': 'u4', 'username': 'gleb'}], deletes=['u2'])
+    cache.save_transaction({users.filepath: ([{'id': 'u3', 'name': 'Вера', 'role': 'admin'}], [])})
+
+    assert users.name('u1') == 'Анна П.' and users.get('u2') is None
+    assert users.get('u4').display_name == 'gleb'
+    assert users.get('u3')['role'] == 'admin'
+    # В справочник попадают только его поля
+    assert 'password' not in users.get('u1')
+    assert len(builds) == 1
+
+
+def test_missed_changes_rebuild_directory(users, monkeypatch):
+    builds = _count_builds(users, monkeypatch)
+    users.entries()
+
+    # Запись другого процесса, события которой не пришли: сигнатура коллекции не совпадает
+    directory.collection_cache.backend.write_records(users.filepath, [{'id': 'u5', 'name': 'Дина'}], [])
+    assert users.name('u5') == 'Дина' and len(builds) == 2
+
+    # Событие не от текущей версии - справочник сбрасывается и строится заново
+    directory.change_bus.publish([ChangeEvent(UPDATE, users.filepath, 'u1', {'id': 'u1', 'name': 'чужое'},
+                                              base=['other'], version=['newer'])])
+    assert users.name('u1') == 'Анна' and len(builds) == 3
+
+
+def test_directory_is_validated_once_per_request(users, monkeypatch):
+    users.entries()
+    backend = directory.collection_cache.backend
+    signatures = []
+    signature = backend.signature
+    monkeypatch.setattr(backend, 'signature', lambda filepath: signatures.append(filepath) or signature(filepath))
+
+    token = bind_scope(UnitOfWork(directory.collection_cache))
+    try:
+        for user_id in ('u1', 'u2', 'u3'):
+            users.name(user_id)
+    finally:
+        unbind_scope(token)
+    assert signatures == [users.filepath]
+
+    users.name('u1')
+    users.name('u2')
+    assert signatures == [users.filepath] * 3
@@ -0,0 +1,94 @@
+"""
+Тесты пакетной записи изменений (app/group_commit.py, CollectionCache.save_records)
+"""
+
+import threading
+
+import pytest
+
+from config import Config
+from app.group_commit import GroupCommitWriter, PendingChange
+from app.storage import CollectionCache, ConflictError, JsonBackend
+
+
+def test_changes_during_window_form_one_batch():
+    batches = []
+    writer = GroupCommitWriter(lambda filepath, changes: batches.append([c.upserts for c in changes]),
+                               window=0.2)
+
+    # Первое изменение после простоя записывается сразу
+    writer.submit('tasks.json', ['a'], []).result(timeout=1)
+    futures = [writer.submit('tasks.json', [name], []) for name in ('b', 'c', 'd')]
+    for future in futures:
+        assert future.result(timeout=1) is None
+
+    assert batches == [[['a']], [['b'], ['c'], ['d']]]
+
+
+def test_full_batch_is_written_without_waiting_for_window():
+    batches = []
+    writer = GroupCommitWriter(lambda filepath, changes: batches.append(len(changes)),
+                               window=30, max_batch=2)
+    writer.submit('tasks.json', ['a'], []).result(timeout=1)
+    futures = [writer.submit('tasks.json', [name], []) for name in ('b', 'c')]
+    for future in futures:
+        future.result(timeout=1)
+    assert batches == [1, 2]
+
+
+def test_commit_error_fails_every_change_of_batch():
+    def commit(filepath, changes):
+        raise OSError('disk full')
+
+    writer = GroupCommitWriter(commit, window=0)
+    with pytest.raises(OSError):
+        writer.submit('tasks.json', ['a'], []).result(timeout=1)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'GROUP_COMMIT', True)
+    monkeypatch.setattr(Config, 'GROUP_COMMIT_WINDOW_MS', 50)
+    return CollectionCache(JsonBackend(str(tmp_path / 'transactions')))
+
+
+def test_parallel_saves_share_journal_writes(cache, tmp_path, monkeypatch):
+    tasks = str(tmp_path / 'tasks.json')
+    cache.save(tasks, [])
+    writes = []
+    write_records = cache.backend.write_records
+    monkeypatch.setattr(cache.backend, 'write_records',
+                        lambda *args: writes.append(args) or write_records(*args))
+
+    barrier = threading.Barrier(20)
+
+    def save(number):
+        barrier.wait()
+        cache.save_records(tasks, upserts=[{'id': f't{number}'}])
+
+    threads = [threading.Thread(target=save, args=(number,)) for number in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(r['id'] for r in cache.get(tasks)) == sorted(f't{n}' for n in range(20))
+    assert sorted(r['id'] for r in cache.backend.read(tasks)) == sorted(f't{n}' for n in range(20))
+    assert len(writes) < 20
+
+
+def test_conflicting_change_is_rejected_alone(cache, tmp_path):
+    tasks = str(tmp_path / 'tasks.json')
+    cache.save(tasks, [{'id': 't1', 'title': 'old'}, {'id': 't2', 'title': 'old'}])
+    original = cache.index(tasks).get('t1')
+
+    first = PendingChange([{'id': 't1', 'title': 'first'}], [], {'t1': original})
+    # Прочитало ту же версию t1, что и первое изменение пакета
+    second = PendingChange([{'id': 't1', 'title': 'second'}], [], {'t1': original})
+    third = PendingChange([{'id': 't2', 'title': 'third'}], [], None)
+    cache._commit_changes(tasks, [first, second, third])
+
+    assert first.future.result() is None and third.future.result() is None
+    with pytest.raises(ConflictError):
+        second.future.result()
+    assert [r['title'] for r in cache.backend.read(tasks)] == ['first', 'third']
@@ -0,0 +1,82 @@
+"""
+Тесты проверки целостности и исправления базы данных (app/integrity.py)
+"""
+
+import os
+
+from config import Config
+from app import backup, integrity, serializer
+from app.storage import collection_cache
+
+
+def _seed():
+    collection_cache.save(Config.USERS_DB, [
+        {'id': 'u1', 'username': 'anna', 'password': 'x', 'role': 'admin', 'projects': ['p1', 'gone']},
+        {'id': 'u2', 'username': 'boris', 'password': 'x', 'role': 'worker', 'projects': []}])
+    collection_cache.save(Config.PROJECTS_DB, [
+        {'id': 'p1', 'name': 'Север', 'team': ['u1', 'u2', 'ghost'], 'manager_id': 'u1'},
+        {'id': 'p2', 'team': []}])
+
+
+def _problems(issues):
+    return sorted((os.path.basename(i.filepath), i.record_id, i.action) for i in issues)
+
+
+def test_check_and_repair_records(database):
+    _seed()
+    issues = integrity.check_database()
+    assert _problems(issues) == [('projects.json', 'p1', integrity.REPAIR),
+                                 ('projects.json', 'p2', integrity.QUARANTINE),
+                                 ('users.json', 'u1', integrity.REPAIR)]
+
+    assert integrity.repair(issues) == {integrity.QUARANTINE: 1, integrity.REPAIR: 2, integrity.RESTORE: 0}
+    assert integrity.check_database() == []
+    assert collection_cache.index(Config.USERS_DB).get('u1')['projects'] == ['p1']
+    assert collection_cache.index(Config.PROJECTS_DB).get('p1')['team'] == ['u1', 'u2']
+    assert collection_cache.index(Config.PROJECTS_DB).get('p2') is None
+
+    # Убранная запись сохраняется в карантине вместе с причиной
+    with open(os.path.join(Config.QUARANTINE_PATH, 'projects.json.jsonl'), 'rb') as f:
+        entries = [serializer.loads(line) for line in f]
+    assert [(e['record'], e['reason']) for e in entries] == [({'id': 'p2', 'team': []}, 'нет обязательного поля name')]
+
+
+def test_corrupt_snapshot_is_restored_from_backup_and_journal(database):
+    _seed()
+    backup.create_backup()
+    collection_cache.save_records(Config.USERS_DB, upserts=[
+        {'id': 'u3', 'username': 'vera', 'password': 'x', 'role': 'worker'}])
+    with open(Config.USERS_DB, 'r+b') as f:
+        f.truncate(20)
+
+    issues = integrity.check_database()
+    assert _problems(issues)[-1] == ('users.json', None, integrity.RESTORE)
+    assert integrity.restore_collection(Config.USERS_DB) is True
+    assert [u['id'] for u in collection_cache.get(Config.USERS_DB)] == ['u1', 'u2', 'u3']
+    assert integrity.quarantined_collections() == []
+
+
+def test_checker_rechecks_only_changed_collections(database, monkeypatch):
+    _seed()
+    checked = []
+    check_collection = integrity.check_collection
+    monkeypatch.setattr(integrity, 'check_collection',
+                        lambda filepath: checked.append(os.path.basename(filepath)) or check_collection(filepath))
+    checker = integrity.IntegrityChecker(interval=0, batch=10, repair_records=True)
+
+    assert checker.run_once() == []
+    assert {'users.json', 'projects.json'} <= set(checked)
+    assert collection_cache.index(Config.PROJECTS_DB).get('p2') is None
+
+    # Исправление проектов изменило зависимость пользователей - они проверяются еще раз
+    checked.clear()
+    assert checker.run_once() == [] and checked == ['users.json']
+    checked.clear()
+    assert checker.run_once() == [] and checked == []
+
+    # Изменение пользователей требует проверить ссылающиеся на них проекты и токены,
+    # а исправление команды проекта - манифест задач
+    collection_cache.save_records(Config.USERS_DB, deletes=['u2'])
+    checker.run_once()
+    assert set(checked) == {'users.json', 'projects.json', 'tokens.json', 'task_manifest.json'}
+    assert collection_cache.index(Config.PROJECTS_DB).get('p1')['team'] == ['u1']
@@ -0,0 +1,62 @@
+"""
+Тесты версий схемы и обновления записей при чтении (app/migrations.py)
+"""
+
+from config import Config
+from app import migrations, utils
+from app.storage import collection_cache
+
+
+def _seed_old_projects():
+    """Коллекция проектов в версии схемы 0 (даты в формате ГГГГ-ММ-ДД)"""
+    collection_cache.backend.write(Config.PROJECTS_DB, [
+        {'id': 'p1', 'name': 'Север', 'start_date': '2024-01-15', 'end_date': '31/12/2024'},
+        {'id': 'p2', 'name': 'Юг', 'start_date': '01.02.2024'}])
+
+
+def test_old_records_are_upgraded_on_read(database, monkeypatch):
+    _seed_old_projects()
+    assert migrations.collection_version(Config.PROJECTS_DB) == 0
+    assert [m.number for m in migrations.pending(Config.PROJECTS_DB)] == [1]
+    assert migrations.pending(Config.USERS_DB) == []
+
+    project = collection_cache.index(Config.PROJECTS_DB).get('p1')
+    assert (project['start_date'], project['end_date']) == ('15.01.2024', '31.12.2024')
+    assert project.date('start_date').year == 2024
+    # Файл не переписывается при чтении
+    assert collection_cache.backend.read(Config.PROJECTS_DB)[0]['start_date'] == '2024-01-15'
+
+    # Потоковые чтения в обход кэша тоже получают записи новой версии
+    collection_cache.invalidate(Config.PROJECTS_DB)
+    monkeypatch.setattr(Config, 'PACKED_READS', False)
+    monkeypatch.setattr(Config, 'STREAMING_READ_BYTES', 1)
+    assert [p['start_date'] for p in utils.iter_records(Config.PROJECTS_DB)] == ['15.01.2024', '01.02.2024']
+    assert list(utils.scan_records(Config.PROJECTS_DB, 'end_date')) == [{'end_date': '31.12.2024'}, {}]
+
+
+def test_migrate_collection_rewrites_records_and_stops_upgrades(database):
+    _seed_old_projects()
+    assert migrations.migrate_collection(Config.PROJECTS_DB, batch_size=1) == 1
+
+    assert collection_cache.backend.read(Config.PROJECTS_DB)[0]['start_date'] == '15.01.2024'
+    assert migrations.collection_version(Config.PROJECTS_DB) == migrations.latest_version()
+    assert migrations.upgrader(Config.PROJECTS_DB) is None
+    assert migrations.migrate_collection(Config.PROJECTS_DB) == 0
+
+
+def test_migrate_database_sets_common_version(database):
+    _seed_old_projects()
+    collection_cache.save(Config.SCHEMA_DB, [{'id': 'tasks/tasks__gone.json', 'version': 0}])
+
+    assert migrations.migrate_database() == {'projects.json': 1}
+    assert migrations.schema_status() == []
+    # Версии удаленных коллекций не хранятся, новые коллекции создаются в текущей версии
+    assert [entry['id'] for entry in collection_cache.get(Config.SCHEMA_DB)] == ['projects.json', '*']
+    assert migrations.pending(Config.TASKS_DB) == []
+
+
+def test_stamped_database_is_not_upgraded(database):
+    migrations.stamp()
+    collection_cache.backend.write(Config.PROJECTS_DB, [{'id': 'p1', 'start_date': '2024-01-15'}])
+    assert migrations.upgrader(Config.PROJECTS_DB) is None
+    assert collection_cache.index(Config.PROJECTS_DB).get('p1')['start_date'] == '2024-01-15'
@@ -0,0 +1,54 @@
+"""
+Тесты загрузки пользователя сессии (app/models.py)
+"""
+
+import pytest
+
+from app import directory, models
+from app.storage import CollectionCache, JsonBackend, bind_scope, unbind_scope
+from app.unit_of_work import UnitOfWork
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    cache = CollectionCache(JsonBackend(str(tmp_path / 'transactions')))
+    filepath = str(tmp_path / 'users.json')
+    cache.save(filepath, [{'id': 'u1', 'username': 'ivanov', 'password': 'x', 'name': 'Иванов', 'role': 'worker'}])
+    monkeypatch.setattr(directory, 'collection_cache', cache)
+    monkeypatch.setattr(models, 'user_directory', directory.UserDirectory(filepath))
+    monkeypatch.setattr(models, '_users', {})
+
+    checks = []
+    signature = cache.backend.signature
+    monkeypatch.setattr(cache.backend, 'signature', lambda path: checks.append(path) or signature(path))
+    return cache, filepath, checks
+
+
+def test_load_user_revalidates_once_per_request(users):
+    cache, filepath, checks = users
+    models.load_user('u1')
+
+    for _ in range(2):
+        token = bind_scope(UnitOfWork(cache))
+        try:
+            checks.clear()
+            first = models.load_user('u1')
+            assert models.load_user('u1') is first
+            assert models.load_user('missing') is None
+            assert len(checks) == 1
+        finally:
+            unbind_scope(token)
+
+
+def test_load_user_sees_edit_and_delete(users):
+    cache, filepath, _ = users
+    before = models.load_user('u1')
+
+    cache.save_records(filepath, upserts=[{'id': 'u1', 'username': 'ivanov', 'password': 'x',
+                                           'name': 'Иванов И.', 'role': 'manager'}])
+    after = models.load_user('u1')
+    assert after is not before
+    assert (after.name, after.role) == ('Иванов И.', 'manager')
+
+    cache.save_records(filepath, deletes=['u1'])
+    assert models.load_user('u1') is None
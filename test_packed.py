@@ -0,0 +1,66 @@
+"""
+Тесты упакованного представления коллекций (app/packed.py)
+"""
+
+import pytest
+
+from app import packed
+from app.storage import JsonBackend
+
+
+RECORDS = [
+    {'id': 't1', 'title': 'Первая', 'status': 'активна', 'tags': ['a']},
+    {'id': 't2', 'title': 'Вторая', 'note': None},
+    {'id': 't3', 'status': 'завершена', 'note': 'текст'},
+]
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return JsonBackend(str(tmp_path / 'transactions'))
+
+
+@pytest.fixture
+def tasks(backend, tmp_path):
+    filepath = str(tmp_path / 'tasks.json')
+    backend.write(filepath, RECORDS)
+    return filepath
+
+
+def test_scan_reads_only_requested_fields(backend, tasks):
+    assert list(packed.scan_packed(tasks, backend, ['id', 'status'])) == [
+        {'id': 't1', 'status': 'активна'}, {'id': 't2'}, {'id': 't3', 'status': 'завершена'}]
+    # null в записи сохраняется, отсутствующее поле пропускается
+    assert list(packed.scan_packed(tasks, backend, ['note', 'tags', 'missing'])) == [
+        {'tags': ['a']}, {'note': None}, {'note': 'текст'}]
+    assert list(packed.scan_packed(tasks, backend, ['missing'])) == [{}, {}, {}]
+
+
+def test_get_decodes_one_record(backend, tasks):
+    collection = packed.open_packed(tasks, backend)
+    assert len(collection) == 3
+    assert collection.get(1, ['title', 'note', 'status']) == {'title': 'Вторая', 'note': None}
+    with pytest.raises(IndexError):
+        collection.get(3, ['id'])
+
+
+def test_packed_file_follows_collection_changes(backend, tasks):
+    collection = packed.open_packed(tasks, backend)
+    assert packed.open_packed(tasks, backend) is collection
+
+    backend.write_records(tasks, [{'id': 't4', 'status': 'новая'}], ['t1'])
+    assert [r['id'] for r in packed.scan_packed(tasks, backend, ['id'])] == ['t2', 't3', 't4']
+
+    # Поврежденный файл перестраивается из коллекции
+    packed._opened.pop(tasks)
+    with open(packed.packed_path(tasks), 'wb') as f:
+        f.write(b'garbage')
+    assert [r['id'] for r in packed.scan_packed(tasks, backend, ['id'])] == ['t2', 't3', 't4']
+
+
+def test_empty_and_missing_collections(backend, tmp_path):
+    missing = str(tmp_path / 'missing.json')
+    assert list(packed.scan_packed(missing, backend, ['id'])) == []
+    empty = str(tmp_path / 'empty.json')
+    backend.write(empty, [])
+    assert len(packed.open_packed(empty, backend)) == 0
@@ -0,0 +1,59 @@
+"""
+Тесты пула проверки паролей (app/passwords.py)
+"""
+
+import threading
+
+import pytest
+
+from app import passwords
+
+
+@pytest.fixture
+def slow_check(monkeypatch):
+    """check_password_hash, ждущий release: проверки остаются в работе"""
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def check(password_hash, password):
+        started.release()
+        release.wait(5)
+        return password_hash == password
+
+    monkeypatch.setattr(passwords, 'check_password_hash', check)
+    yield started, release
+    release.set()
+
+
+def _in_flight(pool, count, client, started):
+    threads = [threading.Thread(target=pool.verify, args=('pw', 'pw', client)) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for _ in range(count):
+        assert started.acquire(timeout=5)
+    return threads
+
+
+def test_same_address_is_not_limited_by_default(slow_check):
+    started, release = slow_check
+    pool = passwords.PasswordPool(workers=4, per_client=0, queue=8)
+    threads = _in_flight(pool, 4, '10.0.0.1', started)
+    release.set()
+    assert pool.verify('pw', 'pw', '10.0.0.1') is True
+    for thread in threads:
+        thread.join()
+
+
+def test_per_client_and_queue_limits(slow_check):
+    started, release = slow_check
+    pool = passwords.PasswordPool(workers=2, per_client=1, queue=2)
+    threads = _in_flight(pool, 1, '10.0.0.1', started)
+    with pytest.raises(passwords.PasswordPoolBusy):
+        pool.verify('pw', 'pw', '10.0.0.1')
+    threads += _in_flight(pool, 1, '10.0.0.2', started)
+    with pytest.raises(passwords.PasswordPoolBusy):
+        pool.verify('pw', 'pw', '10.0.0.3')
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert pool.verify('pw', 'pw', '10.0.0.1') is True
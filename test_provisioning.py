@@ -0,0 +1,102 @@
+"""
+Тесты массового создания пользователей и приглашений (app/provisioning.py)
+"""
+
+import pytest
+from werkzeug.security import check_password_hash
+
+from config import Config
+from app import provisioning
+from app.storage import collection_cache
+from app.tokens import token_store
+
+
+@pytest.fixture
+def seeded(database, monkeypatch):
+    monkeypatch.setattr(token_store, 'filepath', Config.TOKENS_DB)
+    monkeypatch.setattr(Config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    collection_cache.save(Config.USERS_DB, [{'id': 'u1', 'username': 'anna', 'role': 'admin'}])
+    collection_cache.save(Config.PROJECTS_DB, [{'id': 'p1', 'name': 'Север', 'team': ['u1']},
+                                               {'id': 'p2', 'name': 'Юг'}])
+    collection_cache.save(Config.TOKENS_DB, [])
+
+
+def _rows(*rows):
+    return [provisioning._row(row) for row in rows]
+
+
+def test_parse_batch_formats():
+    csv_text = 'username,name,role,projects\nboris,Борис,worker,p1; p2\n,,manager,\n'
+    assert provisioning.parse_batch(csv_text, 'csv') == [
+        {'username': 'boris', 'name': 'Борис', 'role': 'worker', 'password': '', 'projects': ['p1', 'p2']},
+        {'username': '', 'name': '', 'role': 'manager', 'password': '', 'projects': []}]
+    json_text = '{"users": [{"username": " vera ", "role": "worker", "projects": ["p1"]}]}'
+    assert provisioning.parse_batch(json_text, 'json')[0]['username'] == 'vera'
+
+    for text, fmt in (('[{"username": ', 'json'), ('{"rows": []}', 'json'), ('["boris"]', 'json'),
+                      ('username\nboris\n', 'xml')):
+        with pytest.raises(ValueError):
+            provisioning.parse_batch(text, fmt)
+
+
+def test_invalid_batch_is_not_written(seeded):
+    rows = _rows({'username': 'boris', 'role': 'worker', 'projects': ['p1', 'p9']},
+                 {'username': 'anna', 'role': 'worker'},
+                 {'username': 'boris', 'role': 'guest'},
+                 {'role': 'worker', 'password': 'secret', 'projects': ['p1', 'p2']})
+    result = provisioning.provision(rows)
+    assert result.errors == [
+        'строка 1: нет проекта p9',
+        'строка 2: пользователь anna уже существует',
+        "строка 3: неизвестная роль 'guest'",
+        'строка 3: логин boris повторяется в пакете',
+        'строка 4: пароль задан для приглашения без логина',
+        'строка 4: приглашение выдается не больше чем в один проект']
+    assert result.users == [] and result.invitations == []
+    assert [u['id'] for u in collection_cache.get(Config.USERS_DB)] == ['u1']
+
+
+def test_dry_run_writes_nothing(seeded):
+    signatures = [collection_cache.backend.signature(path)
+                  for path in (Config.USERS_DB, Config.PROJECTS_DB, Config.TOKENS_DB)]
+    result = provisioning.provision(_rows({'username': 'boris', 'role': 'worker', 'projects': ['p1']},
+                                          {'role': 'manager', 'projects': ['p2']}), dry_run=True)
+    assert result.to_dict() == {'users': [], 'invitations': [], 'errors': []}
+    assert [collection_cache.backend.signature(path)
+            for path in (Config.USERS_DB, Config.PROJECTS_DB, Config.TOKENS_DB)] == signatures
+
+
+def test_batch_is_written_in_one_transaction(seeded, monkeypatch):
+    transactions = []
+    save_transaction = collection_cache.save_transaction
+    monkeypatch.setattr(collection_cache, 'save_transaction',
+                        lambda changes, expected=None: transactions.append(sorted(changes))
+                        or save_transaction(changes, expected=expected))
+
+    rows = _rows({'username': 'boris', 'name': 'Борис', 'role': 'worker', 'password': 'пароль',
+                  'projects': ['p1', 'p2']},
+                 {'username': 'vera', 'role': 'manager', 'projects': ['p2']},
+                 {'role': 'worker', 'projects': ['p1']})
+    result = provisioning.provision(rows, workers=2)
+    assert result.errors == []
+    assert transactions == [sorted([Config.USERS_DB, Config.TOKENS_DB, Config.PROJECTS_DB])]
+
+    boris, vera = result.users
+    assert 'password' not in boris
+    users = collection_cache.index(Config.USERS_DB)
+    assert check_password_hash(users.get(boris['id'])['password'], 'пароль')
+    # Сгенерированный пароль возвращается один раз, в базе - только хэш
+    assert len(vera['password']) == provisioning.PASSWORD_LENGTH
+    assert check_password_hash(users.get(vera['id'])['password'], vera['password'])
+    assert (users.get(vera['id'])['name'], users.get(vera['id'])['role']) == ('vera', 'manager')
+
+    projects = collection_cache.index(Config.PROJECTS_DB)
+    assert list(projects.get('p1')['team']) == ['u1', boris['id']]
+    assert list(projects.get('p2')['team']) == [boris['id'], vera['id']]
+
+    invitation, = result.invitations
+    token = token_store.validate(invitation['token'])
+    assert (token['role'], token['project_id']) == ('worker', 'p1')
+
+    # Повторная загрузка того же пакета отклоняется: логины уже заняты
+    assert len(provisioning.provision(rows).errors) == 2
@@ -0,0 +1,65 @@
+"""
+Тесты классов записей коллекций (app/records.py)
+"""
+
+import copy
+import pickle
+from datetime import date, datetime
+
+import pytest
+
+from app import serializer
+from app.records import Project, Task, TaskSubtask, Token, record_class
+from app.storage import freeze_collection, thaw
+
+
+TASK = {'id': 't1', 'project_id': 'p1', 'title': 'Задача', 'status': 'активна',
+        'deadline': '05.03.2025', 'start_date': '1.3.2025', 'priority': 'высокий'}
+
+
+def test_record_behaves_like_a_read_only_dict():
+    task = Task(TASK)
+
+    assert task == TASK and dict(task) == TASK
+    assert list(task) == ['id', 'project_id', 'title', 'start_date', 'deadline', 'status', 'priority']
+    assert task['deadline'] == '05.03.2025' and task.deadline == '05.03.2025'
+    assert task.get('assignee_id', 'нет') == 'нет' and 'assignee_id' not in task
+    assert 'priority' in task and task['priority'] == 'высокий'
+    with pytest.raises(KeyError):
+        task['assignee_id']
+    with pytest.raises(TypeError):
+        task.status = 'завершена'
+
+
+def test_dates_are_parsed_but_kept_as_strings():
+    task = Task(TASK)
+    assert task.date('deadline') == date(2025, 3, 5)
+    # Строка не в формате хранится как есть и не считается датой
+    assert task['start_date'] == '1.3.2025' and task.date('start_date') is None
+    assert task.date('completion_date') is None
+
+    token = Token({'id': 'x', 'created_at': '09.12.2025 12:08:05'})
+    assert token.date('created_at') == datetime(2025, 12, 9, 12, 8, 5)
+    assert token['created_at'] == '09.12.2025 12:08:05'
+
+
+def test_copies_are_plain_mutable_dicts():
+    task = Task(TASK)
+    for value in (thaw(task), task.copy(), copy.copy(task), copy.deepcopy(task)):
+        assert type(value) is dict and value == TASK
+    assert pickle.loads(pickle.dumps(task)) == task
+    assert serializer.loads(serializer.dumps(task)) == TASK
+
+
+def test_collection_files_get_their_record_class():
+    assert record_class('/db/projects.json') is Project
+    assert record_class('/db/tasks/tasks__p1.json') is Task
+    assert record_class('/db/directions.json') is None
+
+    subtasks = freeze_collection('/db/tasks/task_subtasks__p1.json', [
+        {'id': 's1', 'task_id': 't1', 'data': {'id': 's1', 'planned_date': '01.02.2025'}}])
+    assert isinstance(subtasks[0], TaskSubtask)
+    assert subtasks[0]['data'].date('planned_date') == date(2025, 2, 1)
+    directions = freeze_collection('/db/directions.json', [{'id': 'd1'}])
+    with pytest.raises(TypeError):
+        directions[0]['id'] = 'd2'
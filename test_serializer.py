@@ -0,0 +1,97 @@
+"""
+Тесты сериализации JSON (app/serializer.py)
+"""
+
+import io
+import json
+from datetime import datetime
+
+import pytest
+from flask import Flask, jsonify
+
+from app import serializer
+from app.storage import freeze
+
+
+SAMPLE = [
+    {'id': 'p1', 'name': 'Проект "Север"', 'team': ['u1', 'u2'], 'budget': 1.5, 'active': True, 'note': None},
+    {'id': 'p2', 'name': 'Строка\nс переводом', 'nested': {'a': [], 'b': {}}, 'count': 10 ** 12},
+]
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def backend(request, monkeypatch):
+    if request.param == 'orjson':
+        if serializer.orjson is None:
+            pytest.skip('orjson не установлен')
+    else:
+        # Без orjson используется стандартный модуль json
+        monkeypatch.setattr(serializer, 'orjson', None)
+    return request.param
+
+
+@pytest.mark.parametrize('pretty', [False, True])
+def test_backends_write_the_same_bytes(backend, pretty):
+    expected = json.dumps(SAMPLE, ensure_ascii=False, indent=2 if pretty else None,
+                          separators=None if pretty else (',', ':')).encode('utf-8')
+    assert serializer.dumps(SAMPLE, pretty=pretty) == expected
+    assert 'Проект'.encode('utf-8') in serializer.dumps(SAMPLE)
+
+
+def test_roundtrip_and_special_types(backend):
+    assert serializer.loads(serializer.dumps(SAMPLE)) == SAMPLE
+    assert serializer.loads(serializer.dumps(SAMPLE).decode('utf-8')) == SAMPLE
+    assert serializer.dumps({'b': 1, 'a': 2}, sort_keys=True) == b'{"a":2,"b":1}'
+
+    # Записи из кэша, даты и нестроковые ключи сериализуются как во Flask
+    value = {'record': freeze({'id': 'p1'}), 'at': datetime(2025, 12, 9, 12, 0), 1: 'one'}
+    assert serializer.loads(serializer.dumps(value)) == {
+        'record': {'id': 'p1'}, 'at': 'Tue, 09 Dec 2025 12:00:00 GMT', '1': 'one'}
+    with pytest.raises(TypeError):
+        serializer.dumps({'value': object()})
+    with pytest.raises(serializer.JSONDecodeError):
+        serializer.loads(b'[{"id": ')
+
+
+@pytest.mark.parametrize('pretty', [False, True])
+def test_dump_array_matches_dumps(backend, pretty):
+    for values in (SAMPLE, []):
+        stream = io.BytesIO()
+        assert serializer.dump_array(iter(values), stream, pretty=pretty) == len(values)
+        assert stream.getvalue() == serializer.dumps(values, pretty=pretty)
+
+
+def test_flask_responses_keep_cyrillic(backend):
+    app = Flask(__name__)
+    app.json = serializer.FastJSONProvider(app)
+    with app.app_context():
+        response = jsonify(SAMPLE[0])
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.get_data()) == SAMPLE[0]
+    assert 'Проект'.encode('utf-8') in response.get_data()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64, 1 << 20])
+def test_iter_array_matches_loads_for_any_chunk_size(chunk_size):
+    # Числа, строки с экранированием и многобайтовые символы попадают на границы частей
+    values = SAMPLE + [12345678901234567890, -0.25e-3, 'конец \\"строки\\"', [], {}, 7]
+    for text in (serializer.dumps(values), serializer.dumps(values, pretty=True)):
+        assert list(serializer.iter_array(io.BytesIO(text), chunk_size=chunk_size)) == values
+
+
+@pytest.mark.parametrize('text', [b'', b'  \n', b'[]', b' [ \n ] \n'])
+def test_iter_array_empty(text):
+    assert list(serializer.iter_array(io.BytesIO(text), chunk_size=1)) == []
+
+
+@pytest.mark.parametrize('text', [b'{"id": 1}', b'[1, 2', b'[1 2]', b'[1,]', b'[1] 2', b'[{"id": '])
+def test_iter_array_rejects_malformed_input(text):
+    with pytest.raises(serializer.JSONDecodeError):
+        list(serializer.iter_array(io.BytesIO(text), chunk_size=2))
+
+
+def test_iter_array_reads_lazily():
+    stream = io.BytesIO(serializer.dumps([{'id': n} for n in range(1000)]))
+    values = serializer.iter_array(stream, chunk_size=16)
+    assert next(values) == {'id': 0}
+    assert stream.tell() < 100
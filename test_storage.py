@@ -0,0 +1,280 @@
+"""
+Тесты хранилища коллекций: кэш, журнал и восстановление после сбоя (app/storage.py, app/integrity.py)
+"""
+
+import os
+
+import pytest
+
+from config import Config
+from app import integrity, serializer, storage
+from app.storage import CollectionCache, JsonBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return JsonBackend(str(tmp_path / 'transactions'))
+
+
+@pytest.fixture
+def cache(backend):
+    return CollectionCache(backend)
+
+
+def _count_reads(backend, monkeypatch):
+    reads = []
+    read = backend.read
+    monkeypatch.setattr(backend, 'read', lambda filepath: reads.append(filepath) or read(filepath))
+    return reads
+
+
+def _crash_after_commit(backend, monkeypatch, journals):
+    """Процесс "падает" после фиксации транзакции, дописав journals пакетов в журналы"""
+    append = backend._append_journal
+    written = []
+
+    def append_journal(filepath, upserts, deletes, sync):
+        if len(written) == journals:
+            raise SystemExit('crash')
+        written.append(filepath)
+        return append(filepath, upserts, deletes, sync)
+
+    monkeypatch.setattr(backend, '_append_journal', append_journal)
+    return append
+
+
+def test_committed_transaction_rolls_forward(backend, tmp_path, monkeypatch):
+    users, projects = str(tmp_path / 'users.json'), str(tmp_path / 'projects.json')
+    backend.write(users, [{'id': 'u1', 'projects': []}])
+    backend.write(projects, [{'id': 'p1', 'team': []}])
+
+    append = _crash_after_commit(backend, monkeypatch, journals=1)
+    with pytest.raises(SystemExit):
+        backend.write_transaction({
+            users: ([{'id': 'u1', 'projects': ['p1']}], [], {'u1': {'id': 'u1', 'projects': []}}),
+            projects: ([{'id': 'p1', 'team': ['u1']}], [], {'p1': {'id': 'p1', 'team': []}})
+        })
+    monkeypatch.setattr(backend, '_append_journal', append)
+
+    pending = os.listdir(tmp_path / 'transactions')
+    assert len(pending) == 1 and pending[0].endswith('.txn')
+    assert backend.read(projects) == [{'id': 'p1', 'team': []}]
+
+    # Транзакцию записывает живой процесс - ее нельзя трогать
+    assert backend.recover() == 0
+    monkeypatch.setattr(storage, '_process_alive', lambda pid: False)
+    assert backend.recover() == 1
+
+    assert os.listdir(tmp_path / 'transactions') == []
+    # Пакет users уже был в журнале и не дописывается повторно
+    assert backend.read(users) == [{'id': 'u1', 'projects': ['p1']}]
+    assert backend.read(projects) == [{'id': 'p1', 'team': ['u1']}]
+
+
+def test_recover_skips_records_changed_later(backend, tmp_path, monkeypatch):
+    users = str(tmp_path / 'users.json')
+    backend.write(users, [{'id': 'u1', 'name': 'old'}])
+
+    append = _crash_after_commit(backend, monkeypatch, journals=0)
+    with pytest.raises(SystemExit):
+        backend.write_transaction({users: ([{'id': 'u1', 'name': 'txn'}], [], {'u1': {'id': 'u1', 'name': 'old'}})})
+    monkeypatch.setattr(backend, '_append_journal', append)
+    backend.write_records(users, [{'id': 'u1', 'name': 'newer'}], [])
+
+    monkeypatch.setattr(storage, '_process_alive', lambda pid: False)
+    assert backend.recover() == 0
+    assert os.listdir(tmp_path / 'transactions') == []
+    assert backend.read(users) == [{'id': 'u1', 'name': 'newer'}]
+
+
+def test_commit_survives_lost_rename(backend, tmp_path, monkeypatch):
+    users, projects = str(tmp_path / 'users.json'), str(tmp_path / 'projects.json')
+    backend.write(users, [{'id': 'u1', 'projects': []}])
+    backend.write(projects, [{'id': 'p1', 'team': []}])
+
+    # Переименования в директории транзакций переживают сбой ОС только после ее fsync
+    durable = set()
+    sync_directory = storage.sync_directory
+
+    def record_sync(path):
+        sync_directory(path)
+        if path == backend.transactions_path:
+            durable.update(os.listdir(path))
+
+    monkeypatch.setattr(storage, 'sync_directory', record_sync)
+    append = _crash_after_commit(backend, monkeypatch, journals=1)
+    with pytest.raises(SystemExit):
+        backend.write_transaction({
+            users: ([{'id': 'u1', 'projects': ['p1']}], [], {'u1': {'id': 'u1', 'projects': []}}),
+            projects: ([{'id': 'p1', 'team': ['u1']}], [], {'p1': {'id': 'p1', 'team': []}})
+        })
+    monkeypatch.setattr(backend, '_append_journal', append)
+
+    # Сбой ОС: несинхронизированные переименования теряются, пакет users уже в журнале
+    for name in os.listdir(backend.transactions_path):
+        if name not in durable:
+            os.remove(os.path.join(backend.transactions_path, name))
+    assert backend.read(users) == [{'id': 'u1', 'projects': ['p1']}]
+
+    monkeypatch.setattr(storage, '_process_alive', lambda pid: False)
+    assert backend.recover() == 1
+    assert backend.read(projects) == [{'id': 'p1', 'team': ['u1']}]
+
+
+def test_torn_journal_entry_is_skipped(backend, tmp_path):
+    tasks = str(tmp_path / 'tasks.json')
+    backend.write(tasks, [{'id': 't1', 'title': 'base'}])
+    backend.write_records(tasks, [{'id': 't1', 'title': 'edited'}], [])
+    backend.write_records(tasks, [{'id': 't2', 'title': 'added'}], [])
+    backend.write_records(tasks, [{'id': 't3', 'title': 'torn'}], ['t1'])
+
+    journal = backend.journal_path(tasks)
+    with open(journal, 'rb+') as f:
+        f.truncate(os.path.getsize(journal) - 10)
+
+    assert backend.read(tasks) == [{'id': 't1', 'title': 'edited'}, {'id': 't2', 'title': 'added'}]
+
+
+def test_truncated_base_is_restored_from_journal(backend, tmp_path, monkeypatch):
+    for name in ('DATABASE_PATH', 'QUARANTINE_PATH', 'BACKUP_PATH'):
+        monkeypatch.setattr(Config, name, str(tmp_path / name.lower()))
+    os.makedirs(Config.DATABASE_PATH)
+    cache = CollectionCache(backend)
+    monkeypatch.setattr(integrity, 'collection_cache', cache)
+
+    tasks = os.path.join(Config.DATABASE_PATH, 'tasks.json')
+    backend.write(tasks, [{'id': 't1', 'title': 'base'}])
+    backend.write_records(tasks, [{'id': 't1', 'title': 'edited'}, {'id': 't2', 'title': 'added'}], [])
+    backend.write_records(tasks, [], ['t2'])
+    with open(tasks, 'rb+') as f:
+        f.truncate(os.path.getsize(tasks) // 2)
+
+    # Поврежденный снимок уходит в карантин вместе со своим журналом
+    assert backend.read(tasks) == []
+    assert integrity.quarantined_collections() == [tasks]
+
+    # Резервных копий нет: данные восстанавливаются из журнала карантина
+    assert integrity.restore_collection(tasks) is False
+    assert backend.read(tasks) == [{'id': 't1', 'title': 'edited'}]
+    assert integrity.quarantined_collections() == []
+
+
+def test_cache_revalidates_by_file_signature(cache, backend, tmp_path, monkeypatch):
+    projects = str(tmp_path / 'projects.json')
+    backend.write(projects, [{'id': 'p1', 'name': 'old', 'team': ['u1', 'u2']}])
+    reads = _count_reads(backend, monkeypatch)
+
+    data = cache.get(projects)
+    assert cache.get(projects) is data
+    assert cache.index(projects).get('p1') is data[0]
+    assert [p['id'] for p in cache.index(projects).filter('team', 'u2')] == ['p1']
+    assert reads == [projects]
+    with pytest.raises(TypeError):
+        data[0]['name'] = 'changed'
+
+    # Файл переписан другим процессом: снимок перечитывается при следующем обращении
+    JsonBackend(backend.transactions_path).write(projects, [{'id': 'p1', 'name': 'new', 'team': []}])
+    assert cache.get(projects)[0]['name'] == 'new'
+    assert cache.index(projects).filter('team', 'u2') == ()
+    assert reads == [projects, projects]
+
+
+def test_cache_keeps_own_writes_without_reparsing(cache, backend, tmp_path, monkeypatch):
+    projects = str(tmp_path / 'projects.json')
+    reads = _count_reads(backend, monkeypatch)
+
+    cache.save(projects, [{'id': 'p1', 'name': 'saved'}])
+    cache.save_records(projects, upserts=[{'id': 'p2', 'name': 'added'}])
+    assert [p['name'] for p in cache.get(projects)] == ['saved', 'added']
+    assert reads == []
+    assert backend.read(projects) == [{'id': 'p1', 'name': 'saved'}, {'id': 'p2', 'name': 'added'}]
+
+
+def test_record_writes_append_to_journal(backend, tmp_path):
+    tasks = str(tmp_path / 'tasks.json')
+    backend.write(tasks, [{'id': 't1', 'title': 'base'}, {'id': 't2', 'title': 'second'}])
+    snapshot = os.stat(tasks)
+
+    backend.write_records(tasks, [{'id': 't1', 'title': 'edited'}, {'id': 't3', 'title': 'added'}], [])
+    backend.write_records(tasks, [], ['t2'])
+
+    # Снимок не переписывается: изменения только дописываются в журнал
+    assert (os.stat(tasks).st_ino, os.stat(tasks).st_mtime_ns) == (snapshot.st_ino, snapshot.st_mtime_ns)
+    with open(backend.journal_path(tasks), encoding='utf-8') as f:
+        assert len(f.readlines()) == 3
+    assert backend.read(tasks) == [{'id': 't1', 'title': 'edited'}, {'id': 't3', 'title': 'added'}]
+
+
+def test_large_journal_is_compacted(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'JOURNAL_MAX_BYTES', 200)
+    tasks = str(tmp_path / 'tasks.json')
+    journal = backend.journal_path(tasks)
+    backend.write(tasks, [{'id': 't1', 'count': 0}])
+
+    snapshots = {os.stat(tasks).st_ino}
+    for count in range(1, 20):
+        backend.write_records(tasks, [{'id': 't1', 'count': count}], [])
+        snapshots.add(os.stat(tasks).st_ino)
+        assert not os.path.exists(journal) or os.path.getsize(journal) <= 200
+
+    # Журнал несколько раз переносился в новый снимок
+    assert len(snapshots) > 1
+    assert backend.read(tasks) == [{'id': 't1', 'count': 19}]
+    backend.compact(tasks)
+    assert not os.path.exists(journal)
+    with open(tasks, 'rb') as f:
+        assert serializer.loads(f.read()) == [{'id': 't1', 'count': 19}]
+
+
+def test_journal_of_replaced_snapshot_is_ignored(backend, tmp_path):
+    tasks = str(tmp_path / 'tasks.json')
+    backend.write(tasks, [{'id': 't1', 'title': 'base'}])
+    backend.write_records(tasks, [{'id': 't2', 'title': 'journaled'}], [])
+
+    # Снимок заменен в обход бэкенда (например, восстановлен из копии): журнал к нему не относится
+    os.replace(tasks, tasks + '.old')
+    with open(tasks, 'w', encoding='utf-8') as f:
+        f.write('[{"id": "t9", "title": "restored"}]')
+
+    assert backend.read(tasks) == [{'id': 't9', 'title': 'restored'}]
+    backend.write_records(tasks, [{'id': 't10', 'title': 'new'}], [])
+    assert backend.read(tasks) == [{'id': 't9', 'title': 'restored'}, {'id': 't10', 'title': 'new'}]
+
+
+def test_streaming_read_applies_journal(backend, tmp_path, monkeypatch):
+    tasks = str(tmp_path / 'tasks.json')
+    backend.write(tasks, [{'id': f't{n}', 'title': 'base'} for n in range(5)])
+    backend.write_records(tasks, [{'id': 't1', 'title': 'edited'}, {'id': 't9', 'title': 'added'}], ['t2'])
+    backend.write_records(tasks, [{'id': 't2', 'title': 'again'}], ['t4'])
+
+    monkeypatch.setattr(Config, 'STREAMING_READ_BYTES', 10 ** 9)
+    assert not backend.streamed(tasks)
+    monkeypatch.setattr(Config, 'STREAMING_READ_BYTES', 1)
+    assert backend.streamed(tasks)
+    assert list(backend.iter_read(tasks)) == backend.read(tasks) == [
+        {'id': 't0', 'title': 'base'}, {'id': 't1', 'title': 'edited'}, {'id': 't3', 'title': 'base'},
+        {'id': 't9', 'title': 'added'}, {'id': 't2', 'title': 'again'}]
+
+    # Перебор видит состояние на момент начала, даже если коллекция переписана
+    records = backend.iter_read(tasks)
+    backend.write(tasks, [{'id': 'x'}])
+    assert [r['id'] for r in records] == ['t0', 't1', 't3', 't9', 't2']
+    assert list(backend.iter_read(str(tmp_path / 'missing.json'))) == []
+
+
+def test_streaming_read_of_corrupt_snapshot(backend, tmp_path, monkeypatch):
+    for name in ('DATABASE_PATH', 'QUARANTINE_PATH'):
+        monkeypatch.setattr(Config, name, str(tmp_path / name.lower()))
+    os.makedirs(Config.DATABASE_PATH)
+    tasks = os.path.join(Config.DATABASE_PATH, 'tasks.json')
+    with open(tasks, 'w', encoding='utf-8') as f:
+        f.write('[{"id": "t1"}, {"id": ')
+
+    with pytest.raises(serializer.JSONDecodeError):
+        list(backend.iter_read(tasks, strict=True))
+    assert os.path.exists(tasks)
+
+    # Без strict перебор завершается на прочитанных записях, снимок уходит в карантин
+    assert list(backend.iter_read(tasks)) == [{'id': 't1'}]
+    assert not os.path.exists(tasks)
+    assert len(os.listdir(Config.QUARANTINE_PATH)) == 1
@@ -0,0 +1,55 @@
+"""
+Тесты хранилища токенов приглашений (app/tokens.py)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import tokens
+from app.records import DATETIME
+from app.storage import CollectionCache, JsonBackend
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(tokens, 'collection_cache', CollectionCache(JsonBackend(str(tmp_path / 'transactions'))))
+    return tokens.TokenStore(str(tmp_path / 'tokens.json'), ttl_days=30)
+
+
+def test_legacy_invitation_survives_sweep(store):
+    legacy = {'id': 'legacy', 'role': 'worker', 'project_id': None,
+              'created_at': '01.12.2025 10:00:00', 'used': False}
+    used = dict(legacy, id='used', used=True)
+    tokens.collection_cache.save_records(store.filepath, upserts=[legacy, used])
+
+    assert store.sweep(now=datetime(2030, 1, 1)) == 1
+    assert store.validate('legacy')['role'] == 'worker'
+    assert store.validate('used') is None
+
+
+def test_issued_token_expires(store):
+    token_id = store.issue(role='worker', project_id=None)
+    token = store.validate(token_id)
+    expires_at = datetime.strptime(token['expires_at'], DATETIME)
+
+    assert store.sweep(now=expires_at - timedelta(seconds=1)) == 0
+    assert store.sweep(now=expires_at + timedelta(seconds=1)) == 1
+    assert store.validate(token_id) is None
+
+
+def test_consumed_token_is_removed(store):
+    token_id = store.issue(role='manager', project_id=None)
+    store.consume(token_id)
+    assert store.validate(token_id) is None
+    assert tokens.collection_cache.get(store.filepath) == []
+
+
+def test_legacy_display_token_is_not_an_invitation(store):
+    display = {'id': 'display', 'user_id': 'u1', 'project_id': 'p1',
+               'created_at': '01.12.2025 10:00:00', 'used': False}
+    tokens.collection_cache.save_records(store.filepath, upserts=[display])
+
+    assert store.validate('display') is None
+    assert store.sweep() == 1
+    assert tokens.collection_cache.get(store.filepath) == []
@@ -0,0 +1,106 @@
+"""
+Тесты единицы работы запроса (app/unit_of_work.py)
+"""
+
+import pytest
+from flask import Flask, jsonify
+
+from app import unit_of_work, utils
+from app.storage import CollectionCache, JsonBackend, bind_scope, unbind_scope
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = CollectionCache(JsonBackend(str(tmp_path / 'transactions')))
+    monkeypatch.setattr(unit_of_work, 'collection_cache', cache)
+    monkeypatch.setattr(utils, 'collection_cache', cache)
+    return cache
+
+
+@pytest.fixture
+def paths(cache, tmp_path):
+    projects, users = str(tmp_path / 'projects.json'), str(tmp_path / 'users.json')
+    cache.save(projects, [{'id': 'p1', 'team': []}])
+    cache.save(users, [{'id': 'u1', 'projects': []}])
+    return projects, users
+
+
+def _count_transactions(cache, monkeypatch):
+    transactions = []
+    save_transaction = cache.save_transaction
+    monkeypatch.setattr(cache, 'save_transaction',
+                        lambda changes, expected=None: transactions.append(sorted(changes))
+                        or save_transaction(changes, expected=expected))
+    return transactions
+
+
+def test_changes_are_deferred_and_flushed_together(cache, paths, monkeypatch):
+    projects, users = paths
+    transactions = _count_transactions(cache, monkeypatch)
+    work = unit_of_work.UnitOfWork(cache)
+    token = bind_scope(work)
+    try:
+        utils.update_record(projects, 'p1', lambda p: p['team'].append('u1'))
+        utils.update_record(users, 'u1', lambda u: u['projects'].append('p1'))
+        utils.save_record(users, {'id': 'u2', 'projects': []})
+
+        # Изменения видны чтениям запроса, но еще не записаны
+        assert cache.index(projects).get('p1')['team'] == ['u1']
+        assert [u['id'] for u in cache.get(users)] == ['u1', 'u2']
+        assert cache.backend.read(projects) == [{'id': 'p1', 'team': []}]
+        assert work.loads == {projects: 1, users: 1}
+        work.flush()
+    finally:
+        unbind_scope(token)
+
+    assert transactions == [sorted([projects, users])]
+    assert cache.backend.read(projects) == [{'id': 'p1', 'team': ['u1']}]
+    assert cache.backend.read(users) == [{'id': 'u1', 'projects': ['p1']}, {'id': 'u2', 'projects': []}]
+
+
+def test_conflicting_flush_replays_mutations(cache, paths):
+    projects, _ = paths
+    work = unit_of_work.UnitOfWork(cache)
+    token = bind_scope(work)
+    try:
+        utils.update_record(projects, 'p1', lambda p: p['team'].append('u1'))
+        # Другой процесс изменил запись до конца запроса
+        cache.backend.write_records(projects, [{'id': 'p1', 'team': ['u9'], 'status': 'активен'}], [])
+        work.flush()
+    finally:
+        unbind_scope(token)
+
+    assert cache.backend.read(projects) == [{'id': 'p1', 'team': ['u9', 'u1'], 'status': 'активен'}]
+
+
+@pytest.fixture
+def client(cache, paths):
+    projects, users = paths
+    app = Flask(__name__)
+    unit_of_work.init_app(app)
+
+    @app.route('/join/<status>')
+    def join(status):
+        utils.update_record(projects, 'p1', lambda p: p['team'].append('u1'))
+        utils.update_record(users, 'u1', lambda u: u['projects'].append('p1'))
+        if status == 'fail':
+            raise RuntimeError('ошибка обработки')
+        return jsonify(team=cache.index(projects).get('p1')['team']), int(status)
+
+    return app.test_client()
+
+
+def test_request_flushes_on_success(client, cache, paths):
+    projects, users = paths
+    response = client.get('/join/200')
+    assert response.get_json() == {'team': ['u1']}
+    assert cache.backend.read(projects) == [{'id': 'p1', 'team': ['u1']}]
+    assert cache.backend.read(users) == [{'id': 'u1', 'projects': ['p1']}]
+
+
+@pytest.mark.parametrize('status', ['500', 'fail'])
+def test_failed_request_discards_changes(client, cache, paths, status):
+    projects, users = paths
+    assert client.get(f'/join/{status}').status_code == 500
+    assert cache.backend.read(projects) == [{'id': 'p1', 'team': []}]
+    assert cache.backend.read(users) == [{'id': 'u1', 'projects': []}]
@@ -0,0 +1,55 @@
+"""
+Тесты изменения записей по схеме чтение-изменение-запись (app/utils.py)
+"""
+
+import threading
+
+import pytest
+
+from app import utils
+from app.storage import CollectionCache, JsonBackend
+
+
+@pytest.fixture
+def tasks(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'collection_cache', CollectionCache(JsonBackend(str(tmp_path / 'transactions'))))
+    filepath = str(tmp_path / 'tasks.json')
+    utils.collection_cache.save(filepath, [{'id': 't1', 'title': 'old', 'status': 'new', 'count': 0}])
+    return filepath
+
+
+def test_concurrent_update_is_merged(tasks):
+    calls = []
+
+    def rename(record):
+        calls.append(dict(record))
+        if len(calls) == 1:
+            # Параллельный запрос успевает изменить другое поле той же записи
+            concurrent = dict(record, status='done')
+            utils.collection_cache.save_records(tasks, upserts=[concurrent])
+        record['title'] = 'new'
+
+    saved = utils.update_record(tasks, 't1', rename)
+
+    assert len(calls) == 2
+    assert calls[1]['status'] == 'done'
+    assert saved['title'] == 'new' and saved['status'] == 'done'
+    assert utils.collection_cache.index(tasks).get('t1')['status'] == 'done'
+    assert utils.collection_cache.index(tasks).get('t1')['title'] == 'new'
+
+
+def test_parallel_updates_are_not_lost(tasks):
+    def increment(record):
+        record['count'] += 1
+
+    def worker():
+        for _ in range(5):
+            utils.update_record(tasks, 't1', increment)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert utils.collection_cache.index(tasks).get('t1')['count'] == 40